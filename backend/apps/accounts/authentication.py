@@ -0,0 +1,154 @@
+"""
+JWT аутентификация без загрузки полной модели пользователя на каждый запрос.
+
+request.user - ClaimsUser: id и username берутся из claims токена
+(apps.accounts.tokens). Признаки доступа (is_active, is_staff, is_superuser)
+из токена не берутся: отключение пользователя или снятие прав действует
+сразу, а не после истечения access токена. Они читаются из общего кеша
+(CACHE_IS_SHARED), который сбрасывается при сохранении пользователя
+(apps.accounts.signals), а без общего кеша - из БД одним запросом только
+этих колонок, без загрузки модели и подписки.
+
+Полная модель User загружается лениво, только если view обращается к другим
+атрибутам или использует пользователя в запросах ORM, и всегда из БД: view
+изменяют и сохраняют пользователя и его подписку, поэтому общие копии
+между запросами не хранятся.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+KEY_PREFIX = 'auth:flags'
+
+# Признаки доступа, которые проверяются на каждый запрос
+ACCESS_FLAGS = ('is_active', 'is_staff', 'is_superuser')
+
+
+def get_flags_cache():
+    """Кеш признаков доступа; None, если кеш не общий для процессов (сброс не дошел бы до них)"""
+    if not getattr(settings, 'CACHE_IS_SHARED', False):
+        return None
+    return caches[getattr(settings, 'AUTH_USER_FLAGS_CACHE_ALIAS', 'default')]
+
+
+def _flags_key(user_id):
+    return f'{KEY_PREFIX}:{user_id}'
+
+
+def get_user_flags(user_id):
+    """Признаки доступа пользователя {flag: value} из общего кеша или БД; None, если его нет"""
+    cache = get_flags_cache()
+    if cache is not None:
+        flags = cache.get(_flags_key(user_id))
+        if flags is not None:
+            return dict(zip(ACCESS_FLAGS, flags))
+
+    flags = get_user_model().objects.filter(
+        **{api_settings.USER_ID_FIELD: user_id}
+    ).values_list(*ACCESS_FLAGS).first()
+    if flags is None:
+        return None
+
+    if cache is not None:
+        cache.set(_flags_key(user_id), flags, getattr(settings, 'AUTH_USER_FLAGS_CACHE_TIMEOUT', 300))
+    return dict(zip(ACCESS_FLAGS, flags))
+
+
+def invalidate_user(user_id):
+    cache = get_flags_cache()
+    if cache is not None:
+        cache.delete(_flags_key(user_id))
+
+
+def load_user(user_id):
+    """Пользователь с подпиской из БД"""
+    user = get_user_model().objects.select_related('subscription').filter(
+        **{api_settings.USER_ID_FIELD: user_id}
+    ).first()
+    if user is None:
+        raise AuthenticationFailed('User not found', code='user_not_found')
+    return user
+
+
+class ClaimsUser(SimpleLazyObject):
+    """
+    Пользователь из claims токена. Атрибуты, которых нет в claims,
+    загружают полную модель User (load_user) и берутся из нее.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, token):
+        # simplejwt хранит ID строкой; приводим к типу первичного ключа
+        user_id = get_user_model()._meta.pk.to_python(token[api_settings.USER_ID_CLAIM])
+        super().__init__(lambda: load_user(user_id))
+        # Атрибуты LazyObject задаются через __dict__, иначе они уйдут в модель
+        self.__dict__['token'] = token
+        self.__dict__['_user_id'] = user_id
+        self.__dict__['_flags'] = None
+
+    def __bool__(self):
+        return True
+
+    def _claim(self, name):
+        """
+        Значение из claims; из модели, если она уже загружена или claim нет
+        (токен выпущен до появления claims)
+        """
+        if self._wrapped is empty and name in self.token:
+            return self.token[name]
+        if self._wrapped is empty:
+            self._setup()
+        return getattr(self._wrapped, name)
+
+    def _flag(self, name):
+        """Признак доступа: из загруженной модели, иначе из общего кеша или БД (get_user_flags)"""
+        if self._wrapped is empty:
+            if self._flags is None:
+                flags = get_user_flags(self._user_id)
+                if flags is None:
+                    raise AuthenticationFailed('User not found', code='user_not_found')
+                self.__dict__['_flags'] = flags
+            return self._flags[name]
+        return getattr(self._wrapped, name)
+
+    @property
+    def id(self):
+        return self._user_id
+
+    @property
+    def pk(self):
+        return self._user_id
+
+    @property
+    def username(self):
+        return self._claim('username')
+
+    @property
+    def is_active(self):
+        return self._flag('is_active')
+
+    @property
+    def is_staff(self):
+        return self._flag('is_staff')
+
+    @property
+    def is_superuser(self):
+        return self._flag('is_superuser')
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication, возвращающая ClaimsUser вместо загрузки User из БД"""
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        user = ClaimsUser(validated_token)
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
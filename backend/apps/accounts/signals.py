@@ -0,0 +1,17 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_user
+from .models import User
+
+
+# Сброс признаков доступа в кеше аутентификации (apps.accounts.authentication).
+# Повторно после коммита: иначе параллельный запрос успел бы закешировать
+# значения, прочитанные до коммита
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    user_id = instance.pk
+    invalidate_user(user_id)
+    transaction.on_commit(lambda: invalidate_user(user_id))
@@ -1,3 +1,115 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.subscribe.models import Subscription, SubscriptionPlan
+
+from .models import User
+from .tokens import UserClaimsRefreshToken
+
+
+def create_user(username, **kwargs):
+    return User.objects.create(email=f'{username}@example.com', username=username, **kwargs)
+
+
+def token_client(user):
+    client = APIClient()
+    access = UserClaimsRefreshToken.for_user(user).access_token
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+    return client
+
+
+class ClaimsAuthenticationTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def get(self, client, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        return response.status_code, len(queries)
+
+    def test_token_carries_only_identity_claims(self):
+        access = UserClaimsRefreshToken.for_user(create_user('reader')).access_token
+
+        self.assertEqual(access['username'], 'reader')
+        for claim in ('is_staff', 'is_superuser', 'subscription_active', 'subscription_end'):
+            self.assertNotIn(claim, access)
+
+    def test_deactivated_user_is_rejected_with_valid_token(self):
+        for shared in (False, True):
+            with self.subTest(shared_cache=shared), override_settings(CACHE_IS_SHARED=shared):
+                user = create_user(f'reader_{shared}')
+                client = token_client(user)
+                self.assertEqual(self.get(client, '/api/v1/auth/profile/')[0], 200)
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    user.is_active = False
+                    user.save()
+
+                self.assertEqual(self.get(client, '/api/v1/auth/profile/')[0], 401)
+
+    def test_revoked_staff_loses_admin_access(self):
+        for shared in (False, True):
+            with self.subTest(shared_cache=shared), override_settings(CACHE_IS_SHARED=shared):
+                admin = create_user(f'admin_{shared}', is_staff=True)
+                client = token_client(admin)
+                self.assertEqual(self.get(client, '/api/v1/payment/analytics/')[0], 200)
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    admin.is_staff = False
+                    admin.save()
+
+                self.assertEqual(self.get(client, '/api/v1/payment/analytics/')[0], 403)
+
+    @override_settings(CACHE_IS_SHARED=True)
+    def test_shared_cache_checks_flags_without_queries(self):
+        client = token_client(create_user('reader'))
+
+        _, first = self.get(client, '/api/v1/subscribe/plans/')
+        status, second = self.get(client, '/api/v1/subscribe/plans/')
+
+        self.assertEqual(status, 200)
+        # Признаки доступа прочитаны из БД один раз, дальше - из кеша
+        self.assertEqual(first - second, 1)
+
+    def test_default_cache_checks_flags_with_one_light_query(self):
+        url = '/api/v1/subscribe/plans/'
+        client = token_client(create_user('reader'))
+
+        with CaptureQueriesContext(connection) as anonymous:
+            APIClient().get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        # Без общего кеша - один запрос признаков доступа, без модели и подписки
+        self.assertEqual(len(queries) - len(anonymous), 1)
+        user_queries = [query['sql'] for query in queries if 'FROM "users"' in query['sql']]
+        self.assertEqual(len(user_queries), 1)
+        self.assertNotIn('subscriptions', user_queries[0])
+        self.assertNotIn('password', user_queries[0])
+
+    def test_views_save_fresh_subscription(self):
+        plan = SubscriptionPlan.objects.create(name='Plan', price=10, stripe_price_id='price_1')
+        user = create_user('subscriber')
+        Subscription.objects.create(
+            user=user, plan=plan, status='active',
+            start_date=timezone.now(), end_date=timezone.now() + timedelta(days=30)
+        )
+        client = token_client(user)
+        self.assertEqual(self.get(client, '/api/v1/subscribe/status/')[0], 200)
+
+        # Другой процесс продлил подписку между запросами
+        extended = timezone.now() + timedelta(days=60)
+        Subscription.objects.filter(user=user).update(end_date=extended)
+
+        self.assertEqual(client.post('/api/v1/subscribe/cancel/').status_code, 200)
+
+        subscription = Subscription.objects.get(user=user)
+        self.assertEqual((subscription.status, subscription.end_date), ('cancelled', extended))
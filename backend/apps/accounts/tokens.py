@@ -0,0 +1,43 @@
+"""
+JWT с данными пользователя в claims.
+
+В токен записывается username, чтобы аутентификация
+(apps.accounts.authentication) не загружала пользователя из БД на каждый
+запрос. Claims обновляются из БД при каждом обновлении access токена.
+Признаки доступа (is_active, is_staff) в токен не пишутся: они проверяются
+на каждый запрос, а не раз в ACCESS_TOKEN_LIFETIME.
+"""
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+def set_user_claims(token, user):
+    """Записывает в токен claims пользователя"""
+    token['username'] = user.username
+
+
+class UserClaimsRefreshToken(RefreshToken):
+    """Refresh токен, передающий claims пользователя в access токены"""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        set_user_claims(token, user)
+        return token
+
+    @property
+    def access_token(self):
+        # Claims обновляются при выпуске каждого access токена
+        User = get_user_model()
+        user = User.objects.only('username').filter(
+            **{api_settings.USER_ID_FIELD: self.payload.get(api_settings.USER_ID_CLAIM)}
+        ).first()
+        if user is not None:
+            set_user_claims(self, user)
+        return super().access_token
+
+
+class UserClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = UserClaimsRefreshToken
@@ -5,6 +5,7 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import login
 
 from .models import User
+from .tokens import UserClaimsRefreshToken
 from .serializers import (
     UserRegistrationSerializer,
     UserLoginSerializer,
@@ -25,7 +26,7 @@ class RegisterView(generics.CreateAPIView):
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
 
-        refresh = RefreshToken.for_user(user)
+        refresh = UserClaimsRefreshToken.for_user(user)
 
         return Response({
             'user': UserProfileSerializer(user).data,
@@ -46,7 +47,7 @@ class LoginView(generics.GenericAPIView):
         user = serializer.validated_data['user']
 
         login(request, user)
-        refresh = RefreshToken.for_user(user)
+        refresh = UserClaimsRefreshToken.for_user(user)
 
         return Response({
             'user': UserProfileSerializer(user).data,
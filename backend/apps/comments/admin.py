@@ -49,13 +49,13 @@ class CommentAdmin(admin.ModelAdmin):
     actions = ['make_active', 'make_inactive']
 
     def make_active(self, request, queryset):
-        updated = queryset.update(is_active=True)
+        updated = queryset.set_active(True)
         self.message_user(request, f'{updated} comments were marked as active.')
 
     make_active.short_description = "Mark selected comments as active"
 
     def make_inactive(self, request, queryset):
-        updated = queryset.update(is_active=False)
+        updated = queryset.set_active(False)
         self.message_user(request, f'{updated} comments were marked as inactive.')
 
     make_inactive.short_description = "Mark selected comments as inactive"
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""
+Денормализованные счетчики комментариев.
+
+Post.active_comments_count и Comment.active_replies_count обновляются
+инкрементально в той же транзакции, что и изменение комментария,
+одним UPDATE на каждую группу строк с одинаковым приростом.
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+
+def _apply_deltas(model, field, deltas):
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if pk is not None and delta:
+            by_delta[delta].append(pk)
+
+    for delta, pks in by_delta.items():
+        model.objects.filter(pk__in=pks).update(
+            **{field: Greatest(F(field) + delta, 0)}
+        )
+
+
+def update_comment_counters(changes):
+    """
+    Применяет изменения счетчиков.
+    changes - последовательность (post_id, parent_id, delta), где delta = +1/-1
+    для каждого активированного/деактивированного комментария.
+    """
+    from apps.main.models import Post
+    from .models import Comment
+
+    post_deltas = Counter()
+    parent_deltas = Counter()
+    for post_id, parent_id, delta in changes:
+        post_deltas[post_id] += delta
+        parent_deltas[parent_id] += delta
+
+    _apply_deltas(Post, 'active_comments_count', post_deltas)
+    _apply_deltas(Comment, 'active_replies_count', parent_deltas)
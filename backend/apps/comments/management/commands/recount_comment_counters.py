@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from apps.comments.models import Comment
+from apps.main.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized comment and reply counters in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of rows processed per query',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        fixed_posts = self._recount(
+            Post.objects.all(),
+            'active_comments_count',
+            Post.objects.active_comments_subquery(),
+            chunk_size
+        )
+        self.stdout.write(f'Posts fixed: {fixed_posts}')
+
+        fixed_comments = self._recount(
+            Comment.objects.all(),
+            'active_replies_count',
+            Comment.objects.active_replies_subquery(),
+            chunk_size
+        )
+        self.stdout.write(f'Comments fixed: {fixed_comments}')
+
+        self.stdout.write(self.style.SUCCESS('Counters recomputed'))
+
+    def _recount(self, queryset, field, actual, chunk_size):
+        """
+        Сверяет счетчик с точным значением по диапазонам pk и исправляет расхождения.
+        Значение пересчитывается подзапросом внутри самого UPDATE, а не переносится
+        из прочитанных данных, поэтому не затирает инкременты, сделанные после чтения.
+        """
+        fixed = 0
+        last_pk = 0
+
+        while True:
+            pks = list(
+                queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not pks:
+                break
+            last_pk = pks[-1]
+
+            fixed += queryset.filter(pk__in=pks).alias(actual=actual).exclude(
+                **{field: F('actual')}
+            ).update(**{field: actual})
+
+        return fixed
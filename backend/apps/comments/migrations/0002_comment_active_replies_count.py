@@ -0,0 +1,30 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_active_replies_count(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+
+    active_replies = Comment.objects.filter(
+        parent=OuterRef('pk'),
+        is_active=True
+    ).order_by().values('parent').annotate(count=Count('pk')).values('count')
+
+    Comment.objects.update(active_replies_count=Coalesce(Subquery(active_replies), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='active_replies_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_active_replies_count, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,57 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 
+from .counters import update_comment_counters
+
+
+class CommentQuerySet(models.QuerySet):
+    """QuerySet комментариев с массовыми операциями, учитывающими счетчики"""
+
+    def with_counts(self):
+        """Добавляет точное количество активных ответов одним подзапросом"""
+        return self.annotate(annotated_replies_count=self.active_replies_subquery())
+
+    @staticmethod
+    def active_replies_subquery():
+        """Выражение: точное количество активных ответов комментария (OuterRef('pk'))"""
+        active_replies = Comment.objects.filter(
+            parent=models.OuterRef('pk'),
+            is_active=True
+        ).order_by().values('parent').annotate(
+            count=models.Count('pk')
+        ).values('count')
+
+        return models.functions.Coalesce(models.Subquery(active_replies), 0)
+
+    def set_active(self, is_active):
+        """
+        Массово меняет is_active и корректирует счетчики постов и ответов.
+        Возвращает количество измененных комментариев.
+        """
+        with transaction.atomic():
+            changed = list(
+                self.filter(is_active=not is_active).select_for_update().values_list(
+                    'pk', 'post_id', 'parent_id'
+                )
+            )
+            if not changed:
+                return 0
+
+            Comment.objects.filter(pk__in=[pk for pk, _, _ in changed]).update(
+                is_active=is_active
+            )
+
+            delta = 1 if is_active else -1
+            update_comment_counters(
+                (post_id, parent_id, delta) for _, post_id, parent_id in changed
+            )
+
+        # update() не отправляет сигналы, поэтому сбрасываем кеш ответов явно
+        from apps.main.cache import invalidate
+        invalidate('comments')
+
+        return len(changed)
+
 
 class Comment(models.Model):
     """Модель комментария"""
@@ -23,9 +74,12 @@ class Comment(models.Model):
     )
     content = models.TextField()
     is_active = models.BooleanField(default=True)
+    active_replies_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
         db_table = 'comments'
         verbose_name = 'Comment'
@@ -40,10 +94,44 @@ class Comment(models.Model):
     def __str__(self):
         return f'Comment by {self.author.username} on {self.post.title}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем загруженный статус, чтобы save() мог скорректировать счетчики
+        instance._loaded_is_active = instance.__dict__.get('is_active')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Сохраняет комментарий и обновляет счетчики при смене is_active"""
+        adding = self._state.adding
+        previous = getattr(self, '_loaded_is_active', None)
+
+        with transaction.atomic():
+            delta = 0
+            if adding:
+                delta = 1 if self.is_active else 0
+            elif previous is not None and previous != self.is_active:
+                # Условный UPDATE: при одновременном удалении (или восстановлении)
+                # комментария счетчики меняет только тот запрос, что изменил строку
+                changed = Comment.objects.filter(pk=self.pk, is_active=previous).update(
+                    is_active=self.is_active
+                )
+                if changed:
+                    delta = 1 if self.is_active else -1
+
+            super().save(*args, **kwargs)
+
+            if delta:
+                update_comment_counters([(self.post_id, self.parent_id, delta)])
+
+        self._loaded_is_active = self.is_active
+
     @property
     def replies_count(self):
-        return self.replies.filter(is_active=True).count()
+        if hasattr(self, 'annotated_replies_count'):
+            return self.annotated_replies_count
+        return self.active_replies_count
 
     @property
     def is_reply(self):
-        return self.parent is not None
\ No newline at end of file
+        return self.parent_id is not None
\ No newline at end of file
@@ -72,7 +72,17 @@ class CommentDetailSerializer(CommentSerializer):
         fields = CommentSerializer.Meta.fields + ['replies']
 
     def get_replies(self, obj):
-        if obj.parent is None:  # Показываем ответы только для основных комментариев
+        # Дерево уже загружено CommentTree - сериализуем без запросов к БД
+        # Ответы без загруженных вложенных ответов - прежним CommentSerializer
+        if hasattr(obj, 'tree_replies'):
+            return [
+                (CommentDetailSerializer if hasattr(reply, 'tree_replies') else CommentSerializer)(
+                    reply, context=self.context
+                ).data
+                for reply in obj.tree_replies
+            ]
+
+        if obj.parent_id is None:  # Показываем ответы только для основных комментариев
             replies = obj.replies.filter(is_active=True).order_by('created_at')
             return CommentSerializer(replies, many=True, context=self.context).data
         return []
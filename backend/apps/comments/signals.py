@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .counters import update_comment_counters
+from .models import Comment
+
+
+@receiver(post_delete, sender=Comment)
+def comment_post_delete(sender, instance, **kwargs):
+    """Уменьшает счетчики при физическом удалении активного комментария"""
+    if instance.is_active:
+        update_comment_counters([(instance.post_id, instance.parent_id, -1)])
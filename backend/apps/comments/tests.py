@@ -1,3 +1,139 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from apps.main.models import Category, Post
+
+from .models import Comment
+
+
+class CommentCountersTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='author@example.com', username='author')
+        cls.post = Post.objects.create(
+            title='Post', slug='post', content='text', author=cls.user,
+            category=Category.objects.create(name='News')
+        )
+
+    def setUp(self):
+        self.comment = Comment.objects.create(post=self.post, author=self.user, content='text')
+        self.reply = Comment.objects.create(
+            post=self.post, author=self.user, content='reply', parent=self.comment
+        )
+
+    def assertCounters(self, comments, replies):
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual(self.post.active_comments_count, comments)
+        self.assertEqual(self.comment.active_replies_count, replies)
+
+    def test_create_and_soft_delete(self):
+        self.assertCounters(2, 1)
+
+        self.reply.is_active = False
+        self.reply.save()
+
+        self.assertCounters(1, 0)
+
+    def test_concurrent_soft_delete_decrements_once(self):
+        # Два запроса загрузили активный ответ и оба его удаляют
+        first = Comment.objects.get(pk=self.reply.pk)
+        second = Comment.objects.get(pk=self.reply.pk)
+        for instance in (first, second):
+            instance.is_active = False
+            instance.save()
+
+        self.assertCounters(1, 0)
+
+    def test_restore_after_soft_delete(self):
+        self.reply.is_active = False
+        self.reply.save()
+        self.reply.is_active = True
+        self.reply.save()
+
+        self.assertCounters(2, 1)
+
+    def test_set_active(self):
+        self.assertEqual(Comment.objects.filter(pk=self.reply.pk).set_active(False), 1)
+        self.assertEqual(Comment.objects.filter(pk=self.reply.pk).set_active(False), 0)
+
+        self.assertCounters(1, 0)
+
+    def test_recount_fixes_drift_with_one_update_per_chunk(self):
+        Post.objects.update(active_comments_count=10)
+        Comment.objects.update(active_replies_count=5)
+
+        out = StringIO()
+        # Комментарии: SELECT pk чанка + UPDATE и завершающий SELECT, посты - так же
+        with self.assertNumQueries(6):
+            call_command('recount_comment_counters', stdout=out)
+
+        self.assertIn('Posts fixed: 1', out.getvalue())
+        self.assertIn('Comments fixed: 2', out.getvalue())
+        self.assertCounters(2, 1)
+
+    def test_recount_keeps_correct_counters(self):
+        out = StringIO()
+        call_command('recount_comment_counters', stdout=out)
+
+        self.assertIn('Posts fixed: 0', out.getvalue())
+        self.assertIn('Comments fixed: 0', out.getvalue())
+
+
+class PostCommentsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='author@example.com', username='author')
+        cls.post = Post.objects.create(
+            title='Post', slug='post', content='text', author=cls.user,
+            category=Category.objects.create(name='News')
+        )
+        cls.root = Comment.objects.create(post=cls.post, author=cls.user, content='root')
+        cls.reply = Comment.objects.create(
+            post=cls.post, author=cls.user, content='reply', parent=cls.root
+        )
+        cls.nested = Comment.objects.create(
+            post=cls.post, author=cls.user, content='nested', parent=cls.reply
+        )
+
+    def get(self, query=''):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(f'/api/v1/comments/post/{self.post.pk}/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.data['comments'], len(queries)
+
+    def test_replies_keep_previous_shape(self):
+        comments, _ = self.get()
+
+        self.assertEqual([c['id'] for c in comments], [self.root.pk])
+        reply = comments[0]['replies'][0]
+        self.assertEqual(reply['id'], self.reply.pk)
+        self.assertNotIn('replies', reply)
+        self.assertEqual(reply['replies_count'], 1)
+
+    def test_depth_nests_replies(self):
+        comments, _ = self.get('?depth=2')
+
+        reply = comments[0]['replies'][0]
+        self.assertEqual([c['id'] for c in reply['replies']], [self.nested.pk])
+        self.assertNotIn('replies', reply['replies'][0])
+
+    def test_query_count_does_not_depend_on_comments(self):
+        for query in ('', '?limit=10'):
+            with self.subTest(query=query):
+                _, before = self.get(query)
+                for i in range(5):
+                    root = Comment.objects.create(post=self.post, author=self.user, content=f'{i}')
+                    Comment.objects.create(post=self.post, author=self.user, content='r', parent=root)
+                comments, after = self.get(query)
 
-# Create your tests here.
+                self.assertEqual(before, after)
+                self.assertTrue(all(c['replies'] for c in comments))
@@ -0,0 +1,93 @@
+"""
+Загрузка дерева комментариев поста без N+1.
+
+Без пагинации все активные комментарии поста выбираются одним запросом
+и раскладываются по родителям за O(n). С пагинацией корневые комментарии
+выбираются keyset-страницей, а ответы - одним запросом на уровень глубины.
+"""
+from collections import defaultdict
+
+from apps.main.pagination import decode_cursor, keyset_cursor, keyset_filter
+
+from .models import Comment
+
+ROOT_ORDERING = ('-created_at', '-id')
+REPLY_ORDERING = ('created_at', 'id')
+
+
+class CommentTree:
+    """Дерево активных комментариев поста"""
+
+    def __init__(self, post, max_depth=None, limit=None, cursor=None):
+        self.post = post
+        self.max_depth = max_depth
+        self.limit = limit
+        self.cursor = cursor
+
+    def _base_queryset(self):
+        return Comment.objects.filter(
+            post=self.post,
+            is_active=True
+        ).select_related('author')
+
+    def load(self):
+        """
+        Возвращает (roots, next_cursor). У каждого загруженного комментария
+        заполнен атрибут tree_replies - список ответов в порядке создания.
+        """
+        if self.limit is None:
+            roots, children = self._load_all()
+            next_cursor = None
+        else:
+            roots, children = self._load_page()
+            next_cursor = None
+            if roots and len(roots) == self.limit:
+                next_cursor = keyset_cursor(roots[-1], ROOT_ORDERING)
+
+        self._attach(roots, children)
+        return roots, next_cursor
+
+    def _load_all(self):
+        """Все комментарии поста одним запросом"""
+        children = defaultdict(list)
+        for comment in self._base_queryset().order_by(*REPLY_ORDERING):
+            children[comment.parent_id].append(comment)
+
+        roots = children.pop(None, [])
+        roots.reverse()
+        return roots, children
+
+    def _load_page(self):
+        """Страница корневых комментариев и их ответы по уровням"""
+        roots_queryset = self._base_queryset().filter(parent=None)
+        values = decode_cursor(self.cursor, ROOT_ORDERING, Comment)
+        if values is not None:
+            roots_queryset = roots_queryset.filter(keyset_filter(ROOT_ORDERING, values))
+        roots = list(roots_queryset.order_by(*ROOT_ORDERING)[:self.limit])
+
+        children = defaultdict(list)
+        frontier = [root.pk for root in roots]
+        depth = 0
+        while frontier and (self.max_depth is None or depth < self.max_depth):
+            level = list(
+                self._base_queryset().filter(parent_id__in=frontier).order_by(*REPLY_ORDERING)
+            )
+            for comment in level:
+                children[comment.parent_id].append(comment)
+            frontier = [comment.pk for comment in level]
+            depth += 1
+
+        return roots, children
+
+    def _attach(self, roots, children):
+        """Раскладывает ответы по родителям с учетом ограничения глубины"""
+        stack = [(root, 0) for root in roots]
+        while stack:
+            comment, depth = stack.pop()
+            if self.max_depth is not None and depth >= self.max_depth:
+                # Ответы на последнем уровне сериализуются без вложенных ответов
+                if depth == 0:
+                    comment.tree_replies = []
+                continue
+            comment.tree_replies = children.get(comment.pk, [])
+            stack.extend((reply, depth + 1) for reply in comment.tree_replies)
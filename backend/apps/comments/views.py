@@ -12,6 +12,7 @@ from .serializers import (
     CommentDetailSerializer
 )
 from .permissions import IsAuthorOrReadOnly
+from .tree import CommentTree
 from apps.main.models import Post
 
 
@@ -74,14 +75,18 @@ def post_comments(request, post_id):
     """Получить комментарий к определенному посту"""
     post = get_object_or_404(Post, id=post_id, status='published')
 
-    # Получаем только основные комментарии
-    comments = Comment.objects.filter(
-        post=post,
-        parent=None,
-        is_active=True
-    ).select_related('author').prefetch_related(
-        'replies__author'
-    ).order_by('-created_at')
+    # Глубина ответов (по умолчанию только прямые ответы) и keyset-пагинация корней
+    depth = request.query_params.get('depth', '1')
+    max_depth = min(int(depth), 10) if depth.isdigit() else 1
+    limit = request.query_params.get('limit')
+    limit = min(int(limit), 100) if limit and limit.isdigit() else None
+
+    comments, next_cursor = CommentTree(
+        post,
+        max_depth=max_depth,
+        limit=limit,
+        cursor=request.query_params.get('cursor')
+    ).load()
 
     serializer = CommentDetailSerializer(comments, many=True, context={'request': request})
     return Response({
@@ -91,7 +96,8 @@ def post_comments(request, post_id):
             'slug': post.slug
         },
         'comments': serializer.data,
-        'comments_count': post.comments.filter(is_active=True).count()
+        'comments_count': post.active_comments_count,
+        'next_cursor': next_cursor
     })
 
 
@@ -0,0 +1,55 @@
+"""
+Отслеживание изменений полей модели без дополнительных запросов.
+
+Значения полей tracked_fields запоминаются при загрузке объекта из БД
+(from_db) и после каждого сохранения, поэтому обработчики сигналов
+могут узнать предыдущее значение без повторного SELECT.
+
+Сейчас примесь применяется к Payment: переходы статусов
+(apps.payment.transitions) обновляют снимок после условного UPDATE.
+Subscription ее не использует: историю статусов подписки записывают
+сервисы (apps.payment.services, apps.subscribe.expiry), а массовые
+переходы выполняются UPDATE, которого не видят ни сигналы, ни трекер.
+"""
+
+
+class FieldTrackerMixin:
+    """Примесь для моделей: previous_value(), has_changed(), changed_fields()"""
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked_fields()
+        return instance
+
+    def _snapshot_tracked_fields(self):
+        # Отложенные (defer/only) поля отсутствуют в __dict__ и не отслеживаются
+        self._loaded_values = {
+            name: self.__dict__[name]
+            for name in self.tracked_fields if name in self.__dict__
+        }
+
+    def previous_value(self, field):
+        """Значение поля на момент загрузки или последнего сохранения"""
+        return getattr(self, '_loaded_values', {}).get(field)
+
+    def has_changed(self, field):
+        loaded = getattr(self, '_loaded_values', {})
+        return field in loaded and loaded[field] != self.__dict__.get(field)
+
+    def changed_fields(self):
+        """Измененные поля: {имя: (старое значение, новое значение)}"""
+        return {
+            name: (old, self.__dict__.get(name))
+            for name, old in getattr(self, '_loaded_values', {}).items()
+            if old != self.__dict__.get(name)
+        }
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._snapshot_tracked_fields()
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._snapshot_tracked_fields()
@@ -7,16 +7,34 @@ from .models import Category, Post
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'slug', 'posts_count', 'created_at')
+    list_display = (
+        'name', 'slug', 'posts_count', 'latest_post_at', 'total_views', 'created_at'
+    )
     list_filter = ('created_at',)
     search_fields = ('name', 'description')
     prepopulated_fields = {'slug': ('name',)}
     readonly_fields = ('created_at',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_stats()
+
     def posts_count(self, obj):
-        return obj.posts.count()
+        return obj.published_posts_count
+
+    posts_count.short_description = 'Published Posts'
+    posts_count.admin_order_field = 'published_posts_count'
+
+    def latest_post_at(self, obj):
+        return obj.latest_post_at
+
+    latest_post_at.short_description = 'Latest Post'
+    latest_post_at.admin_order_field = 'latest_post_at'
+
+    def total_views(self, obj):
+        return obj.total_views
 
-    posts_count.short_description = 'Posts Count'
+    total_views.short_description = 'Total Views'
+    total_views.admin_order_field = 'total_views'
 
 
 @admin.register(Post)
@@ -45,9 +63,10 @@ class PostAdmin(admin.ModelAdmin):
     )
 
     def comments_count(self, obj):
-        return obj.comments.count()
+        return obj.comments_count
 
     comments_count.short_description = 'Comments'
+    comments_count.admin_order_field = 'active_comments_count'
 
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('author', 'category')
\ No newline at end of file
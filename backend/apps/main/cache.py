@@ -0,0 +1,152 @@
+"""
+Кеш ответов публичных эндпоинтов для анонимных пользователей.
+
+Ответ хранится уже отрендеренным JSON по ключу "эндпоинт + путь с query string".
+В ключ входят версии групп зависимостей (posts, categories, comments, pins,
+subscriptions): сигналы моделей (apps.main.signals) увеличивают версию группы,
+и все зависящие от нее ответы перестают находиться в кеше без перебора ключей.
+Пересчет одного ключа выполняет только один запрос (single-flight), остальные
+ждут готового значения.
+
+Версии групп видны всем процессам только в общем кеше (Redis, см. CACHES
+в настройках). С кешем в памяти процесса изменение в другом воркере или
+в Celery не сбрасывает ответы, и они живут до RESPONSE_CACHE_TIMEOUT -
+поэтому для такого кеша он по умолчанию всего несколько секунд.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+POST_LIST_DEPENDENCIES = ('posts', 'comments', 'pins', 'subscriptions')
+
+KEY_PREFIX = 'response_cache'
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2.0
+LOCK_POLL_INTERVAL = 0.05
+
+
+def get_response_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def _version_key(group):
+    return f'{KEY_PREFIX}:version:{group}'
+
+
+def _get_versions(cache, groups):
+    """Текущие версии групп; отсутствующие инициализируются временем"""
+    keys = [_version_key(group) for group in groups]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Время как начальная версия не дает повторно использовать
+            # старые ключи после вытеснения версии из кеша
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def invalidate(*groups):
+    """Инвалидирует все закешированные ответы, зависящие от групп"""
+    cache = get_response_cache()
+    for group in groups:
+        key = _version_key(group)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def _incr_metric(cache, name, kind):
+    key = f'{KEY_PREFIX}:metrics:{name}:{kind}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_metrics(names):
+    """Количество попаданий и промахов по эндпоинтам"""
+    cache = get_response_cache()
+    metrics = {}
+    for name in names:
+        hits = cache.get(f'{KEY_PREFIX}:metrics:{name}:hit', 0)
+        misses = cache.get(f'{KEY_PREFIX}:metrics:{name}:miss', 0)
+        total = hits + misses
+        metrics[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0,
+        }
+    return metrics
+
+
+def _json_response(content):
+    return HttpResponse(content, content_type='application/json')
+
+
+registered_endpoints = []
+
+
+def cache_response(name, depends_on, timeout=None):
+    """
+    Декоратор view: кеширует успешные GET-ответы для анонимных пользователей.
+    depends_on - группы зависимостей, при изменении которых ответ инвалидируется.
+    """
+    registered_endpoints.append(name)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (not getattr(settings, 'RESPONSE_CACHE_ENABLED', True)
+                    or request.method != 'GET'
+                    or request.user.is_authenticated):
+                return view(request, *args, **kwargs)
+
+            cache = get_response_cache()
+            versions = _get_versions(cache, depends_on)
+            digest = hashlib.md5(
+                f'{versions}:{request.get_full_path()}'.encode()
+            ).hexdigest()
+            key = f'{KEY_PREFIX}:{name}:{digest}'
+
+            content = cache.get(key)
+            if content is not None:
+                _incr_metric(cache, name, 'hit')
+                return _json_response(content)
+            _incr_metric(cache, name, 'miss')
+
+            lock_key = f'{key}:lock'
+            if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+                # Ответ уже пересчитывается другим запросом - ждем его
+                deadline = time.monotonic() + LOCK_WAIT
+                while time.monotonic() < deadline:
+                    time.sleep(LOCK_POLL_INTERVAL)
+                    content = cache.get(key)
+                    if content is not None:
+                        return _json_response(content)
+                return view(request, *args, **kwargs)
+
+            try:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                content = JSONRenderer().render(response.data)
+                cache.set(
+                    key,
+                    content,
+                    timeout or getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 60)
+                )
+                return _json_response(content)
+            finally:
+                cache.delete(lock_key)
+
+        return wrapper
+
+    return decorator
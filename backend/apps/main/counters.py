@@ -0,0 +1,207 @@
+"""
+Буферизированный счетчик просмотров постов.
+
+Вместо записи в строку поста на каждый GET просмотры накапливаются в буфере
+(локальном для процесса или в Redis) и периодически сбрасываются в БД
+пакетными ``UPDATE posts SET views_count = views_count + n``.
+
+Redis-буфер сбрасывает задача Celery flush_post_views. Локальный буфер
+виден только своему процессу, поэтому его сбрасывает фоновый поток процесса
+раз в flush_interval секунд, независимо от того, идут ли запросы.
+"""
+import logging
+import os
+import threading
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+
+class LocalViewBuffer:
+    """Буфер просмотров в памяти текущего процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = defaultdict(int)
+
+    def add(self, post_id, count=1):
+        with self._lock:
+            self._counts[post_id] += count
+
+    def pending(self, post_id):
+        with self._lock:
+            return self._counts.get(post_id, 0)
+
+    def pending_many(self, post_ids):
+        with self._lock:
+            return {pk: self._counts[pk] for pk in post_ids if pk in self._counts}
+
+    def drain(self):
+        """Забирает все накопленные просмотры и очищает буфер"""
+        with self._lock:
+            counts, self._counts = dict(self._counts), defaultdict(int)
+        return counts
+
+    def restore(self, counts):
+        """Возвращает в буфер просмотры, которые не удалось записать"""
+        with self._lock:
+            for post_id, count in counts.items():
+                self._counts[post_id] += count
+
+
+class RedisViewBuffer:
+    """Буфер просмотров в хеше Redis, общий для всех процессов"""
+
+    def __init__(self, url, key='post_views:pending'):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._key = key
+        self._response_error = redis.exceptions.ResponseError
+
+    def add(self, post_id, count=1):
+        self._client.hincrby(self._key, post_id, count)
+
+    def pending(self, post_id):
+        return int(self._client.hget(self._key, post_id) or 0)
+
+    def pending_many(self, post_ids):
+        post_ids = list(post_ids)
+        if not post_ids:
+            return {}
+        values = self._client.hmget(self._key, post_ids)
+        return {pk: int(value) for pk, value in zip(post_ids, values) if value}
+
+    def drain(self):
+        """Атомарно переименовывает хеш и вычитывает его целиком"""
+        # Уникальный ключ: параллельный сброс не перезапишет чужой вычитываемый хеш
+        draining_key = f'{self._key}:draining:{uuid.uuid4().hex}'
+        try:
+            self._client.rename(self._key, draining_key)
+        except self._response_error:
+            # Ключа нет - просмотров не накоплено
+            return {}
+        pipe = self._client.pipeline()
+        pipe.hgetall(draining_key)
+        pipe.delete(draining_key)
+        raw, _ = pipe.execute()
+        return {int(pk): int(count) for pk, count in raw.items()}
+
+    def restore(self, counts):
+        pipe = self._client.pipeline()
+        for post_id, count in counts.items():
+            pipe.hincrby(self._key, post_id, count)
+        pipe.execute()
+
+
+class ViewCounter:
+    """Накапливает просмотры и сбрасывает их в БД пакетами"""
+
+    def __init__(self, buffer, flush_interval=60):
+        self.buffer = buffer
+        self.flush_interval = flush_interval
+        self._flusher = None
+        self._flusher_pid = None
+        self._flusher_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def record(self, post_id, count=1):
+        """Регистрирует просмотр поста"""
+        self.buffer.add(post_id, count)
+
+        # Локальный буфер не виден Celery, поэтому процесс сбрасывает его сам
+        if isinstance(self.buffer, LocalViewBuffer):
+            self.start_flusher()
+
+    def start_flusher(self):
+        """Запускает фоновый поток периодического сброса (один на процесс)"""
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._flusher_lock:
+            # После fork поток родителя в дочернем процессе не существует
+            if self._flusher_pid == pid:
+                return
+            self._stopped.clear()
+            self._flusher = threading.Thread(
+                target=self._run_flusher, name='view-counter-flush', daemon=True
+            )
+            self._flusher.start()
+            self._flusher_pid = pid
+
+    def stop_flusher(self):
+        self._stopped.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self._flusher = None
+        self._flusher_pid = None
+
+    def _run_flusher(self):
+        while not self._stopped.wait(self.flush_interval):
+            self._flush_in_thread()
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        except Exception:
+            # Просмотры возвращены в буфер, повторим на следующем интервале
+            logger.exception("Error in post views flush thread")
+        finally:
+            # Поток держит собственное соединение с БД - не оставляем его открытым
+            connection.close()
+
+    def pending(self, post_id):
+        return self.buffer.pending(post_id)
+
+    def pending_many(self, post_ids):
+        return self.buffer.pending_many(post_ids)
+
+    def flush(self):
+        """Записывает накопленные просмотры в БД, возвращает число обновленных постов"""
+        from .models import Post
+
+        counts = self.buffer.drain()
+        if not counts:
+            return 0
+
+        # Группируем посты по приросту: один UPDATE на каждое значение
+        by_delta = defaultdict(list)
+        for post_id, count in counts.items():
+            by_delta[count].append(post_id)
+
+        try:
+            with transaction.atomic():
+                for delta, post_ids in by_delta.items():
+                    Post.objects.filter(pk__in=post_ids).update(
+                        views_count=F('views_count') + delta
+                    )
+        except Exception as e:
+            logger.error(f"Error flushing post views: {e}")
+            self.buffer.restore(counts)
+            raise
+
+        return len(counts)
+
+
+_view_counter = None
+
+
+def get_view_counter():
+    """Возвращает счетчик просмотров, настроенный через VIEW_COUNTER_* settings"""
+    global _view_counter
+    if _view_counter is None:
+        backend = getattr(settings, 'VIEW_COUNTER_BACKEND', 'local')
+        if backend == 'redis':
+            buffer = RedisViewBuffer(settings.VIEW_COUNTER_REDIS_URL)
+        else:
+            buffer = LocalViewBuffer()
+        _view_counter = ViewCounter(
+            buffer,
+            flush_interval=getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', 60)
+        )
+    return _view_counter
@@ -0,0 +1,106 @@
+"""
+Лента постов: закрепленные посты идут первыми (в порядке закрепления),
+затем остальные посты по дате создания.
+
+ID закрепленных постов с активной подпиской вычисляются одним запросом,
+без повторных join'ов на подписку автора в запросе ленты.
+
+Порядок "закрепленные первыми" в queryset() задается выражением (CASE по
+списку ID, который меняется при каждом закреплении), поэтому индекс для
+него не используется: БД сортирует все отобранные посты. Для больших лент
+нужен page(): закрепленные посты выбираются по ID, а обычные - по индексу
+(status, -created_at) с условием "после курсора" и LIMIT.
+"""
+from django.db.models import Case, DateTimeField, F, When
+from django.utils import timezone
+
+from .pagination import decode_cursor, keyset_cursor, keyset_filter
+
+FEED_ORDERING = ('-created_at', '-id')
+
+
+def active_pinned_post_ids():
+    """ID опубликованных закрепленных постов пользователей с активной подпиской"""
+    from apps.subscribe.models import PinnedPost
+
+    return list(PinnedPost.objects.filter(
+        user__subscription__status='active',
+        user__subscription__end_date__gt=timezone.now(),
+        post__status='published'
+    ).order_by('pinned_at').values_list('post_id', flat=True))
+
+
+class PostFeed:
+    """Построитель ленты постов с закрепленными постами в начале"""
+
+    def __init__(self, queryset=None, pinned_ids=None):
+        if queryset is None:
+            from .models import Post
+            queryset = Post.objects.filter(status='published')
+        self.base = queryset
+        self._pinned_ids = pinned_ids
+
+    @property
+    def pinned_ids(self):
+        """ID закрепленных постов в порядке закрепления (вычисляются один раз)"""
+        if self._pinned_ids is None:
+            self._pinned_ids = active_pinned_post_ids()
+        return self._pinned_ids
+
+    def _with_related(self, queryset):
+        return queryset.select_related(
+            'author', 'category', 'pin_info', 'pin_info__user',
+            'pin_info__user__subscription'
+        )
+
+    def queryset(self):
+        """
+        Вся лента одним запросом: закрепленные посты первыми.
+        Сортировка по выражению без индекса - см. описание модуля.
+        """
+        queryset = self._with_related(self.base)
+        if not self.pinned_ids:
+            return queryset.order_by(*FEED_ORDERING)
+
+        return queryset.annotate(
+            feed_pinned_at=Case(
+                When(pk__in=self.pinned_ids, then='pin_info__pinned_at'),
+                default=None,
+                output_field=DateTimeField()
+            )
+        ).order_by(F('feed_pinned_at').asc(nulls_last=True), *FEED_ORDERING)
+
+    def pinned(self):
+        """Только закрепленные посты в порядке закрепления"""
+        return self._with_related(self.base).filter(
+            pk__in=self.pinned_ids
+        ).order_by('pin_info__pinned_at')
+
+    def regular(self):
+        """Незакрепленные посты по дате создания"""
+        return self._with_related(self.base).exclude(
+            pk__in=self.pinned_ids
+        ).order_by(*FEED_ORDERING)
+
+    def page(self, cursor=None, limit=20):
+        """
+        Keyset-страница ленты. Первая страница (без курсора) содержит все
+        закрепленные посты и первые limit обычных, следующие - только обычные.
+        Возвращает (posts, next_cursor).
+        """
+        values = decode_cursor(cursor, FEED_ORDERING, self.base.model)
+
+        if values is None:
+            pinned = list(self.pinned())
+            regular = list(self.regular()[:limit])
+        else:
+            pinned = []
+            regular = list(
+                self.regular().filter(keyset_filter(FEED_ORDERING, values))[:limit]
+            )
+
+        next_cursor = None
+        if regular and len(regular) == limit:
+            next_cursor = keyset_cursor(regular[-1], FEED_ORDERING)
+
+        return pinned + regular, next_cursor
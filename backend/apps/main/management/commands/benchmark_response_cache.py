@@ -0,0 +1,64 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+DEFAULT_URLS = (
+    '/api/v1/posts/popular/',
+    '/api/v1/posts/recent/',
+    '/api/v1/posts/featured/',
+    '/api/v1/posts/pinned/',
+    '/api/v1/posts/categories/',
+    '/api/v1/subscribe/pinned-posts/',
+)
+
+
+class Command(BaseCommand):
+    help = 'Measure requests per second of cached public endpoints with the response cache on and off'
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*', help='Endpoints to measure, defaults to all cached ones')
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Number of anonymous GET requests per endpoint and mode',
+        )
+        parser.add_argument(
+            '--host',
+            help='Host header of the requests, defaults to the first ALLOWED_HOSTS entry',
+        )
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        if count < 1:
+            raise CommandError('--requests must be positive')
+        if not settings.CACHE_IS_SHARED:
+            self.stdout.write(self.style.WARNING(
+                'Cache backend is per-process: numbers are for a single worker'
+            ))
+
+        host = options['host'] or next(
+            (host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost'
+        )
+        client = Client(HTTP_HOST=host)
+        for url in options['urls'] or DEFAULT_URLS:
+            off = self._measure(client, url, count, enabled=False)
+            on = self._measure(client, url, count, enabled=True)
+            self.stdout.write(
+                f'{url}: cache off {off:.1f} rps, cache on {on:.1f} rps, x{on / off:.1f}'
+            )
+
+    def _measure(self, client, url, count, enabled):
+        """Запросов в секунду; с кешем - после прогревающего запроса"""
+        with override_settings(RESPONSE_CACHE_ENABLED=enabled):
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{url} returned {response.status_code}')
+
+            started = time.perf_counter()
+            for _ in range(count):
+                client.get(url)
+            elapsed = time.perf_counter() - started
+        return count / elapsed
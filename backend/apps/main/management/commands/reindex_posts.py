@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.main.models import Post
+from apps.main.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for posts in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of posts reindexed per transaction',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        backend = get_search_backend()
+
+        # Индекс в памяти процесса достаточно перестроить целиком
+        backend.rebuild()
+
+        indexed = 0
+        last_pk = 0
+        while True:
+            post_ids = list(
+                Post.objects.filter(pk__gt=last_pk).order_by('pk').values_list(
+                    'pk', flat=True
+                )[:batch_size]
+            )
+            if not post_ids:
+                break
+            last_pk = post_ids[-1]
+
+            with transaction.atomic():
+                backend.update(post_ids)
+            indexed += len(post_ids)
+            self.stdout.write(f'Indexed {indexed} posts')
+
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt: {indexed} posts'))
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_active_comments_count(apps, schema_editor):
+    Post = apps.get_model('main', 'Post')
+    Comment = apps.get_model('comments', 'Comment')
+
+    active_comments = Comment.objects.filter(
+        post=OuterRef('pk'),
+        is_active=True
+    ).order_by().values('post').annotate(count=Count('pk')).values('count')
+
+    Post.objects.update(active_comments_count=Coalesce(Subquery(active_comments), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_alter_category_id_alter_post_id'),
+        ('comments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='active_comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_active_comments_count, migrations.RunPython.noop),
+    ]
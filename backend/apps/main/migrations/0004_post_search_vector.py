@@ -0,0 +1,35 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # GIN-индекс доступен только на PostgreSQL, на других БД поиск идет
+    # через инвертированный индекс в памяти (apps.main.search)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS posts_search_vector_gin ON posts USING gin (search_vector)'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS posts_search_vector_gin')
+
+
+class Migration(migrations.Migration):
+    """Существующие посты индексирует миграция 0005_backfill_post_search_vector"""
+
+    dependencies = [
+        ('main', '0003_post_active_comments_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
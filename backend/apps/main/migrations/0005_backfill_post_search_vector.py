@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def backfill_search_vector(apps, schema_editor):
+    # На других БД поиск идет через индекс в памяти, который строится при первом запросе
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    Post = apps.get_model('main', 'Post')
+    config = getattr(settings, 'POST_SEARCH_CONFIG', 'english')
+    vector = (
+        SearchVector('title', weight='A', config=config) +
+        SearchVector('content', weight='B', config=config)
+    )
+
+    # Порциями по первичному ключу, чтобы не держать блокировку всей таблицы
+    last_pk = 0
+    while True:
+        post_ids = list(
+            Post.objects.filter(pk__gt=last_pk, search_vector__isnull=True)
+            .order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE]
+        )
+        if not post_ids:
+            break
+        Post.objects.filter(pk__in=post_ids).update(search_vector=vector)
+        last_pk = post_ids[-1]
+
+
+class Migration(migrations.Migration):
+    # Каждая порция фиксируется отдельно
+    atomic = False
+
+    dependencies = [
+        ('main', '0004_post_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,28 @@
 from django.db import models
+from django.contrib.postgres.search import SearchVectorField
 from django.conf import settings
 from django.utils.text import slugify
 from django.urls import reverse
 
 
+class CategoryQuerySet(models.QuerySet):
+    """QuerySet категорий со статистикой опубликованных постов"""
+
+    def with_stats(self):
+        """
+        Количество опубликованных постов, дата последнего из них и сумма
+        просмотров - одним сгруппированным запросом вместо запроса на категорию.
+        """
+        published = models.Q(posts__status='published')
+        return self.annotate(
+            published_posts_count=models.Count('posts', filter=published),
+            latest_post_at=models.Max('posts__created_at', filter=published),
+            total_views=models.functions.Coalesce(
+                models.Sum('posts__views_count', filter=published), 0
+            )
+        )
+
+
 class Category(models.Model):
     """
     Модель категории для постов блога.
@@ -13,6 +32,8 @@ class Category(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CategoryQuerySet.as_manager()
+
     class Meta:
         db_table = 'categories'
         verbose_name = 'Category'
@@ -27,8 +48,49 @@ class Category(models.Model):
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
 
-
-class PostManager(models.Manager):
+    def get_stats(self):
+        """Статистика категории: из аннотации with_stats() или отдельным запросом"""
+        if not hasattr(self, 'published_posts_count'):
+            stats = Category.objects.with_stats().filter(pk=self.pk).values(
+                'published_posts_count', 'latest_post_at', 'total_views'
+            ).first() or {}
+            self.published_posts_count = stats.get('published_posts_count', 0)
+            self.latest_post_at = stats.get('latest_post_at')
+            self.total_views = stats.get('total_views', 0)
+        return {
+            'posts_count': self.published_posts_count,
+            'latest_post_at': self.latest_post_at,
+            'total_views': self.total_views,
+        }
+
+
+class PostQuerySet(models.QuerySet):
+    """QuerySet постов с аннотациями счетчиков"""
+
+    def with_counts(self):
+        """
+        Добавляет точное количество активных комментариев одним подзапросом.
+        Для списков достаточно денормализованного active_comments_count,
+        аннотация нужна для сверки счетчиков (recount_comment_counters).
+        """
+        return self.annotate(annotated_comments_count=self.active_comments_subquery())
+
+    @staticmethod
+    def active_comments_subquery():
+        """Выражение: точное количество активных комментариев поста (OuterRef('pk'))"""
+        from apps.comments.models import Comment
+
+        active_comments = Comment.objects.filter(
+            post=models.OuterRef('pk'),
+            is_active=True
+        ).order_by().values('post').annotate(
+            count=models.Count('pk')
+        ).values('count')
+
+        return models.functions.Coalesce(models.Subquery(active_comments), 0)
+
+
+class PostManager(models.Manager.from_queryset(PostQuerySet)):
     """Менеджер для модели Post с дополнительными методами"""
 
     def pusblished(self):
@@ -36,24 +98,20 @@ class PostManager(models.Manager):
 
     def pinned_posts(self):
         """Возвращает закрепленные посты в порядке закрепления"""
-        return self.filter(
-            pin_info__isnull=False,
-            pin_info__user__subscription__status='active',
-            pin_info__user__subscription__end_date__gt=models.functions.Now(),
-            status='published'
-        ).select_related(
-            'pin_info', 'pin_info__user', 'pin_info__user__subcription'
-        ).order_by('pin_info__pinned_at')
+        from .feed import PostFeed
+
+        return PostFeed(self.filter(status='published')).pinned()
 
     def regular_posts(self):
         """Возвращает обычные (незакрепленные) посты"""
         return self.filter(pin_info__isnull=True, status='published')
 
     def with_subscription_info(self):
-        """Добавляет информацию о подписке автора"""
+        """Добавляет информацию о подписке автора и о закреплении"""
         return self.select_related(
-            'author', 'author__subscription', 'category'
-        ).prefetch_related('pin_info')
+            'author', 'author__subscription', 'category',
+            'pin_info', 'pin_info__user', 'pin_info__user__subscription'
+        )
 
 
 class Post(models.Model):
@@ -89,6 +147,9 @@ class Post(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     views_count = models.PositiveIntegerField(default=0)
+    active_comments_count = models.PositiveIntegerField(default=0, editable=False)
+    # Поддерживается apps.main.search, GIN-индекс создается миграцией на PostgreSQL
+    search_vector = SearchVectorField(null=True, editable=False)
 
     objects = PostManager()
 
@@ -112,13 +173,22 @@ class Post(models.Model):
             self.slug = slugify(self.title)
         super().save(*args, **kwargs)
 
+    @classmethod
+    def get_posts_for_feed(cls, queryset=None):
+        """Лента постов: закрепленные первыми, затем по дате (см. apps.main.feed)"""
+        from .feed import PostFeed
+
+        return PostFeed(queryset).queryset()
+
     def get_absolute_url(self):
         return reverse('post-detail', kwargs={'slug': self.slug})
 
     @property
     def comments_count(self):
-        """Количество комментариев к посту"""
-        return self.comments.filter(is_active=True).count()
+        """Количество активных комментариев к посту"""
+        if hasattr(self, 'annotated_comments_count'):
+            return self.annotated_comments_count
+        return self.active_comments_count
 
     @property
     def is_pinned(self):
@@ -143,23 +213,31 @@ class Post(models.Model):
             return False
 
         # Пост должен принадлежать пользователю
-        if self.author != user:
+        if self.author_id != user.pk:
             return False
 
         # Пост должен быть опубликован
         if self.status != 'published':
             return False
 
-        # У пользователя должна быть активная подписка
-        if not hasattr(user, 'subscription') or not user.subscription.is_active:
+        # Активная подписка пользователя должна позволять закрепление
+        from apps.subscribe.entitlements import has_entitlement
+        if not has_entitlement(user, 'pin_posts'):
             return False
 
         return True
 
     def increment_views(self):
-        """Увеличивает счетчик просмотров"""
-        self.views_count += 1
-        self.save(update_fields=['views_count'])
+        """
+        Регистрирует просмотр в буфере счетчика.
+        В БД просмотры попадают пакетно (см. apps.main.counters),
+        а views_count экземпляра дополняется еще не сброшенными просмотрами.
+        """
+        from .counters import get_view_counter
+
+        counter = get_view_counter()
+        counter.record(self.pk)
+        self.views_count += counter.pending(self.pk)
 
     def get_pinned_info(self):
         """Возвращает информацию о закреплении поста"""
@@ -0,0 +1,166 @@
+"""
+Пагинация списков: постраничная (по умолчанию) и keyset (по курсору).
+
+Курсор - это значения полей сортировки последней записи страницы,
+закодированные в base64. Следующая страница выбирается условием
+"строго после курсора", что использует индекс и не требует OFFSET и COUNT.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+INVALID_CURSOR = 'Invalid cursor'
+
+
+def encode_cursor(values):
+    """Кодирует значения полей сортировки в строку курсора"""
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor, ordering, model):
+    """
+    Декодирует строку курсора в значения полей ordering модели model.
+    Пустой курсор - первая страница (None); некорректный - NotFound,
+    как у CursorPagination в DRF.
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.b64decode(cursor.encode(), altchars=b'-_', validate=True))
+    except (TypeError, ValueError, binascii.Error):
+        raise NotFound(INVALID_CURSOR)
+
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise NotFound(INVALID_CURSOR)
+
+    decoded = []
+    for field, value in zip(ordering, values):
+        if value is None or not isinstance(value, (str, int)) or isinstance(value, bool):
+            raise NotFound(INVALID_CURSOR)
+        try:
+            value = model._meta.get_field(field.lstrip('-')).to_python(value)
+        except (DjangoValidationError, TypeError, ValueError):
+            raise NotFound(INVALID_CURSOR)
+        if value is None:
+            raise NotFound(INVALID_CURSOR)
+        decoded.append(value)
+    return decoded
+
+
+def keyset_filter(ordering, values):
+    """
+    Строит условие "после курсора" для сортировки ordering,
+    например ('-created_at', '-id') -> created_at < c OR (created_at = c AND id < i)
+    """
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+
+def keyset_cursor(obj, ordering):
+    """Возвращает курсор, указывающий на объект obj"""
+    return encode_cursor([getattr(obj, field.lstrip('-')) for field in ordering])
+
+
+def is_keyset_request(request):
+    """Запрошен ли keyset-режим пагинации"""
+    params = request.query_params
+    return 'cursor' in params or params.get('pagination') == 'cursor'
+
+
+def estimate_count(queryset, threshold=10000):
+    """
+    Приблизительное количество строк по плану запроса PostgreSQL.
+    Если оценка меньше threshold (или БД не PostgreSQL), считается точный COUNT.
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        return queryset.count()
+
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    estimate = int(plan[0]['Plan']['Plan Rows'])
+    if estimate < threshold:
+        return queryset.count()
+    return estimate
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator, использующий оценку количества строк вместо COUNT(*)"""
+
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+
+class FlexiblePagination(PageNumberPagination):
+    """
+    Постраничная навигация с опциями, выбираемыми в запросе:
+    - ?cursor=... или ?pagination=cursor - keyset-режим по view.keyset_ordering
+      (по умолчанию -created_at, -id) без COUNT и OFFSET;
+    - ?count=estimated - номер страницы с оценкой количества вместо COUNT(*).
+    """
+    cursor_query_param = 'cursor'
+    keyset_ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = is_keyset_request(request)
+        if self.keyset:
+            return self.paginate_keyset(queryset, request, view)
+
+        if request.query_params.get('count') == 'estimated':
+            self.django_paginator_class = EstimatedCountPaginator
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_keyset(self, queryset, request, view=None):
+        self.request = request
+        self.next_cursor = None
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        ordering = getattr(view, 'keyset_ordering', self.keyset_ordering)
+        values = decode_cursor(
+            request.query_params.get(self.cursor_query_param), ordering, queryset.model
+        )
+        if values:
+            queryset = queryset.filter(keyset_filter(ordering, values))
+
+        # Берем на одну запись больше, чтобы узнать о наличии следующей страницы
+        results = list(queryset.order_by(*ordering)[:page_size + 1])
+        if len(results) > page_size:
+            results = results[:page_size]
+            self.next_cursor = keyset_cursor(results[-1], ordering)
+        return results
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
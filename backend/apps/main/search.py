@@ -0,0 +1,276 @@
+"""
+Полнотекстовый поиск по постам.
+
+На PostgreSQL используется поддерживаемое поле Post.search_vector с GIN-индексом
+(ранжирование SearchRank, префиксный поиск, подсветка SearchHeadline).
+На остальных БД (SQLite в тестах) - инвертированный индекс в памяти процесса.
+Индекс обновляется при сохранении поста (apps.main.signals), полная
+переиндексация - командой reindex_posts.
+"""
+import bisect
+import html
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchHeadline,
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db import connection
+from django.db.models import Case, F, FloatField, Value, When
+from rest_framework.filters import BaseFilterBackend
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+TITLE_WEIGHT = 1.0
+CONTENT_WEIGHT = 0.4
+
+# ts_headline не экранирует HTML текста поста: совпадения размечаются
+# управляющими символами, а экранирование и теги подсветки добавляет
+# render_headline - так же, как highlight() для индекса в памяти
+HEADLINE_START = '\x02'
+HEADLINE_STOP = '\x03'
+
+
+def tokenize(text):
+    """Разбивает текст на слова в нижнем регистре"""
+    return TOKEN_RE.findall(text.lower())
+
+
+def highlight(text, term, max_length=200, start_sel='<mark>', stop_sel='</mark>'):
+    """Фрагмент текста вокруг первого совпадения с подсвеченными словами запроса"""
+    tokens = tokenize(term)
+    if not tokens:
+        return html.escape(text[:max_length])
+
+    pattern = re.compile(
+        r'\b(' + '|'.join(re.escape(token) for token in tokens) + r')\w*',
+        re.IGNORECASE | re.UNICODE
+    )
+    match = pattern.search(text)
+    start = max(0, match.start() - max_length // 4) if match else 0
+    fragment = text[start:start + max_length]
+
+    parts = []
+    position = 0
+    for found in pattern.finditer(fragment):
+        parts.append(html.escape(fragment[position:found.start()]))
+        parts.append(start_sel + html.escape(found.group(0)) + stop_sel)
+        position = found.end()
+    parts.append(html.escape(fragment[position:]))
+
+    prefix = '...' if start > 0 else ''
+    suffix = '...' if start + max_length < len(text) else ''
+    return prefix + ''.join(parts) + suffix
+
+
+def no_results(queryset):
+    """Пустой результат с search_rank: сортировка по релевантности должна работать и для него"""
+    return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+
+
+def render_headline(headline, start_sel='<mark>', stop_sel='</mark>'):
+    """HTML фрагмента SearchHeadline: текст экранирован, совпадения подсвечены"""
+    return html.escape(headline).replace(HEADLINE_START, start_sel).replace(HEADLINE_STOP, stop_sel)
+
+
+class PostgresSearchBackend:
+    """Поиск по search_vector с GIN-индексом"""
+
+    def __init__(self):
+        self.config = getattr(settings, 'POST_SEARCH_CONFIG', 'english')
+
+    def vector(self):
+        return (
+            SearchVector('title', weight='A', config=self.config) +
+            SearchVector('content', weight='B', config=self.config)
+        )
+
+    def update(self, post_ids):
+        from .models import Post
+
+        Post.objects.filter(pk__in=post_ids).update(search_vector=self.vector())
+
+    def remove(self, post_ids):
+        # Вектор хранится в строке поста и удаляется вместе с ней
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, queryset, term):
+        tokens = tokenize(term)
+        if not tokens:
+            return no_results(queryset)
+
+        # Слова состоят только из \w, поэтому безопасны для синтаксиса tsquery
+        query = SearchQuery(
+            ' & '.join(f'{token}:*' for token in tokens),
+            search_type='raw',
+            config=self.config
+        )
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query),
+            search_headline=SearchHeadline(
+                'content',
+                query,
+                config=self.config,
+                start_sel=HEADLINE_START,
+                stop_sel=HEADLINE_STOP,
+                max_words=35,
+                min_words=15
+            )
+        )
+
+
+class InvertedIndexSearchBackend:
+    """Инвертированный индекс в памяти процесса (для БД без полнотекстового поиска)"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        self._sorted_tokens = None
+        self._built = False
+
+    def _index(self, post_id, title, content):
+        weights = defaultdict(float)
+        for token in tokenize(title):
+            weights[token] += TITLE_WEIGHT
+        for token in tokenize(content):
+            weights[token] += CONTENT_WEIGHT
+
+        for token, weight in weights.items():
+            self._postings[token][post_id] = weight
+        self._documents[post_id] = set(weights)
+        self._sorted_tokens = None
+
+    def _unindex(self, post_id):
+        for token in self._documents.pop(post_id, ()):
+            postings = self._postings[token]
+            postings.pop(post_id, None)
+            if not postings:
+                del self._postings[token]
+        self._sorted_tokens = None
+
+    def _ensure_built(self):
+        if not self._built:
+            self.rebuild()
+
+    def rebuild(self):
+        from .models import Post
+
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            for pk, title, content in Post.objects.values_list(
+                'pk', 'title', 'content'
+            ).iterator():
+                self._index(pk, title, content)
+            self._built = True
+
+    def update(self, post_ids):
+        from .models import Post
+
+        with self._lock:
+            if not self._built:
+                return
+            rows = Post.objects.filter(pk__in=post_ids).values_list('pk', 'title', 'content')
+            for pk, title, content in rows:
+                self._unindex(pk)
+                self._index(pk, title, content)
+
+    def remove(self, post_ids):
+        with self._lock:
+            for pk in post_ids:
+                self._unindex(pk)
+
+    def _prefix_matches(self, prefix):
+        """Веса постов для всех слов, начинающихся с prefix"""
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self._postings)
+
+        scores = defaultdict(float)
+        position = bisect.bisect_left(self._sorted_tokens, prefix)
+        while position < len(self._sorted_tokens):
+            token = self._sorted_tokens[position]
+            if not token.startswith(prefix):
+                break
+            for post_id, weight in self._postings[token].items():
+                scores[post_id] = max(scores[post_id], weight)
+            position += 1
+        return scores
+
+    def ranked_ids(self, term):
+        """ID постов, содержащих все слова запроса (с префиксами), с рангом"""
+        tokens = tokenize(term)
+        if not tokens:
+            return {}
+
+        with self._lock:
+            self._ensure_built()
+            result = None
+            for token in tokens:
+                matches = self._prefix_matches(token)
+                if result is None:
+                    result = dict(matches)
+                else:
+                    result = {
+                        pk: score + matches[pk]
+                        for pk, score in result.items() if pk in matches
+                    }
+                if not result:
+                    return {}
+            return result
+
+    def search(self, queryset, term):
+        ranks = self.ranked_ids(term)
+        if not ranks:
+            return no_results(queryset)
+
+        return queryset.filter(pk__in=ranks).annotate(
+            search_rank=Case(
+                *[When(pk=pk, then=Value(rank)) for pk, rank in ranks.items()],
+                default=Value(0.0),
+                output_field=FloatField()
+            )
+        )
+
+
+_search_backend = None
+
+
+def get_search_backend():
+    """Возвращает backend поиска, подходящий для текущей БД"""
+    global _search_backend
+    if _search_backend is None:
+        if connection.vendor == 'postgresql':
+            _search_backend = PostgresSearchBackend()
+        else:
+            _search_backend = InvertedIndexSearchBackend()
+    return _search_backend
+
+
+class PostSearchFilter(BaseFilterBackend):
+    """
+    Полнотекстовый поиск по параметру ?search=.
+    Без явного ?ordering= результаты сортируются по релевантности.
+    """
+    search_param = 'search'
+
+    def get_search_term(self, request):
+        return request.query_params.get(self.search_param, '').strip()
+
+    def filter_queryset(self, request, queryset, view):
+        term = self.get_search_term(request)
+        if not term:
+            return queryset
+
+        queryset = get_search_backend().search(queryset, term)
+        if not request.query_params.get('ordering'):
+            queryset = queryset.order_by('-search_rank', '-created_at', '-id')
+        return queryset
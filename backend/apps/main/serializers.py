@@ -1,25 +1,52 @@
 from rest_framework import serializers
 from django.utils.text import slugify
+from .counters import get_view_counter
 from .models import Category, Post
+from .search import highlight, render_headline
 
 
 class CategorySerializer(serializers.ModelSerializer):
     """Сериализатор для категорий"""
     posts_count = serializers.SerializerMethodField()
+    latest_post_at = serializers.SerializerMethodField()
+    total_views = serializers.SerializerMethodField()
 
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug', 'description', 'posts_count', 'created_at']
+        fields = [
+            'id', 'name', 'slug', 'description', 'posts_count',
+            'latest_post_at', 'total_views', 'created_at'
+        ]
         read_only_fields = ['slug', 'created_at']
 
     def get_posts_count(self, obj):
-        return obj.posts.filter(status='published').count()
+        return obj.get_stats()['posts_count']
+
+    def get_latest_post_at(self, obj):
+        latest_post_at = obj.get_stats()['latest_post_at']
+        return serializers.DateTimeField().to_representation(latest_post_at) if latest_post_at else None
+
+    def get_total_views(self, obj):
+        return obj.get_stats()['total_views']
 
     def create(self, validated_data):
         validated_data['slug'] = slugify(validated_data['name'])
         return super().create(validated_data)
 
 
+class PostListViewsSerializer(serializers.ListSerializer):
+    """
+    Список постов: к views_count добавляются просмотры, еще не сброшенные
+    из буфера счетчика (apps.main.counters), как в детальном просмотре.
+    Буфер опрашивается одним вызовом на весь список.
+    """
+
+    def to_representation(self, data):
+        posts = list(data.all() if hasattr(data, 'all') else data)
+        self.child.pending_views = get_view_counter().pending_many(post.pk for post in posts)
+        return super().to_representation(posts)
+
+
 class PostListSerializer(serializers.ModelSerializer):
     """Сериализатор для списка постов"""
     author = serializers.StringRelatedField()
@@ -36,6 +63,7 @@ class PostListSerializer(serializers.ModelSerializer):
             'views_count', 'comments_count', 'is_pinned', 'pinned_info'
         ]
         read_only_fields = ['slug', 'author', 'views_count']
+        list_serializer_class = PostListViewsSerializer
 
     def get_pinned_info(self, obj):
         """Возвращает информацию о закреплении"""
@@ -43,9 +71,18 @@ class PostListSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
+        data['views_count'] += getattr(self, 'pending_views', {}).get(instance.pk, 0)
         # Обрезаем контент для списка
         if len(data['content']) > 200:
             data['content'] = data['content'][:200] + '...'
+
+        # Для результатов поиска добавляем фрагмент с подсветкой
+        if hasattr(instance, 'search_rank'):
+            headline = getattr(instance, 'search_headline', None)
+            data['highlight'] = render_headline(headline) if headline else highlight(
+                instance.content,
+                self.context['request'].query_params.get('search', '')
+            )
         return data
 
 
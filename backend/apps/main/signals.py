@@ -0,0 +1,54 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import invalidate
+from .models import Category, Post
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Post)
+def post_post_save(sender, instance, created, update_fields=None, **kwargs):
+    """Обновляет поисковый индекс при изменении заголовка или текста поста"""
+    if update_fields is None or {'title', 'content'} & set(update_fields):
+        get_search_backend().update([instance.pk])
+
+
+@receiver(post_delete, sender=Post)
+def post_post_delete(sender, instance, **kwargs):
+    """Удаляет пост из поискового индекса"""
+    get_search_backend().remove([instance.pk])
+
+
+# Инвалидация кеша ответов (apps.main.cache) по группам зависимостей.
+# Повторно после коммита: до него параллельный запрос мог закешировать
+# ответ, прочитанный из БД до изменения
+
+def invalidate_on_commit(*groups):
+    invalidate(*groups)
+    transaction.on_commit(lambda: invalidate(*groups))
+
+
+@receiver([post_save, post_delete], sender=Post)
+def invalidate_posts(sender, **kwargs):
+    invalidate_on_commit('posts')
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_categories(sender, **kwargs):
+    invalidate_on_commit('categories')
+
+
+@receiver([post_save, post_delete], sender='comments.Comment')
+def invalidate_comments(sender, **kwargs):
+    invalidate_on_commit('comments')
+
+
+@receiver([post_save, post_delete], sender='subscribe.PinnedPost')
+def invalidate_pins(sender, **kwargs):
+    invalidate_on_commit('pins')
+
+
+@receiver([post_save, post_delete], sender='subscribe.Subscription')
+def invalidate_subscriptions(sender, **kwargs):
+    invalidate_on_commit('subscriptions')
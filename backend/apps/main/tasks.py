@@ -0,0 +1,10 @@
+from celery import shared_task
+
+from .counters import get_view_counter
+
+
+@shared_task
+def flush_post_views():
+    """Сбрасывает накопленные просмотры постов в БД"""
+    flushed_posts = get_view_counter().flush()
+    return {'flushed_posts': flushed_posts}
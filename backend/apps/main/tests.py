@@ -1,3 +1,522 @@
-from django.test import TestCase
+import base64
+import json
+import threading
+import unittest
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from apps.comments.models import Comment
+from apps.subscribe.models import PinnedPost, Subscription, SubscriptionPlan
+
+from .cache import _version_key, get_metrics, get_response_cache
+from .counters import LocalViewBuffer, RedisViewBuffer, ViewCounter
+from .feed import FEED_ORDERING, PostFeed
+from .models import Category, Post
+from .pagination import decode_cursor, encode_cursor
+from .search import get_search_backend, render_headline
+
+
+def create_subscriber(username, plan=None):
+    user = User.objects.create(email=f'{username}@example.com', username=username)
+    plan = plan or SubscriptionPlan.objects.create(
+        name=f'Plan {username}', price=10, stripe_price_id=f'price_{username}'
+    )
+    Subscription.objects.create(
+        user=user, plan=plan, status='active',
+        start_date=timezone.now(), end_date=timezone.now() + timedelta(days=30)
+    )
+    return user
+
+
+def create_posts(count, author=None, category=None, prefix='post', **kwargs):
+    author = author or User.objects.create(email='author@example.com', username='author')
+    category = category or Category.objects.create(name='News')
+    return [
+        Post.objects.create(
+            title=f'Post {i}', slug=f'{prefix}-{author.pk}-{i}', content='text',
+            author=author, category=category, **kwargs
+        )
+        for i in range(count)
+    ]
+
+
+class ViewCounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.posts = create_posts(3)
+
+    def setUp(self):
+        self.counter = ViewCounter(LocalViewBuffer(), flush_interval=3600)
+        self.addCleanup(self.counter.stop_flusher)
+
+    def test_flush_writes_buffered_views_in_batches(self):
+        first, second, third = self.posts
+        for post, views in ((first, 2), (second, 2), (third, 5)):
+            self.counter.record(post.pk, views)
+
+        # Одинаковый прирост - один UPDATE: два UPDATE + SAVEPOINT/RELEASE
+        with self.assertNumQueries(4):
+            self.assertEqual(self.counter.flush(), 3)
+
+        self.assertEqual(
+            dict(Post.objects.values_list('pk', 'views_count')),
+            {first.pk: 2, second.pk: 2, third.pk: 5}
+        )
+        self.assertEqual(self.counter.pending(first.pk), 0)
+
+    def test_failed_flush_returns_views_to_buffer(self):
+        post = self.posts[0]
+        self.counter.record(post.pk, 3)
+
+        with mock.patch('django.db.models.QuerySet.update', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.counter.flush()
+
+        self.assertEqual(self.counter.pending(post.pk), 3)
+
+    def test_rolled_back_request_does_not_stop_flushing(self):
+        post = self.posts[0]
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.counter.record(post.pk)
+                raise ValueError
+
+        self.counter.record(post.pk)
+        self.counter.flush()
+        post.refresh_from_db()
+        self.assertEqual(post.views_count, 2)
+
+
+    def test_failed_flush_in_thread_is_logged(self):
+        self.counter.record(self.posts[0].pk)
+
+        # Соединение теста не закрываем: в потоке сброса оно собственное
+        with mock.patch('django.db.models.QuerySet.update', side_effect=RuntimeError), \
+                mock.patch('apps.main.counters.connection'), \
+                self.assertLogs('apps.main.counters', 'ERROR') as logs:
+            self.counter._flush_in_thread()
+
+        self.assertTrue(any('flush thread' in line for line in logs.output))
+        self.assertEqual(self.counter.pending(self.posts[0].pk), 1)
+
+    def test_list_includes_buffered_views(self):
+        first, second, _ = self.posts
+        Post.objects.update(status='published')
+        get_response_cache().clear()
+        self.counter.record(first.pk, 4)
+
+        with mock.patch('apps.main.serializers.get_view_counter', return_value=self.counter):
+            response = APIClient().get('/api/v1/posts/')
+
+        views = {post['id']: post['views_count'] for post in response.data['results']}
+        self.assertEqual((views[first.pk], views[second.pk]), (4, 0))
+
+
+class ViewCounterFlusherTests(TransactionTestCase):
+
+    def test_flusher_runs_without_new_views(self):
+        counter = ViewCounter(LocalViewBuffer(), flush_interval=0.01)
+        flushed = threading.Event()
+        calls = []
+
+        def flush():
+            calls.append(1)
+            if len(calls) >= 3:
+                flushed.set()
+            return 0
+
+        with mock.patch.object(counter, 'flush', side_effect=flush):
+            counter.record(1)
+            self.assertTrue(flushed.wait(5))
+            counter.stop_flusher()
+
+        self.assertGreaterEqual(len(calls), 3)
+
+    def test_flusher_is_started_once_per_process(self):
+        counter = ViewCounter(LocalViewBuffer(), flush_interval=3600)
+        self.addCleanup(counter.stop_flusher)
+
+        counter.record(1)
+        flusher = counter._flusher
+        counter.record(2)
+
+        self.assertIs(counter._flusher, flusher)
+        self.assertTrue(flusher.is_alive())
+
+
+class RedisViewBufferTests(TestCase):
+
+    def test_each_drain_uses_its_own_key(self):
+        client = mock.MagicMock()
+        client.pipeline.return_value.execute.return_value = ({b'1': b'2'}, 1)
+        with mock.patch('redis.Redis.from_url', return_value=client):
+            buffer = RedisViewBuffer('redis://localhost')
+
+        self.assertEqual(buffer.drain(), {1: 2})
+        self.assertEqual(buffer.drain(), {1: 2})
+
+        first, second = (call.args[1] for call in client.rename.call_args_list)
+        self.assertNotEqual(first, second)
+        self.assertTrue(first.startswith('post_views:pending:draining:'))
+
+
+class PostFeedTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_subscriber(f'user{i}') for i in range(3)]
+        category = Category.objects.create(name='News')
+        cls.posts = (
+            create_posts(20, author=cls.users[0], category=category)
+            + create_posts(5, author=cls.users[1], category=category)
+        )
+        # Старый пост закреплен раньше нового: закрепленные идут по pinned_at
+        cls.pinned = [cls.posts[10], cls.posts[21]]
+        for user, post in zip(cls.users, cls.pinned):
+            PinnedPost.objects.create(user=user, post=post)
+
+    def test_queryset_puts_pinned_posts_first_in_two_queries(self):
+        with self.assertNumQueries(2):
+            posts = list(PostFeed().queryset())
+
+        self.assertEqual(posts[:2], self.pinned)
+        regular = posts[2:]
+        self.assertEqual(len(regular), 23)
+        self.assertEqual(
+            [post.pk for post in regular],
+            [post.pk for post in sorted(regular, key=lambda p: (p.created_at, p.pk), reverse=True)]
+        )
+
+    def test_page_query_count_does_not_depend_on_page_size(self):
+        for limit in (5, 20):
+            with self.subTest(limit=limit), self.assertNumQueries(3):
+                posts, cursor = PostFeed().page(limit=limit)
+                for post in posts:
+                    post.author.username, post.category.name, post.is_pinned
+
+            self.assertEqual(posts[:2], self.pinned)
+            self.assertEqual(len(posts), 2 + limit)
+            self.assertIsNotNone(cursor)
+
+    def test_pages_cover_feed_without_duplicates(self):
+        feed = PostFeed()
+        posts, cursor = feed.page(limit=10)
+        seen = [post.pk for post in posts]
+        while cursor:
+            # Следующие страницы - только обычные посты: ID закрепленных уже известны
+            with self.assertNumQueries(1):
+                posts, cursor = feed.page(cursor=cursor, limit=10)
+            seen.extend(post.pk for post in posts)
+
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(set(seen), {post.pk for post in self.posts})
+
+    def test_expired_subscription_is_not_pinned_first(self):
+        Subscription.objects.filter(user=self.users[0]).update(end_date=timezone.now())
+
+        posts = list(PostFeed().queryset())
+
+        self.assertEqual(posts[0], self.pinned[1])
+        self.assertNotEqual(posts[1], self.pinned[0])
+
+
+class PostListQueryCountTests(TestCase):
+    """Число запросов списков постов не зависит от числа постов и комментариев"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_subscriber('reader')
+        cls.category = Category.objects.create(name='News')
+        cls.posts = create_posts(3, author=cls.user, category=cls.category)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_posts_with_comments(self, count):
+        author = User.objects.create(email='writer@example.com', username='writer')
+        for post in create_posts(count, author=self.user, category=self.category, prefix='more'):
+            for _ in range(3):
+                comment = Comment.objects.create(post=post, author=author, content='text')
+                Comment.objects.create(post=post, author=author, content='reply', parent=comment)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_list_endpoints(self):
+        for url in ('/api/v1/posts/', '/api/v1/posts/popular/', '/api/v1/posts/recent/',
+                    '/api/v1/posts/my-posts/', '/api/v1/posts/?pagination=cursor'):
+            with self.subTest(url=url):
+                before, _ = self.count_queries(url)
+                self.add_posts_with_comments(8)
+                after, _ = self.count_queries(url)
+                self.assertEqual(before, after)
+                Post.objects.exclude(pk__in=[post.pk for post in self.posts]).delete()
+                User.objects.filter(username='writer').delete()
+
+    def test_comments_count_excludes_inactive_comments(self):
+        post = self.posts[0]
+        comment = Comment.objects.create(post=post, author=self.user, content='text')
+        Comment.objects.create(post=post, author=self.user, content='reply', parent=comment)
+        Comment.objects.create(post=post, author=self.user, content='hidden', is_active=False)
+
+        _, response = self.count_queries('/api/v1/posts/')
+
+        counts = {item['id']: item['comments_count'] for item in response.data['results']}
+        self.assertEqual(counts[post.pk], 2)
+
+
+class CursorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.posts = create_posts(3)
+
+    def test_round_trip(self):
+        post = self.posts[0]
+        cursor = encode_cursor([post.created_at, post.pk])
+
+        self.assertEqual(decode_cursor(cursor, FEED_ORDERING, Post), [post.created_at, post.pk])
+        self.assertIsNone(decode_cursor('', FEED_ORDERING, Post))
+        self.assertIsNone(decode_cursor(None, FEED_ORDERING, Post))
+
+    def test_invalid_cursors(self):
+        def raw(value):
+            return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+        created_at = self.posts[0].created_at.isoformat()
+        cursors = {
+            'not base64': '!!!',
+            'not json': base64.urlsafe_b64encode(b'{').decode(),
+            'not a list': raw({'id': 1}),
+            'too short': raw([created_at]),
+            'too long': raw([created_at, 1, 2]),
+            'null value': raw([None, 1]),
+            'bad datetime': raw(['yesterday', 1]),
+            'bad id': raw([created_at, 'one']),
+            'nested': raw([created_at, [1]]),
+            'bool': raw([created_at, True]),
+        }
+        for name, cursor in cursors.items():
+            with self.subTest(name), self.assertRaises(NotFound):
+                decode_cursor(cursor, FEED_ORDERING, Post)
+
+    def test_endpoints_reject_invalid_cursor(self):
+        category = Category.objects.get()
+        client = APIClient()
+        for url in ('/api/v1/posts/?cursor=!!!',
+                    f'/api/v1/posts/categories/{category.slug}/posts/?limit=2&cursor=!!!',
+                    f'/api/v1/comments/post/{self.posts[0].pk}/?limit=2&cursor=!!!'):
+            with self.subTest(url=url):
+                response = client.get(url)
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+    def test_keyset_pages_through_post_list(self):
+        posts = self.posts + create_posts(
+            20, author=self.posts[0].author, category=self.posts[0].category, prefix='more'
+        )
+        client = APIClient()
+        response = client.get('/api/v1/posts/?pagination=cursor')
+        pages = [response.data['results']]
+        while response.data['next']:
+            response = client.get(response.data['next'])
+            pages.append(response.data['results'])
+
+        self.assertEqual([len(page) for page in pages], [20, 3])
+        seen = [post['id'] for page in pages for post in page]
+        self.assertEqual(sorted(seen), sorted(post.pk for post in posts))
+
+
+class ResponseCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.posts = create_posts(3)
+
+    def setUp(self):
+        get_response_cache().clear()
+        self.client = APIClient()
+
+    def test_cached_response_needs_no_queries(self):
+        first = self.client.get('/api/v1/posts/recent/')
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get('/api/v1/posts/recent/')
+
+        # Остаются только SAVEPOINT/RELEASE транзакции запроса (ATOMIC_REQUESTS)
+        self.assertFalse([q['sql'] for q in queries if 'SAVEPOINT' not in q['sql']])
+
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(get_metrics(['recent_posts'])['recent_posts']['hits'], 1)
+
+    def test_post_change_invalidates_response(self):
+        self.client.get('/api/v1/posts/recent/')
+        post = self.posts[0]
+        post.title = 'Updated'
+        post.save()
+
+        response = self.client.get('/api/v1/posts/recent/')
+
+        titles = {item['id']: item['title'] for item in response.json()}
+        self.assertEqual(titles[post.pk], 'Updated')
+
+    def test_response_cached_inside_transaction_is_invalidated_on_commit(self):
+        post = self.posts[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            post.title = 'Updated'
+            post.save()
+            # Параллельный запрос до коммита кеширует ответ со старыми данными
+            cache = get_response_cache()
+            key = _version_key('posts')
+            stale_version = cache.get(key)
+            self.client.get('/api/v1/posts/recent/')
+            self.assertEqual(get_metrics(['recent_posts'])['recent_posts']['misses'], 1)
+
+        self.assertNotEqual(cache.get(key), stale_version)
+        self.client.get('/api/v1/posts/recent/')
+        self.assertEqual(get_metrics(['recent_posts'])['recent_posts']['misses'], 2)
+
+    def test_authenticated_requests_bypass_cache(self):
+        self.client.force_authenticate(self.posts[0].author)
+        self.client.get('/api/v1/posts/recent/')
+
+        self.assertEqual(get_metrics(['recent_posts'])['recent_posts']['misses'], 0)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_response_cache', '/api/v1/posts/recent/', requests=3, stdout=out)
+
+        self.assertRegex(out.getvalue(), r'/api/v1/posts/recent/: cache off [\d.]+ rps, cache on [\d.]+ rps')
+
+
+class CategoryStatsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(email='author@example.com', username='author')
+
+    def setUp(self):
+        self.client = APIClient()
+        # Запросы считаются без кеша ответов
+        self.client.force_authenticate(self.author)
+
+    def add_category(self, name, published=2, drafts=1):
+        category = Category.objects.create(name=name)
+        create_posts(published, author=self.author, category=category, prefix=f'{name}-p', views_count=5)
+        create_posts(drafts, author=self.author, category=category, prefix=f'{name}-d', status='draft')
+        return category
+
+    def test_categories_query_count_is_constant(self):
+        self.add_category('first')
+        # SAVEPOINT/RELEASE запроса, COUNT для пагинации и список со статистикой
+        with self.assertNumQueries(4):
+            self.client.get('/api/v1/posts/categories/')
+
+        for i in range(10):
+            self.add_category(f'more{i}')
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/v1/posts/categories/')
+
+        self.assertEqual(response.data['count'], 11)
+
+    def test_stats_count_published_posts_only(self):
+        category = self.add_category('news', published=3, drafts=2)
+        Category.objects.create(name='empty')
+
+        response = self.client.get('/api/v1/posts/categories/')
+
+        stats = {item['name']: item for item in response.data['results']}
+        self.assertEqual(stats['news']['posts_count'], 3)
+        self.assertEqual(stats['news']['total_views'], 15)
+        self.assertIsNotNone(stats['news']['latest_post_at'])
+        self.assertEqual(stats['empty']['posts_count'], 0)
+        self.assertEqual(stats['empty']['total_views'], 0)
+        self.assertIsNone(stats['empty']['latest_post_at'])
+
+        detail = self.client.get(f'/api/v1/posts/categories/{category.slug}/')
+        self.assertEqual(detail.data['posts_count'], 3)
+
+
+class PostSearchTests(TestCase):
+    """Поиск через API на backend текущей БД: PostgreSQL или индекс в памяти"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(email='author@example.com', username='author')
+        category = Category.objects.create(name='News')
+
+        def create(slug, title, content):
+            return Post.objects.create(
+                title=title, slug=slug, content=content, author=author,
+                category=category, status='published'
+            )
+
+        cls.in_title = create('in-title', 'Python packaging guide', 'How to build wheels.')
+        cls.in_content = create('in-content', 'Weekly notes', 'A short remark about Python.')
+        cls.unrelated = create('unrelated', 'Gardening', 'Tomatoes and cucumbers.')
+        cls.html = create(
+            'html', 'Release notes', '<script>alert(1)</script> If 2 < 3 & 3 > 2 the changelog is right.'
+        )
+
+    def setUp(self):
+        get_search_backend().rebuild()
+
+    def search(self, term):
+        response = APIClient().get('/api/v1/posts/', {'search': term})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_title_matches_rank_first(self):
+        results = self.search('python')
+
+        self.assertEqual([post['id'] for post in results], [self.in_title.pk, self.in_content.pk])
+
+    def test_prefix_matching(self):
+        self.assertEqual(
+            [post['id'] for post in self.search('pyth')], [self.in_title.pk, self.in_content.pk]
+        )
+        # Все слова запроса обязательны
+        self.assertEqual([post['id'] for post in self.search('pyth pack')], [self.in_title.pk])
+        self.assertEqual(self.search('cobol'), [])
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_highlight_escapes_post_html(self):
+        highlight = self.search('changelog')[0]['highlight']
+
+        self.assertIn('<mark>changelog</mark>', highlight)
+        self.assertNotIn('<script>', highlight)
+        self.assertIn('2 &lt; 3 &amp; 3 &gt; 2', highlight)
+
+    def test_render_headline(self):
+        self.assertEqual(
+            render_headline('<b>\x02word\x03</b>'),
+            '&lt;b&gt;<mark>word</mark>&lt;/b&gt;'
+        )
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'search_vector is PostgreSQL only')
+    def test_migration_backfills_existing_posts(self):
+        Post.objects.update(search_vector=None)
+        self.assertEqual(self.search('python'), [])
+
+        migration = import_module('apps.main.migrations.0005_backfill_post_search_vector')
+        migration.backfill_search_vector(apps, SimpleNamespace(connection=connection))
+
+        self.assertEqual(len(self.search('python')), 2)
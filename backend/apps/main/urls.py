@@ -14,5 +14,6 @@ urlpatterns = [
     path('pinned/', views.pinned_posts_only, name='pinned-posts-only'),
     path('featured/', views.featured_posts, name='featured-posts'),
     path('recent/', views.recent_posts, name='recent-posts'),
+    path('cache-metrics/', views.response_cache_metrics, name='response-cache-metrics'),
     path('<slug:slug>/', views.PostDetailView.as_view(), name='post-detail'),
 ]
\ No newline at end of file
@@ -4,8 +4,13 @@ from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 
 from .models import Category, Post
+from .cache import POST_LIST_DEPENDENCIES, cache_response, get_metrics, registered_endpoints
+from .feed import PostFeed
+from .pagination import is_keyset_request
+from .search import PostSearchFilter
 from .serializers import (
     CategorySerializer,
     PostListSerializer,
@@ -17,7 +22,7 @@ from .permissions import IsAuthorOrReadOnly
 
 class CategoryListCreateView(generics.ListCreateAPIView):
     """API endpoint для категорий"""
-    queryset = Category.objects.all()
+    queryset = Category.objects.with_stats()
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
@@ -25,10 +30,14 @@ class CategoryListCreateView(generics.ListCreateAPIView):
     ordering_fields = ['name', 'created_at']
     ordering = ['name']
 
+    @method_decorator(cache_response('categories', ('categories', 'posts')))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
     """API endpoint для конкретной категории"""
-    queryset = Category.objects.all()
+    queryset = Category.objects.with_stats()
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     lookup_field = 'slug'
@@ -41,16 +50,18 @@ class PostListCreateView(generics.ListCreateAPIView):
     """
     serializer_class = PostListSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, PostSearchFilter]
     filterset_fields = ['category', 'author', 'status']
-    search_fields = ['title', 'content']
     ordering_fields = ['created_at', 'updated_at', 'views_count', 'title']
     ordering = ['-created_at']
 
     def get_queryset(self):
         """Возвращает посты с учетом прав доступа"""
 
-        queryset = Post.objects.select_related('author', 'category')
+        queryset = Post.objects.select_related(
+            'author', 'category', 'pin_info', 'pin_info__user',
+            'pin_info__user__subscription'
+        )
 
         # фильрация по правам доступа
         if not self.request.user.is_authenticated:
@@ -60,16 +71,18 @@ class PostListCreateView(generics.ListCreateAPIView):
                 Q(status='published') | Q(author=self.request.user)
             )
 
-        # Проверяем, нужна ли сортировка с учетом закрепленных постов
-        ordering = self.request.query_params.get('ordering', '')
-        show_pinned_first = not ordering or ordering in ['-created_at', 'created_at']
+        return queryset
 
-        if show_pinned_first:
-            return Post.get_posts_for_feed().filter(
-                Q(status='published') | (
-                    Q(author=self.request.user) if self.request.user.is_authenticated else Q()
-                )
-            )
+    def filter_queryset(self, queryset):
+        """Применяет фильтры; без явной сортировки закрепленные посты идут первыми"""
+        queryset = super().filter_queryset(queryset)
+
+        # В keyset-режиме лента идет строго по дате, при поиске - по релевантности
+        params = self.request.query_params
+        if (params.get('ordering', '') in ['', '-created_at']
+                and not params.get('search')
+                and not is_keyset_request(self.request)):
+            return Post.get_posts_for_feed(queryset)
 
         return queryset
 
@@ -102,7 +115,7 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
         return PostDetailSerializer
 
     def retrieve(self, request, *args, **kwargs):
-        """Увеличивает счетчик просмотров при GET запросе"""
+        """Регистрирует просмотр при GET запросе"""
         instance = self.get_object()
 
         if request.method == 'GET':
@@ -116,70 +129,53 @@ class MyPostsView(generics.ListAPIView):
     """API endpoint для постов текущего пользователя"""
     serializer_class = PostListSerializer
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, PostSearchFilter]
     filterset_fields = ['category', 'status']
-    search_fields = ['title', 'content']
     ordering_fields = ['created_at', 'updated_at', 'views_count', 'title']
     ordering = ['-created_at']
 
     def get_queryset(self):
         return Post.objects.filter(
             author=self.request.user
-        ).select_related('author', 'category')
+        ).select_related(
+            'author', 'category', 'pin_info', 'pin_info__user',
+            'pin_info__user__subscription'
+        )
 
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def post_by_category(request, category_slug):
     """Посты определенной категории"""
-    category = get_object_or_404(Category, slug=category_slug)
-
-    # Получаем посты с учетом закрепления
-    # Используем менеджер модели для получения with_subscription_info
-    posts = Post.objects.with_subscription_info().filter(
-        category=category,
-        status='published'
-    )
-
-    # Сортируем с учетом закрепленных постов
-    # Используем сложную аннотацию для правильной сортировки
-    from django.db.models import Case, When, Value, DateTimeField, BooleanField
-    from django.utils import timezone
-
-    posts = posts.annotate(
-        effective_date=Case(
-            When(
-                pin_info__isnull=False,
-                pin_info__user__subscription__status='active',
-                pin_info__user__subscription__end_date__gt=timezone.now(),
-                then='pin_info__pinned_at'
-            ),
-            default='created_at',
-            output_field=DateTimeField()
-        ),
-        is_pinned_flag=Case(
-            When(
-                pin_info__isnull=False,
-                pin_info__user__subscription__status='active',
-                pin_info__user__subscription__end_date__gt=timezone.now(),
-                then=Value(True)
-            ),
-            default=Value(False),
-            output_field=BooleanField()
+    category = get_object_or_404(Category.objects.with_stats(), slug=category_slug)
+
+    # Лента категории: закрепленные посты первыми, затем по дате
+    feed = PostFeed(Post.objects.filter(category=category, status='published'))
+
+    # С параметром limit отдаем keyset-страницу, иначе всю ленту
+    next_cursor = None
+    limit = request.query_params.get('limit')
+    if limit and limit.isdigit():
+        posts, next_cursor = feed.page(
+            cursor=request.query_params.get('cursor'),
+            limit=min(int(limit), 100)
         )
-    ).order_by('-is_pinned_flag', 'effective_date', '-created_at')
+    else:
+        posts = feed.queryset()
 
     serializer = PostListSerializer(posts, many=True, context={'request': request})
 
     return Response({
         'category': CategorySerializer(category).data,
         'posts': serializer.data,
-        'pinned_posts_count': sum(1 for post in serializer.data if post.get('is_pinned', False))
+        'pinned_posts_count': sum(1 for post in serializer.data if post.get('is_pinned', False)),
+        'next_cursor': next_cursor
     })
 
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@cache_response('popular_posts', POST_LIST_DEPENDENCIES)
 def popular_posts(request):
     """10 самых популярных постов"""
     posts = Post.objects.with_subscription_info().filter(
@@ -196,6 +192,7 @@ def popular_posts(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@cache_response('recent_posts', POST_LIST_DEPENDENCIES)
 def recent_posts(request):
     """10 последних опубликованных постов"""
     posts = Post.objects.with_subscription_info().filter(
@@ -212,22 +209,24 @@ def recent_posts(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@cache_response('pinned_posts_only', POST_LIST_DEPENDENCIES)
 def pinned_posts_only(request):
     """Только закрепленные посты"""
-    posts = Post.objects.pinned_posts()
+    posts = list(PostFeed().pinned())
     serializer = PostListSerializer(
         posts,
         many=True,
         context={'request': request}
     )
     return Response({
-        'count': posts.count(),
+        'count': len(posts),
         'results': serializer.data
     })
 
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@cache_response('featured_posts', POST_LIST_DEPENDENCIES)
 def featured_posts(request):
     """
     Рекомендуемые посты для главной страницы:
@@ -237,8 +236,9 @@ def featured_posts(request):
     from django.utils import timezone
     from datetime import timedelta
 
-    # Получаем последние 3 закрепленных поста
-    pinned_posts = Post.objects.pinned_posts()[:3]
+    # Получаем первые 3 закрепленных поста
+    feed = PostFeed()
+    pinned_posts = list(feed.pinned()[:3])
 
     # Получаем популярные посты за неделю (исключая уже закрепленные)
     week_ago = timezone.now() - timedelta(days=7)
@@ -264,7 +264,7 @@ def featured_posts(request):
     return Response({
         'pinned_posts': pinned_serializer.data,
         'popular_posts': popular_serializer.data,
-        'total_pinned': Post.objects.pinned_posts().count()
+        'total_pinned': len(feed.pinned_ids)
     })
 
 
@@ -277,8 +277,10 @@ def toggle_post_pin_status(request, slug):
     """
     post = get_object_or_404(Post, slug=slug, author=request.user, status='published')
 
+    from apps.subscribe.entitlements import has_entitlement
+
     # Проверяем подписку
-    if not hasattr(request.user, 'subscription') or not request.user.subscription.is_active:
+    if not has_entitlement(request.user, 'pin_posts'):
         return Response({
             'error': 'Active subscription required to pin posts'
         }, status=status.HTTP_403_FORBIDDEN)
@@ -311,4 +313,11 @@ def toggle_post_pin_status(request, slug):
     except Exception as e:
         return Response({
             'error': str(e)
-        }, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def response_cache_metrics(request):
+    """Попадания и промахи кеша ответов по эндпоинтам"""
+    return Response(get_metrics(registered_endpoints))
@@ -119,15 +119,25 @@ class PaymentAdmin(admin.ModelAdmin):
     actions = ['mark_as_succeeded', 'mark_as_failed', 'export_payments']
 
     def mark_as_succeeded(self, request, queryset):
-        """Помечает платежи как успешные"""
-        count = queryset.filter(status__in=['pending', 'processing']).update(status='succeeded')
+        """Помечает платежи как успешные (с активацией подписки)"""
+        from .services import PaymentService
+
+        count = 0
+        for payment in queryset.filter(status__in=['pending', 'processing']):
+            if PaymentService.process_successful_payment(payment):
+                count += 1
         self.message_user(request, f'{count} payments marked as succeeded.')
 
     mark_as_succeeded.short_description = "Mark selected payments as succeeded"
 
     def mark_as_failed(self, request, queryset):
-        """Помечает платежи как неудачные"""
-        count = queryset.filter(status__in=['pending', 'processing']).update(status='failed')
+        """Помечает платежи как неудачные (с отменой подписки)"""
+        from .services import PaymentService
+
+        count = 0
+        for payment in queryset.filter(status__in=['pending', 'processing']):
+            if PaymentService.process_failed_payment(payment, 'Marked as failed by admin'):
+                count += 1
         self.message_user(request, f'{count} payments marked as failed.')
 
     mark_as_failed.short_description = "Mark selected payments as failed"
@@ -249,18 +259,21 @@ class RefundAdmin(admin.ModelAdmin):
 class WebhookEventAdmin(admin.ModelAdmin):
     list_display = (
         'id', 'provider', 'event_type', 'status_display',
-        'error_message_short', 'created_at'
+        'attempts', 'next_attempt_at', 'error_message_short', 'created_at'
     )
     list_filter = ('provider', 'status', 'event_type', 'created_at')
     search_fields = ('event_id', 'event_type', 'error_message')
-    readonly_fields = ('provider', 'event_id', 'event_type', 'data', 'created_at', 'processed_at')
+    readonly_fields = (
+        'provider', 'event_id', 'event_type', 'data', 'attempts', 'next_attempt_at',
+        'created_at', 'processed_at'
+    )
 
     fieldsets = (
         (None, {
             'fields': ('provider', 'event_id', 'event_type', 'status')
         }),
         ('Processing', {
-            'fields': ('error_message',)
+            'fields': ('error_message', 'attempts', 'next_attempt_at')
         }),
         ('Data', {
             'fields': ('data',),
@@ -278,7 +291,8 @@ class WebhookEventAdmin(admin.ModelAdmin):
             'processed': 'green',
             'failed': 'red',
             'pending': 'orange',
-            'ignored': 'gray'
+            'ignored': 'gray',
+            'dead': 'darkred'
         }
         color = colors.get(obj.status, 'black')
         return format_html(
@@ -306,7 +320,7 @@ class WebhookEventAdmin(admin.ModelAdmin):
         # Разрешаем удаление только старых записей
         return request.user.is_superuser
 
-    actions = ['mark_as_processed', 'retry_failed_events']
+    actions = ['mark_as_processed', 'retry_failed_events', 'requeue_dead_events']
 
     def mark_as_processed(self, request, queryset):
         """Помечает события как обработанные"""
@@ -321,11 +335,20 @@ class WebhookEventAdmin(admin.ModelAdmin):
 
         count = 0
         for event in queryset.filter(status='failed'):
-            success = WebhookService.process_stripe_webhook(event.data)
-            if success:
-                event.mark_as_processed()
+            if WebhookService.handle_event(event):
                 count += 1
 
         self.message_user(request, f'{count} events reprocessed successfully.')
 
-    retry_failed_events.short_description = "Retry failed events"
\ No newline at end of file
+    retry_failed_events.short_description = "Retry failed events"
+
+    def requeue_dead_events(self, request, queryset):
+        """Возвращает dead события в очередь повторной обработки"""
+        count = 0
+        for event in queryset.filter(status='dead'):
+            event.requeue()
+            count += 1
+
+        self.message_user(request, f'{count} events requeued.')
+
+    requeue_dead_events.short_description = "Requeue dead events"
@@ -0,0 +1,64 @@
+"""
+Клиент Stripe пользователя.
+
+ID клиента хранится в User.stripe_customer_id и кешируется в памяти процесса,
+поэтому клиент создается в Stripe один раз на пользователя, а не на каждый
+платеж. Одновременное создание защищено ключом идемпотентности
+('customer:<user_id>') и условным UPDATE: сохраняется первый записанный ID.
+"""
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+
+MEMO_SIZE = 10000
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def _remember(user_id, customer_id):
+    with _memo_lock:
+        _memo[user_id] = customer_id
+        _memo.move_to_end(user_id)
+        if len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+
+
+def _recall(user_id):
+    with _memo_lock:
+        customer_id = _memo.get(user_id)
+        if customer_id:
+            _memo.move_to_end(user_id)
+        return customer_id
+
+
+def get_customer_id(user, create=True) -> Optional[str]:
+    """ID клиента Stripe пользователя; при create=True клиент создается при отсутствии"""
+    from .services import StripeService
+
+    customer_id = _recall(user.pk) or user.stripe_customer_id
+    if customer_id:
+        _remember(user.pk, customer_id)
+        return customer_id
+    if not create:
+        return None
+
+    customer_id = StripeService.create_customer(user)
+    if not customer_id:
+        return None
+
+    User = get_user_model()
+    updated = User.objects.filter(
+        Q(stripe_customer_id__isnull=True) | Q(stripe_customer_id=''),
+        pk=user.pk
+    ).update(stripe_customer_id=customer_id)
+    if not updated:
+        # Клиент уже записан другим запросом - используем его
+        customer_id = User.objects.values_list('stripe_customer_id', flat=True).get(pk=user.pk)
+
+    user.stripe_customer_id = customer_id
+    _remember(user.pk, customer_id)
+    return customer_id
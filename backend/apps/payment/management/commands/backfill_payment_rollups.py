@@ -0,0 +1,61 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from apps.payment.models import Payment
+from apps.payment.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Build daily payment rollups from payment history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-days',
+            type=int,
+            default=30,
+            help='Number of days rebuilt per transaction',
+        )
+        parser.add_argument(
+            '--from',
+            dest='date_from',
+            help='First day to rebuild (YYYY-MM-DD), defaults to the oldest payment',
+        )
+        parser.add_argument(
+            '--to',
+            dest='date_to',
+            help='Last day to rebuild (YYYY-MM-DD), defaults to today',
+        )
+
+    def handle(self, *args, **options):
+        chunk_days = options['chunk_days']
+        if chunk_days < 1:
+            raise CommandError('--chunk-days must be positive')
+
+        bounds = Payment.objects.aggregate(first=Min('created_at'), last=Max('created_at'))
+        if bounds['first'] is None:
+            self.stdout.write('No payments found')
+            return
+
+        try:
+            start = (
+                date.fromisoformat(options['date_from']) if options['date_from']
+                else timezone.localtime(bounds['first']).date()
+            )
+            end = date.fromisoformat(options['date_to']) if options['date_to'] else timezone.localdate()
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        total_rows = 0
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+            rows = rebuild_rollups(chunk_start, chunk_end)
+            total_rows += rows
+            self.stdout.write(f'{chunk_start}..{chunk_end}: {rows} rows')
+            chunk_start = chunk_end + timedelta(days=1)
+
+        self.stdout.write(f'Rollup rows: {total_rows}')
+        self.stdout.write(self.style.SUCCESS('Payment rollups back-filled'))
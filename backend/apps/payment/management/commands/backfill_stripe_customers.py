@@ -0,0 +1,64 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+
+from apps.payment.models import Payment
+
+
+class Command(BaseCommand):
+    help = 'Link Stripe customer IDs from existing payments to users and back-fill payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of users processed per query',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        User = get_user_model()
+
+        # Последний известный клиент Stripe пользователя по его платежам
+        latest_customer = Payment.objects.filter(
+            user=OuterRef('pk'),
+            stripe_customer_id__isnull=False
+        ).exclude(stripe_customer_id='').order_by('-created_at').values('stripe_customer_id')[:1]
+
+        linked_users = 0
+        linked_payments = 0
+        last_pk = 0
+
+        while True:
+            user_ids = list(
+                User.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not user_ids:
+                break
+            last_pk = user_ids[-1]
+
+            with transaction.atomic():
+                linked_users += User.objects.filter(
+                    Q(stripe_customer_id__isnull=True) | Q(stripe_customer_id=''),
+                    pk__in=user_ids
+                ).annotate(
+                    payment_customer_id=Subquery(latest_customer)
+                ).filter(
+                    payment_customer_id__isnull=False
+                ).update(stripe_customer_id=Subquery(latest_customer))
+
+                linked_payments += Payment.objects.filter(
+                    Q(stripe_customer_id__isnull=True) | Q(stripe_customer_id=''),
+                    user_id__in=user_ids,
+                    user__stripe_customer_id__isnull=False
+                ).exclude(user__stripe_customer_id='').update(
+                    stripe_customer_id=Subquery(
+                        User.objects.filter(pk=OuterRef('user_id')).values('stripe_customer_id')[:1]
+                    )
+                )
+
+        self.stdout.write(f'Users linked: {linked_users}')
+        self.stdout.write(f'Payments linked: {linked_payments}')
+        self.stdout.write(self.style.SUCCESS('Stripe customers back-filled'))
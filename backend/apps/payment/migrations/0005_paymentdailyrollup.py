@@ -0,0 +1,37 @@
+# Generated by Django 5.2.9 on 2026-10-18 19:52
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0004_webhookevent_retry_schedule'),
+        ('subscribe', '0002_subscription_reminder_sent_for'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('currency', models.CharField(max_length=3)),
+                ('payments_count', models.PositiveIntegerField(default=0)),
+                ('succeeded_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('plan', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='payment_rollups', to='subscribe.subscriptionplan')),
+            ],
+            options={
+                'verbose_name': 'Payment Daily Rollup',
+                'verbose_name_plural': 'Payment Daily Rollups',
+                'db_table': 'payment_daily_rollups',
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'currency', 'plan'), name='payment_rollup_unique_day'), models.UniqueConstraint(condition=models.Q(('plan__isnull', True)), fields=('date', 'currency'), name='payment_rollup_unique_day_no_plan')],
+            },
+        ),
+    ]
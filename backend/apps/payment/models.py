@@ -2,9 +2,13 @@ from django.db import models
 from django.conf import settings
 from decimal import Decimal
 
+from apps.core.tracking import FieldTrackerMixin
 
-class Payment(models.Model):
+
+class Payment(FieldTrackerMixin, models.Model):
     """Модель платежа"""
+    tracked_fields = ('status',)
+
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('processing', 'Processing'),
@@ -82,20 +86,17 @@ class Payment(models.Model):
         return self.status == 'succeeded' and self.payment_method == 'stripe'
 
     def mark_as_succeeded(self):
-        """Помечает платеж как успешный"""
-        from django.utils import timezone
-        self.status = 'succeeded'
-        self.processed_at = timezone.now()
-        self.save()
+        """Помечает платеж как успешный, возвращает False, если переход недопустим"""
+        from .transitions import transition
+        return transition(self, 'succeed')
 
     def mark_as_failed(self, reason=None):
-        """Помечает платеж как неудачный"""
-        from django.utils import timezone
-        self.status = 'failed'
-        self.processed_at = timezone.now()
+        """Помечает платеж как неудачный, возвращает False, если переход недопустим"""
+        from .transitions import transition
+        fields = {}
         if reason:
-            self.metadata['failure_reason'] = reason
-        self.save()
+            fields['metadata'] = {**self.metadata, 'failure_reason': reason}
+        return transition(self, 'fail', **fields)
 
 
 class PaymentAttempt(models.Model):
@@ -173,6 +174,47 @@ class Refund(models.Model):
         self.save()
 
 
+class PaymentDailyRollup(models.Model):
+    """
+    Дневная сводка по платежам (apps.payment.rollups): одна строка на день
+    создания платежа, валюту и тарифный план.
+    """
+    date = models.DateField()
+    currency = models.CharField(max_length=3)
+    plan = models.ForeignKey(
+        'subscribe.SubscriptionPlan',
+        on_delete=models.CASCADE,
+        related_name='payment_rollups',
+        null=True,
+        blank=True
+    )
+    payments_count = models.PositiveIntegerField(default=0)
+    succeeded_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'payment_daily_rollups'
+        verbose_name = 'Payment Daily Rollup'
+        verbose_name_plural = 'Payment Daily Rollups'
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'currency', 'plan'],
+                name='payment_rollup_unique_day'
+            ),
+            models.UniqueConstraint(
+                fields=['date', 'currency'],
+                condition=models.Q(plan__isnull=True),
+                name='payment_rollup_unique_day_no_plan'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.currency} - {self.payments_count} payments"
+
+
 class WebhookEvent(models.Model):
     """События webhook от платежных систем"""
     PROVIDER_CHOICES = [
@@ -185,6 +227,7 @@ class WebhookEvent(models.Model):
         ('processed', 'Processed'),
         ('failed', 'Failed'),
         ('ignored', 'Ignored'),
+        ('dead', 'Dead'),
     ]
 
     provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES)
@@ -193,6 +236,13 @@ class WebhookEvent(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
 
     data = models.JSONField()
+    # ID платежа из метаданных события: события одного платежа обрабатываются по порядку
+    ordering_key = models.CharField(max_length=64, blank=True, default='')
+    # Аренда обработки: пока не истекла, событие обрабатывает захвативший его воркер
+    locked_until = models.DateTimeField(null=True, blank=True)
+    # Повторные попытки обработки (apps.payment.retry)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
     processed_at = models.DateTimeField(null=True, blank=True)
     error_message = models.TextField(blank=True, null=True)
 
@@ -206,22 +256,76 @@ class WebhookEvent(models.Model):
         indexes = [
             models.Index(fields=['provider', 'event_type']),
             models.Index(fields=['status']),
+            models.Index(fields=['ordering_key', 'status']),
+            models.Index(fields=['status', 'next_attempt_at']),
         ]
 
     def __str__(self):
         return f"{self.provider} - {self.event_type} ({self.status})"
 
+    def claim(self, lease_seconds=None):
+        """
+        Захватывает событие для обработки одним условным UPDATE.
+        Возвращает False, если событие уже обработано или его обрабатывает другой воркер.
+        """
+        from datetime import timedelta
+        from django.utils import timezone
+
+        if lease_seconds is None:
+            lease_seconds = getattr(settings, 'WEBHOOK_EVENT_LEASE_SECONDS', 300)
+        now = timezone.now()
+        locked_until = now + timedelta(seconds=lease_seconds)
+
+        claimed = WebhookEvent.objects.filter(
+            models.Q(locked_until__isnull=True) | models.Q(locked_until__lt=now),
+            pk=self.pk,
+            status__in=['pending', 'failed']
+        ).update(locked_until=locked_until)
+
+        if claimed:
+            self.locked_until = locked_until
+        return bool(claimed)
+
     def mark_as_processed(self):
         """Помечает событие как обработанное"""
         from django.utils import timezone
         self.status = 'processed'
         self.processed_at = timezone.now()
+        self.locked_until = None
+        self.save()
+
+    def mark_as_ignored(self):
+        """Помечает событие как игнорируемое"""
+        self.status = 'ignored'
+        self.locked_until = None
         self.save()
 
     def mark_as_failed(self, error_message):
-        """Помечает событие как неудачно обработанное"""
+        """
+        Помечает событие как неудачно обработанное и планирует повторную попытку.
+        После исчерпания попыток событие переводится в dead.
+        """
+        from datetime import timedelta
         from django.utils import timezone
-        self.status = 'failed'
+        from .retry import backoff_delay, max_attempts
+
+        now = timezone.now()
+        self.attempts += 1
         self.error_message = error_message
-        self.processed_at = timezone.now()
+        self.processed_at = now
+        self.locked_until = None
+        if self.attempts >= max_attempts():
+            self.status = 'dead'
+            self.next_attempt_at = None
+        else:
+            self.status = 'failed'
+            self.next_attempt_at = now + timedelta(seconds=backoff_delay(self.attempts))
+        self.save()
+
+    def requeue(self):
+        """Возвращает событие из dead в очередь повторной обработки"""
+        from django.utils import timezone
+        self.status = 'failed'
+        self.attempts = 0
+        self.next_attempt_at = timezone.now()
         self.save()
\ No newline at end of file
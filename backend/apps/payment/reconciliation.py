@@ -0,0 +1,151 @@
+"""
+Сверка ожидающих платежей со Stripe.
+
+Вместо запроса к Stripe на каждый опрос payment_status периодическая задача
+получает недавние checkout сессии постранично (list API), сопоставляет их
+с ожидающими платежами по stripe_session_id и применяет переходы статусов
+(apps.payment.transitions). Оплаченные сессии завершают платеж успешно,
+истекшие - неудачно.
+
+Здесь же восстанавливаются "осиротевшие" платежи checkout: платеж создается
+до запроса к Stripe, и если процесс завершился между этими шагами,
+у платежа нет stripe_session_id.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Payment
+
+logger = logging.getLogger(__name__)
+
+# Запас на расхождение часов с Stripe при выборе нижней границы created
+CLOCK_SKEW = timedelta(minutes=5)
+
+
+def get_sessions_api():
+    """
+    Источник checkout сессий: StripeService или заглушка для работы без сети
+    (STRIPE_FAKE_CLIENT=True, apps.payment.stripe_fake).
+    """
+    if getattr(settings, 'STRIPE_FAKE_CLIENT', False):
+        from .stripe_fake import get_fake_stripe_client
+        return get_fake_stripe_client()
+
+    from .services import StripeService
+    return StripeService
+
+
+def sessions_created_gte(payments):
+    """
+    Нижняя граница created для списка сессий: сессия создается после
+    своего платежа, поэтому достаточно самого старого из payments.
+    """
+    oldest = min(payment.created_at for payment in payments)
+    return int((oldest - CLOCK_SKEW).timestamp())
+
+
+def iter_checkout_sessions(sessions_api, created_gte, page_size=100):
+    """Перебирает все checkout сессии, созданные не раньше created_gte"""
+    starting_after = None
+    while True:
+        sessions, has_more = sessions_api.list_checkout_sessions(
+            created_gte, starting_after=starting_after, limit=page_size
+        )
+        yield from sessions
+        if not has_more or not sessions:
+            break
+        starting_after = sessions[-1]['id']
+
+
+def reconcile_checkout_sessions(sessions_api=None, lookback_hours=24, page_size=100):
+    """Применяет к ожидающим платежам итог их checkout сессий, возвращает статистику"""
+    from .services import PaymentService
+
+    since = timezone.now() - timedelta(hours=lookback_hours)
+    pending = {
+        payment.stripe_session_id: payment
+        for payment in Payment.objects.filter(
+            status__in=['pending', 'processing'],
+            stripe_session_id__isnull=False,
+            created_at__gte=since
+        ).select_related('subscription', 'subscription__plan')
+    }
+
+    stats = {'pending_payments': len(pending), 'sessions_seen': 0, 'succeeded': 0, 'failed': 0}
+    if not pending:
+        return stats
+
+    sessions_api = sessions_api or get_sessions_api()
+    created_gte = sessions_created_gte(pending.values())
+
+    # Сессии идут от новых к старым; перебор останавливается, как только найдены все платежи
+    for session in iter_checkout_sessions(sessions_api, created_gte, page_size):
+        stats['sessions_seen'] += 1
+        payment = pending.pop(session['id'], None)
+        if payment is None:
+            continue
+
+        # Обработчики возвращают True и для уже завершенного платежа - считаем по статусу
+        if session['payment_status'] == 'paid':
+            PaymentService.process_successful_payment(payment)
+            if payment.status == 'succeeded':
+                stats['succeeded'] += 1
+        elif session['status'] == 'expired':
+            PaymentService.process_failed_payment(payment, 'Checkout session expired')
+            if payment.status == 'failed':
+                stats['failed'] += 1
+
+        if not pending:
+            break
+
+    logger.info(f"Stripe reconciliation: {stats}")
+    return stats
+
+
+def recover_orphaned_checkouts(sessions_api=None, orphan_minutes=None, lookback_hours=24, page_size=100):
+    """
+    Платежи без сессии старше orphan_minutes: если сессия в Stripe все же
+    создана (найдена по metadata.payment_id), она привязывается к платежу,
+    иначе платеж и его подписка отменяются.
+    """
+    from .services import PaymentService
+    from .transitions import transition
+
+    orphan_minutes = orphan_minutes or getattr(settings, 'STRIPE_CHECKOUT_ORPHAN_MINUTES', 15)
+    now = timezone.now()
+    since = now - timedelta(hours=lookback_hours)
+    orphans = {
+        str(payment.id): payment
+        for payment in Payment.objects.filter(
+            status='pending',
+            payment_method='stripe',
+            stripe_session_id__isnull=True,
+            stripe_payment_intent_id__isnull=True,
+            created_at__lt=now - timedelta(minutes=orphan_minutes),
+            created_at__gte=since
+        ).select_related('subscription')
+    }
+
+    stats = {'orphaned_payments': len(orphans), 'adopted': 0, 'cancelled': 0}
+    if not orphans:
+        return stats
+
+    sessions_api = sessions_api or get_sessions_api()
+    created_gte = sessions_created_gte(orphans.values())
+    for session in iter_checkout_sessions(sessions_api, created_gte, page_size):
+        payment_id = (session.get('metadata') or {}).get('payment_id')
+        payment = orphans.pop(str(payment_id), None)
+        if payment and transition(payment, 'start', stripe_session_id=session['id']):
+            stats['adopted'] += 1
+        if not orphans:
+            break
+
+    for payment in orphans.values():
+        if PaymentService.cancel_payment(payment):
+            stats['cancelled'] += 1
+
+    logger.info(f"Orphaned checkout recovery: {stats}")
+    return stats
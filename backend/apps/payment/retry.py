@@ -0,0 +1,91 @@
+"""
+Повторная обработка неудачных webhook событий.
+
+После неудачной обработки событие планируется на повтор с экспоненциальной
+задержкой и случайным разбросом (full jitter), чтобы повторы после сбоя
+не приходили одной волной. После WEBHOOK_RETRY_MAX_ATTEMPTS попыток событие
+переводится в dead и больше не повторяется автоматически.
+"""
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import WebhookEvent
+
+LAST_RUN_KEY = 'payment:webhook_retry:last_run'
+
+
+def max_attempts():
+    return getattr(settings, 'WEBHOOK_RETRY_MAX_ATTEMPTS', 8)
+
+
+def backoff_delay(attempts):
+    """Задержка в секундах перед следующей попыткой после attempts неудачных"""
+    base = getattr(settings, 'WEBHOOK_RETRY_BASE_DELAY', 60)
+    cap = getattr(settings, 'WEBHOOK_RETRY_MAX_DELAY', 6 * 3600)
+    return random.uniform(0, min(cap, base * 2 ** (attempts - 1)))
+
+
+def due_events(now=None):
+    """Неудачные события, время повторной обработки которых наступило"""
+    now = now or timezone.now()
+    return WebhookEvent.objects.filter(
+        Q(next_attempt_at__lte=now) | Q(next_attempt_at__isnull=True),
+        status='failed'
+    ).order_by('next_attempt_at', 'id')
+
+
+def retry_events(webhook_event_ids):
+    """
+    Повторно обрабатывает события, возвращает количество успешных.
+    Событие, завершенное успешно или переведенное в dead, больше не задерживает
+    следующие события своего платежа - они обрабатываются сразу.
+    """
+    from .services import WebhookService
+
+    succeeded = 0
+    resume_keys = set()
+    events = WebhookEvent.objects.filter(
+        pk__in=webhook_event_ids, status='failed'
+    ).order_by('next_attempt_at', 'id')
+    for webhook_event in events:
+        if WebhookService.handle_event(webhook_event):
+            succeeded += 1
+        if webhook_event.ordering_key and webhook_event.status != 'failed':
+            resume_keys.add(webhook_event.ordering_key)
+
+    for ordering_key in resume_keys:
+        WebhookService.process_pending_events(ordering_key)
+    return succeeded
+
+
+def record_run(processed, elapsed):
+    """Запоминает статистику последнего прогона (пачки) повторов для метрик"""
+    cache.set(LAST_RUN_KEY, {
+        'processed': processed,
+        'elapsed_seconds': round(elapsed, 3),
+        'rate_per_second': round(processed / elapsed, 1) if elapsed else processed,
+        'finished_at': timezone.now().isoformat(),
+    }, None)
+
+
+def retry_metrics():
+    """Размер очереди повторов, число dead событий и скорость последнего прогона"""
+    now = timezone.now()
+    failed = WebhookEvent.objects.filter(status='failed')
+    stats = failed.aggregate(oldest_due=Min('next_attempt_at'))
+    oldest_due = stats['oldest_due']
+
+    return {
+        'backlog': failed.count(),
+        'due': due_events(now).count(),
+        'dead': WebhookEvent.objects.filter(status='dead').count(),
+        'oldest_due_age_seconds': (
+            max(0, int((now - oldest_due).total_seconds())) if oldest_due else 0
+        ),
+        'last_run': cache.get(LAST_RUN_KEY),
+    }
+
@@ -0,0 +1,183 @@
+"""
+Дневные сводки по платежам (PaymentDailyRollup).
+
+Аналитика читает несколько строк на день вместо агрегации по всей таблице
+платежей. Счетчики увеличиваются инкрементально: при создании платежа
+и при его переходе в succeeded/failed (apps.payment.transitions) - в той же
+транзакции, что и сам переход. Платеж учитывается в дне своего создания,
+валюте и тарифном плане подписки.
+
+Инкременты могут разойтись с таблицей платежей (ручные правки, гонка при
+повторе неудачного платежа), поэтому ночная задача compact_payment_rollups
+пересчитывает последние дни из платежей целиком, а команда
+backfill_payment_rollups заполняет историю. Пересчет блокирует запись
+в сводки до своего коммита: иначе инкремент, сделанный между агрегацией
+и заменой строк, был бы потерян.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, TruncDate
+from django.utils import timezone
+
+from .models import Payment, PaymentDailyRollup
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('payments_count', 'succeeded_count', 'failed_count', 'revenue')
+
+
+def _plan_id(payment):
+    """Тарифный план подписки платежа без лишнего запроса, если подписка загружена"""
+    if not payment.subscription_id:
+        return None
+    if Payment.subscription.is_cached(payment):
+        return payment.subscription.plan_id
+
+    from apps.subscribe.models import Subscription
+    return Subscription.objects.filter(
+        pk=payment.subscription_id
+    ).values_list('plan_id', flat=True).first()
+
+
+def _bucket(payment):
+    """Ключ строки сводки платежа: (дата создания, валюта, план)"""
+    created_at = timezone.localtime(payment.created_at or timezone.now())
+    return created_at.date(), payment.currency, _plan_id(payment)
+
+
+def add_to_rollup(date, currency, plan_id, **deltas):
+    """
+    Атомарно прибавляет deltas к счетчикам строки сводки, создавая ее при отсутствии.
+    Уменьшение не опускает счетчик ниже нуля: строка могла не учитывать платеж
+    (например, до backfill), а ошибка CHECK сорвала бы переход платежа.
+    """
+    updates = {
+        field: F(field) + value if value > 0 else Greatest(F(field) + value, 0)
+        for field, value in deltas.items() if value
+    }
+    if not updates:
+        return
+    deltas = {field: max(value, 0) for field, value in deltas.items()}
+
+    rows = PaymentDailyRollup.objects.filter(date=date, currency=currency, plan_id=plan_id)
+    if rows.update(updated_at=timezone.now(), **updates):
+        return
+
+    try:
+        with transaction.atomic():
+            PaymentDailyRollup.objects.create(date=date, currency=currency, plan_id=plan_id, **deltas)
+    except IntegrityError:
+        # Строку одновременно создал другой запрос - прибавляем к ней
+        rows.update(updated_at=timezone.now(), **updates)
+
+
+def record_payment_created(payment):
+    date, currency, plan_id = _bucket(payment)
+    add_to_rollup(date, currency, plan_id, payments_count=1)
+
+
+def record_transition(payment, source, target):
+    """Учитывает переход платежа из source в target"""
+    deltas = {}
+    if target == 'succeeded':
+        deltas['succeeded_count'] = 1
+        deltas['revenue'] = payment.amount
+    elif target == 'failed':
+        deltas['failed_count'] = 1
+    if source == 'failed':
+        # Повтор неудачного платежа
+        deltas['failed_count'] = deltas.get('failed_count', 0) - 1
+
+    if deltas:
+        date, currency, plan_id = _bucket(payment)
+        add_to_rollup(date, currency, plan_id, **deltas)
+
+
+def aggregate_payments(start_date, end_date):
+    """Сводки за дни [start_date, end_date], посчитанные напрямую по платежам"""
+    zero = Value(Decimal('0'), output_field=DecimalField(max_digits=14, decimal_places=2))
+    return (
+        Payment.objects.filter(created_at__date__gte=start_date, created_at__date__lte=end_date)
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'currency', 'subscription__plan')
+        .annotate(
+            payments_count=Count('id'),
+            succeeded_count=Count('id', filter=Q(status='succeeded')),
+            failed_count=Count('id', filter=Q(status='failed')),
+            revenue=Coalesce(Sum('amount', filter=Q(status='succeeded')), zero),
+        )
+        .order_by()
+    )
+
+
+def lock_rollups():
+    """
+    Блокирует запись в сводки до конца транзакции. Блокировка дожидается
+    транзакций, уже изменивших сводки, а новые инкременты ждут ее снятия
+    и применяются к пересчитанным строкам. В SQLite запись и так
+    последовательна.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'LOCK TABLE {connection.ops.quote_name(PaymentDailyRollup._meta.db_table)} '
+                f'IN SHARE ROW EXCLUSIVE MODE'
+            )
+
+
+def rebuild_rollups(start_date, end_date):
+    """Пересчитывает сводки за дни [start_date, end_date], возвращает число строк"""
+    with transaction.atomic():
+        # Агрегация после блокировки видит все платежи, уже учтенные инкрементами
+        lock_rollups()
+        rollups = [
+            PaymentDailyRollup(
+                date=row['day'],
+                currency=row['currency'],
+                plan_id=row['subscription__plan'],
+                **{field: row[field] for field in COUNTERS}
+            )
+            for row in aggregate_payments(start_date, end_date)
+        ]
+        PaymentDailyRollup.objects.filter(date__gte=start_date, date__lte=end_date).delete()
+        PaymentDailyRollup.objects.bulk_create(rollups)
+
+    logger.info(f"Payment rollups rebuilt for {start_date}..{end_date}: {len(rollups)} rows")
+    return len(rollups)
+
+
+def compact_recent_rollups(days=3):
+    """Пересчитывает сводки последних days дней (включая сегодняшний)"""
+    today = timezone.localdate()
+    return rebuild_rollups(today - timedelta(days=days - 1), today)
+
+
+def summarize_rollups(start_date=None, end_date=None):
+    """
+    Итоги по сводкам за дни [start_date, end_date] (границы необязательны):
+    общие счетчики, разбивка по валютам и по тарифным планам.
+    """
+    rollups = PaymentDailyRollup.objects.all()
+    if start_date:
+        rollups = rollups.filter(date__gte=start_date)
+    if end_date:
+        rollups = rollups.filter(date__lte=end_date)
+
+    totals = {
+        'payments': Sum('payments_count'),
+        'successful_payments': Sum('succeeded_count'),
+        'failed_payments': Sum('failed_count'),
+        'revenue_total': Sum('revenue'),
+    }
+    summary = {key: value or 0 for key, value in rollups.aggregate(**totals).items()}
+    summary['by_currency'] = list(
+        rollups.values('currency').annotate(**totals).order_by('currency')
+    )
+    summary['by_plan'] = list(
+        rollups.values('plan', plan_name=F('plan__name')).annotate(**totals).order_by('plan')
+    )
+    return summary
@@ -1,19 +1,20 @@
 import stripe
 from django.conf import settings
+from django.db import IntegrityError, connection, transaction
 from django.utils import timezone
 from decimal import Decimal
 from typing import Dict, Optional, Tuple
 import logging
 
 from .models import Payment, PaymentAttempt, WebhookEvent
+from .customers import get_customer_id
+from .rollups import record_payment_created
+from .stripe_client import get_stripe_client, idempotency_key
+from .transitions import SETTLED_STATUSES, transition
 from apps.subscribe.models import Subscription, SubscriptionPlan, SubscriptionHistory
 
 logger = logging.getLogger(__name__)
 
-# Настройка Stripe
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-
 class StripeService:
     """Сервис для работы с Stripe"""
 
@@ -21,7 +22,8 @@ class StripeService:
     def create_customer(user) -> Optional[str]:
         """Создает клиента в Stripe"""
         try:
-            customer = stripe.Customer.create(
+            customer = get_stripe_client().create_customer(
+                idempotency_key=idempotency_key('customer', user.id),
                 email=user.email,
                 name=user.get_full_name() or user.username,
                 metadata={
@@ -38,14 +40,17 @@ class StripeService:
     def create_checkout_session(payment: Payment, success_url: str, cancel_url: str) -> Optional[Dict]:
         """Создает сессию Stripe Checkout"""
         try:
-            # Получаем или создаем клиента
+            # Получаем клиента пользователя (создается в Stripe один раз)
             if not payment.stripe_customer_id:
-                customer_id = StripeService.create_customer(payment.user)
+                customer_id = get_customer_id(payment.user)
                 if customer_id:
                     payment.stripe_customer_id = customer_id
-                    payment.save()
+                    payment.save(update_fields=['stripe_customer_id', 'updated_at'])
 
-            session = stripe.checkout.Session.create(
+            session = get_stripe_client().create_checkout_session(
+                idempotency_key=idempotency_key(
+                    'checkout', payment.id, int(payment.updated_at.timestamp())
+                ),
                 customer=payment.stripe_customer_id,
                 payment_method_types=['card'],
                 line_items=[{
@@ -69,10 +74,10 @@ class StripeService:
                 }
             )
 
-            # Обновляем платеж
-            payment.stripe_session_id = session.id
-            payment.status = 'processing'
-            payment.save()
+            # Обновляем платеж: сессия создана, ожидаем оплату
+            if not transition(payment, 'start', stripe_session_id=session.id):
+                payment.stripe_session_id = session.id
+                payment.save(update_fields=['stripe_session_id', 'updated_at'])
 
             return {
                 'checkout_url': session.url,
@@ -89,7 +94,8 @@ class StripeService:
     def create_payment_intent(payment: Payment) -> Optional[str]:
         """Создает Payment Intent в Stripe"""
         try:
-            intent = stripe.PaymentIntent.create(
+            intent = get_stripe_client().create_payment_intent(
+                idempotency_key=idempotency_key('payment_intent', payment.id),
                 amount=int(payment.amount * 100),  # В центах
                 currency=payment.currency.lower(),
                 customer=payment.stripe_customer_id,
@@ -101,7 +107,7 @@ class StripeService:
             )
 
             payment.stripe_payment_intent_id = intent.id
-            payment.save()
+            payment.save(update_fields=['stripe_payment_intent_id', 'updated_at'])
 
             return intent.client_secret
 
@@ -111,8 +117,9 @@ class StripeService:
             return None
 
     @staticmethod
-    def refund_payment(payment: Payment, amount: Optional[Decimal] = None, reason: str = "") -> bool:
-        """Возвращает платеж через Stripe"""
+    def refund_payment(payment: Payment, amount: Optional[Decimal] = None, reason: str = "", *,
+                       refund_id: int) -> bool:
+        """Возвращает платеж через Stripe; refund_id - ID записи Refund, ключ идемпотентности возврата"""
         try:
             if not payment.stripe_payment_intent_id:
                 return False
@@ -128,7 +135,10 @@ class StripeService:
             if amount:
                 refund_data['amount'] = int(amount * 100)
 
-            refund = stripe.Refund.create(**refund_data)
+            refund = get_stripe_client().create_refund(
+                idempotency_key=idempotency_key('refund', payment.id, refund_id),
+                **refund_data
+            )
 
             return refund.status == 'succeeded'
 
@@ -136,11 +146,30 @@ class StripeService:
             logger.error(f"Error processing refund: {e}")
             return False
 
+    @staticmethod
+    def list_checkout_sessions(created_gte: int, starting_after: Optional[str] = None,
+                               limit: int = 100) -> Tuple[list, bool]:
+        """Страница checkout сессий, созданных не раньше created_gte: (сессии, has_more)"""
+        params = {'created': {'gte': created_gte}, 'limit': limit}
+        if starting_after:
+            params['starting_after'] = starting_after
+        page = get_stripe_client().list_checkout_sessions(**params)
+        return [
+            {
+                'id': session.id,
+                'status': session.status,
+                'payment_status': session.payment_status,
+                'payment_intent': session.payment_intent,
+                'metadata': dict(session.metadata or {}),
+            }
+            for session in page.data
+        ], page.has_more
+
     @staticmethod
     def retrieve_session(session_id: str) -> Optional[Dict]:
         """Получает информацию о сессии"""
         try:
-            session = stripe.checkout.Session.retrieve(session_id)
+            session = get_stripe_client().retrieve_checkout_session(session_id)
             return {
                 'status': session.payment_status,
                 'payment_intent': session.payment_intent,
@@ -158,14 +187,30 @@ class PaymentService:
     @staticmethod
     def create_subscription_payment(user, plan: SubscriptionPlan) -> Tuple[Payment, Subscription]:
         """Создает платеж для подписки"""
-        # Создаем подписку
-        subscription = Subscription.objects.create(
-            user=user,
-            plan=plan,
-            status='pending',
-            start_date=timezone.now(),
-            end_date=timezone.now()  # Будет обновлено после оплаты
-        )
+        # У пользователя одна подписка: после отмены или истечения
+        # повторная оплата использует ту же запись (связь уже загружена валидацией)
+        try:
+            subscription = user.subscription
+        except Subscription.DoesNotExist:
+            subscription = None
+
+        # Продление - повторная оплата подписки, которая уже была активна
+        renewal = False
+        if subscription is None:
+            # Создаем подписку
+            subscription = Subscription.objects.create(
+                user=user,
+                plan=plan,
+                status='pending',
+                start_date=timezone.now(),
+                end_date=timezone.now()  # Будет обновлено после оплаты
+            )
+        else:
+            renewal = subscription.history.filter(action__in=['activated', 'renewed']).exists()
+            subscription.plan = plan
+            subscription.status = 'pending'
+            subscription.auto_renew = True
+            subscription.save(update_fields=['plan', 'status', 'auto_renew', 'updated_at'])
 
         # Создаем платеж
         payment = Payment.objects.create(
@@ -174,38 +219,60 @@ class PaymentService:
             amount=plan.price,
             currency='USD',
             description=f'Subscription to {plan.name}',
-            payment_method='stripe'
+            payment_method='stripe',
+            stripe_customer_id=get_customer_id(user, create=False),
+            metadata={'renewal': True} if renewal else {}
         )
+        record_payment_created(payment)
 
         # Записываем в историю
         SubscriptionHistory.objects.create(
             subscription=subscription,
             action='created',
-            description=f'Subscription created for plan {plan.name}'
+            description=(
+                f'Subscription renewal started for plan {plan.name}' if renewal
+                else f'Subscription created for plan {plan.name}'
+            )
         )
 
         return payment, subscription
 
     @staticmethod
     def process_successful_payment(payment: Payment) -> bool:
-        """Обрабатывает успешный платеж"""
-        try:
-            payment.mark_as_succeeded()
-
+        """
+        Обрабатывает успешный платеж. Подписка активируется только при
+        фактическом переходе статуса, повторные вызовы ничего не делают.
+        Возвращает True, и если платеж уже в статусе, где событие ничего не меняет.
+        """
+        def activate_subscription(payment):
             # Активируем подписку
-            if payment.subscription:
-                payment.subscription.activate()
-
-                # Записываем в историю
+            subscription = payment.subscription
+            if subscription:
+                # Подписку отменили из-за неудачной попытки оплаты - восстанавливаем ее
+                reactivated = subscription.status == 'cancelled'
+                if reactivated:
+                    subscription.auto_renew = True
+                subscription.activate()
+
+                # Записываем в историю: первая активация подписки или ее продление
+                # (ряды new/renewed_subscriptions в apps.payment.timeseries)
+                if payment.metadata.get('renewal'):
+                    action, description = 'renewed', 'Subscription renewed after successful payment'
+                elif reactivated:
+                    action, description = 'activated', 'Subscription reactivated after successful payment'
+                else:
+                    action, description = 'activated', 'Subscription activated after successful payment'
                 SubscriptionHistory.objects.create(
-                    subscription=payment.subscription,
-                    action='activated',
-                    description='Subscription activated after successful payment',
+                    subscription=subscription,
+                    action=action,
+                    description=description,
                     metadata={'payment_id': payment.id}
                 )
 
-            logger.info(f"Payment {payment.id} processed successfully")
-            return True
+        try:
+            if transition(payment, 'succeed', side_effect=activate_subscription):
+                logger.info(f"Payment {payment.id} processed successfully")
+            return payment.status in SETTLED_STATUSES['succeed']
 
         except Exception as e:
             logger.error(f"Error processing successful payment {payment.id}: {e}")
@@ -213,10 +280,8 @@ class PaymentService:
 
     @staticmethod
     def process_failed_payment(payment: Payment, reason: str = "") -> bool:
-        """Обрабатывает неудачный платеж"""
-        try:
-            payment.mark_as_failed(reason)
-
+        """Обрабатывает неудачный платеж (один раз, как и успешный)"""
+        def cancel_subscription(payment):
             # Отменяем подписку
             if payment.subscription:
                 payment.subscription.cancel()
@@ -229,13 +294,28 @@ class PaymentService:
                     metadata={'payment_id': payment.id}
                 )
 
-            logger.info(f"Payment {payment.id} marked as failed")
-            return True
+        fields = {}
+        if reason:
+            fields['metadata'] = {**payment.metadata, 'failure_reason': reason}
+
+        try:
+            if transition(payment, 'fail', side_effect=cancel_subscription, **fields):
+                logger.info(f"Payment {payment.id} marked as failed")
+            return payment.status in SETTLED_STATUSES['fail']
 
         except Exception as e:
             logger.error(f"Error processing failed payment {payment.id}: {e}")
             return False
 
+    @staticmethod
+    def cancel_payment(payment: Payment) -> bool:
+        """Отменяет ожидающий платеж и его подписку, возвращает False для завершенного платежа"""
+        def cancel_subscription(payment):
+            if payment.subscription:
+                payment.subscription.cancel()
+
+        return transition(payment, 'cancel', side_effect=cancel_subscription)
+
     @staticmethod
     def cancel_subscription(subscription: Subscription) -> bool:
         """Отменяет подписку"""
@@ -265,47 +345,144 @@ class WebhookService:
     """Сервис для обработки webhook событий"""
 
     @staticmethod
-    def process_stripe_webhook(event_data: Dict) -> bool:
-        """Обрабатывает Stripe webhook"""
-        try:
-            event_id = event_data.get('id')
-            event_type = event_data.get('type')
+    def get_ordering_key(event_data: Dict) -> str:
+        """ID платежа из метаданных объекта события (пустая строка, если его нет)"""
+        obj = (event_data.get('data') or {}).get('object') or {}
+        payment_id = (obj.get('metadata') or {}).get('payment_id')
+        return str(payment_id) if payment_id else ''
 
-            # Проверяем, не обрабатывали ли мы уже это событие
-            if WebhookEvent.objects.filter(event_id=event_id).exists():
-                return True
+    @staticmethod
+    def record_stripe_event(event_data: Dict) -> Tuple[WebhookEvent, bool]:
+        """
+        Сохраняет событие Stripe одной вставкой "INSERT или пропустить" по event_id.
+        Возвращает (событие, created); created=False для уже полученного события.
+        """
+        webhook_event = WebhookEvent(
+            provider='stripe',
+            event_id=event_data.get('id'),
+            event_type=event_data.get('type'),
+            data=event_data,
+            ordering_key=WebhookService.get_ordering_key(event_data),
+            created_at=timezone.now()
+        )
 
-            # Создаем запись о событии
-            webhook_event = WebhookEvent.objects.create(
-                provider='stripe',
-                event_id=event_id,
-                event_type=event_type,
-                data=event_data
-            )
+        if connection.vendor == 'postgresql':
+            # Все колонки модели, как в INSERT save(): Django не задает DEFAULT в БД,
+            # поэтому пропущенная NOT NULL колонка сломала бы вставку
+            fields = [field for field in WebhookEvent._meta.concrete_fields if not field.primary_key]
+            values = [
+                field.get_db_prep_save(field.pre_save(webhook_event, True), connection)
+                for field in fields
+            ]
+            quote = connection.ops.quote_name
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {quote(WebhookEvent._meta.db_table)} "
+                    f"({', '.join(quote(field.column) for field in fields)}) "
+                    f"VALUES ({', '.join(['%s'] * len(fields))}) "
+                    f"ON CONFLICT ({quote(WebhookEvent._meta.get_field('event_id').column)}) "
+                    f"DO NOTHING RETURNING {quote(WebhookEvent._meta.pk.column)}",
+                    values
+                )
+                row = cursor.fetchone()
+            if row:
+                webhook_event.pk = row[0]
+                webhook_event._state.adding = False
+                return webhook_event, True
+        else:
+            try:
+                with transaction.atomic():
+                    webhook_event.save(force_insert=True)
+                return webhook_event, True
+            except IntegrityError:
+                pass
+
+        # Событие уже получено (повторная доставка Stripe)
+        return WebhookEvent.objects.get(event_id=webhook_event.event_id), False
 
-            # Обрабатываем различные типы событий
-            success = False
-
-            if event_type == 'checkout.session.completed':
-                success = WebhookService._handle_checkout_completed(event_data)
-            elif event_type == 'payment_intent.succeeded':
-                success = WebhookService._handle_payment_succeeded(event_data)
-            elif event_type == 'payment_intent.payment_failed':
-                success = WebhookService._handle_payment_failed(event_data)
-            elif event_type == 'charge.dispute.created':
-                success = WebhookService._handle_dispute_created(event_data)
-            else:
-                # Неизвестный тип события - помечаем как игнорируемый
-                webhook_event.status = 'ignored'
-                webhook_event.save()
-                return True
+    @staticmethod
+    def handle_event(webhook_event: WebhookEvent) -> Optional[bool]:
+        """
+        Захватывает и обрабатывает событие.
+        Возвращает None, если событие уже обработано или захвачено другим воркером.
+        """
+        if not webhook_event.claim():
+            return None
+        return WebhookService.process_event(webhook_event)
+
+    @staticmethod
+    def process_event(webhook_event: WebhookEvent) -> bool:
+        """Обрабатывает сохраненное событие и обновляет его статус"""
+        event_data = webhook_event.data
+        event_type = webhook_event.event_type
+
+        # Обрабатываем различные типы событий
+        success = False
+
+        if event_type == 'checkout.session.completed':
+            success = WebhookService._handle_checkout_completed(event_data)
+        elif event_type == 'payment_intent.succeeded':
+            success = WebhookService._handle_payment_succeeded(event_data)
+        elif event_type == 'payment_intent.payment_failed':
+            success = WebhookService._handle_payment_failed(event_data)
+        elif event_type == 'charge.dispute.created':
+            success = WebhookService._handle_dispute_created(event_data)
+        else:
+            # Неизвестный тип события - помечаем как игнорируемый
+            webhook_event.mark_as_ignored()
+            return True
+
+        if success:
+            webhook_event.mark_as_processed()
+        else:
+            webhook_event.mark_as_failed("Processing failed")
+
+        return success
 
-            if success:
-                webhook_event.mark_as_processed()
-            else:
-                webhook_event.mark_as_failed("Processing failed")
+    @staticmethod
+    def process_pending_events(ordering_key: str) -> int:
+        """
+        Обрабатывает ожидающие события одного платежа в порядке получения.
+        Строка платежа блокируется на время обработки, поэтому события
+        одного платежа не обрабатываются параллельно разными воркерами.
+        Обработка останавливается на первом неудачном событии: следующие
+        ждут, пока его повтор (apps.payment.retry) не завершится.
+        """
+        with transaction.atomic():
+            if ordering_key.isdigit():
+                # Платежа может не быть - тогда блокировать нечего, обработчик вернет ошибку
+                Payment.objects.select_for_update().filter(pk=int(ordering_key)).first()
+
+            events = list(WebhookEvent.objects.filter(
+                ordering_key=ordering_key,
+                status__in=['pending', 'failed']
+            ).order_by('created_at', 'id'))
+
+            processed = 0
+            for webhook_event in events:
+                if webhook_event.status == 'failed':
+                    break
+                success = WebhookService.handle_event(webhook_event)
+                if success is None:
+                    # Событие захвачено другим воркером - порядок сохранит он
+                    break
+                processed += 1
+                if not success:
+                    break
+
+        return processed
+
+    @staticmethod
+    def process_stripe_webhook(event_data: Dict) -> bool:
+        """Обрабатывает Stripe webhook синхронно"""
+        try:
+            webhook_event, created = WebhookService.record_stripe_event(event_data)
+            if webhook_event.status in ['processed', 'ignored']:
+                return True
 
-            return success
+            # Повторная доставка, которую уже обрабатывает другой воркер, тоже подтверждаем
+            success = WebhookService.handle_event(webhook_event)
+            return True if success is None else success
 
         except Exception as e:
             logger.error(f"Error processing Stripe webhook: {e}")
@@ -346,8 +523,9 @@ class WebhookService:
                 return False
 
             payment = Payment.objects.get(id=payment_id)
-            payment.stripe_payment_intent_id = payment_intent['id']
-            payment.save()
+            if payment.stripe_payment_intent_id != payment_intent['id']:
+                payment.stripe_payment_intent_id = payment_intent['id']
+                payment.save(update_fields=['stripe_payment_intent_id', 'updated_at'])
 
             return PaymentService.process_successful_payment(payment)
 
@@ -0,0 +1,223 @@
+"""
+Клиент Stripe с пулом соединений, таймаутами, повторами и circuit breaker.
+
+Все запросы идут через одну requests.Session (постоянные TLS-соединения).
+Таймауты задаются по типу операции: чтение (read) и запись (write).
+Повторы при сетевых ошибках выполняет библиотека stripe; запросы на запись
+отправляются с детерминированным ключом идемпотентности (idempotency_key),
+поэтому ни повтор библиотеки, ни повтор задачи или запроса не создает
+дубликатов. После серии сбоев (сеть, таймауты, 5xx, 429) circuit breaker на время
+перестает обращаться к Stripe и сразу возвращает ошибку вместо ожидания
+таймаута в воркере gunicorn.
+"""
+import logging
+import threading
+import time
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class StripeUnavailableError(stripe.error.APIConnectionError):
+    """Stripe недоступен: circuit breaker разомкнут"""
+
+
+class CircuitBreaker:
+    """
+    Размыкается после failure_threshold сбоев подряд; через reset_timeout
+    пропускает одну пробную операцию (half-open) и по ее итогу замыкается
+    или снова размыкается.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        # Поток, выполняющий пробную операцию в состоянии half-open
+        self._probe_owner = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Можно ли выполнить операцию сейчас"""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half-open' and self._probe_owner is None:
+                self._probe_owner = threading.get_ident()
+                return True
+            return False
+
+    def release_probe(self):
+        """Освобождает пробную операцию текущего потока, если ее итог не записан"""
+        with self._lock:
+            if self._probe_owner == threading.get_ident():
+                self._probe_owner = None
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_owner = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_owner = None
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+def is_outage_error(error):
+    """Ошибка говорит о деградации Stripe, а не о некорректном запросе"""
+    if isinstance(error, (stripe.error.APIConnectionError, stripe.error.RateLimitError)):
+        return True
+    return isinstance(error, stripe.error.APIError) and (error.http_status or 500) >= 500
+
+
+def idempotency_key(*parts):
+    """
+    Ключ идемпотентности из частей (например, операция и ID платежа).
+    Ключ должен повторяться при повторе той же операции, поэтому части обязательны.
+    """
+    if not parts:
+        raise ValueError('idempotency_key() requires at least one part')
+    return ':'.join(str(part) for part in parts)
+
+
+class StripeClient:
+    """Обертка над stripe.StripeClient для операций, используемых приложением"""
+
+    def __init__(self, api_key=None, connect_timeout=None, read_timeout=None,
+                 write_timeout=None, max_retries=None, pool_size=None,
+                 api_base=None, breaker=None):
+        api_key = api_key if api_key is not None else settings.STRIPE_SECRET_KEY
+        connect_timeout = connect_timeout or getattr(settings, 'STRIPE_CONNECT_TIMEOUT', 3)
+        timeouts = {
+            'read': (connect_timeout, read_timeout or getattr(settings, 'STRIPE_READ_TIMEOUT', 10)),
+            'write': (connect_timeout, write_timeout or getattr(settings, 'STRIPE_WRITE_TIMEOUT', 20)),
+        }
+        max_retries = max_retries if max_retries is not None else getattr(
+            settings, 'STRIPE_MAX_NETWORK_RETRIES', 2
+        )
+        pool_size = pool_size or getattr(settings, 'STRIPE_POOL_SIZE', 10)
+        api_base = api_base or getattr(settings, 'STRIPE_API_BASE', None)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        base_addresses = {'api': api_base} if api_base else None
+        self._clients = {
+            kind: stripe.StripeClient(
+                api_key,
+                http_client=stripe.RequestsClient(timeout=timeout, session=self.session),
+                max_network_retries=max_retries,
+                base_addresses=base_addresses
+            )
+            for kind, timeout in timeouts.items()
+        }
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=getattr(settings, 'STRIPE_CIRCUIT_FAILURE_THRESHOLD', 5),
+            reset_timeout=getattr(settings, 'STRIPE_CIRCUIT_RESET_TIMEOUT', 30)
+        )
+
+    def _call(self, kind, operation, *args, idempotency_key=None, **params):
+        """Выполняет операцию клиента kind ('read'/'write') через circuit breaker"""
+        options = {}
+        if kind == 'write':
+            if not idempotency_key:
+                raise ValueError('Stripe write operations require an idempotency key')
+            # Один ключ на все повторы запроса: и внутри библиотеки stripe, и повторы задачи
+            options['idempotency_key'] = idempotency_key
+
+        if not self.breaker.allow():
+            raise StripeUnavailableError('Stripe API is temporarily unavailable (circuit open)')
+
+        try:
+            result = operation(self._clients[kind].v1)(*args, params=params or None, options=options)
+        except stripe.error.StripeError as e:
+            if is_outage_error(e):
+                self.breaker.record_failure()
+                logger.warning(f"Stripe API failure ({self.breaker.state}): {e}")
+            else:
+                self.breaker.record_success()
+            raise
+        except Exception as e:
+            # Ошибка вне stripe (например, в разборе ответа) тоже считается сбоем
+            self.breaker.record_failure()
+            logger.warning(f"Stripe call failed unexpectedly ({self.breaker.state}): {e!r}")
+            raise
+        finally:
+            # Пробная операция не должна зависнуть, даже если итог не записан
+            # (BaseException: таймаут воркера, остановка процесса)
+            self.breaker.release_probe()
+
+        self.breaker.record_success()
+        return result
+
+    # Чтение
+
+    def retrieve_balance(self):
+        return self._call('read', lambda api: api.balance.retrieve)
+
+    def retrieve_checkout_session(self, session_id):
+        return self._call('read', lambda api: api.checkout.sessions.retrieve, session_id)
+
+    def list_checkout_sessions(self, **params):
+        return self._call('read', lambda api: api.checkout.sessions.list, **params)
+
+    # Запись
+
+    def create_customer(self, *, idempotency_key, **params):
+        return self._call('write', lambda api: api.customers.create,
+                          idempotency_key=idempotency_key, **params)
+
+    def create_checkout_session(self, *, idempotency_key, **params):
+        return self._call('write', lambda api: api.checkout.sessions.create,
+                          idempotency_key=idempotency_key, **params)
+
+    def create_payment_intent(self, *, idempotency_key, **params):
+        return self._call('write', lambda api: api.payment_intents.create,
+                          idempotency_key=idempotency_key, **params)
+
+    def create_refund(self, *, idempotency_key, **params):
+        return self._call('write', lambda api: api.refunds.create,
+                          idempotency_key=idempotency_key, **params)
+
+    def create_product(self, *, idempotency_key, **params):
+        return self._call('write', lambda api: api.products.create,
+                          idempotency_key=idempotency_key, **params)
+
+    def create_price(self, *, idempotency_key, **params):
+        return self._call('write', lambda api: api.prices.create,
+                          idempotency_key=idempotency_key, **params)
+
+
+_stripe_client = None
+
+
+def get_stripe_client():
+    """Клиент Stripe процесса (пул соединений и circuit breaker общие)"""
+    global _stripe_client
+    if _stripe_client is None:
+        _stripe_client = StripeClient()
+    return _stripe_client
@@ -0,0 +1,109 @@
+"""
+Заглушка Stripe в памяти процесса для локальной и нагрузочной проверки
+без сети. Включается настройкой STRIPE_FAKE_CLIENT=True.
+
+Операции записи повторяют интерфейс StripeClient (apps.payment.stripe_client)
+и, как Stripe, возвращают сохраненный результат при повторе с тем же
+ключом идемпотентности; writes хранит все полученные запросы на запись.
+"""
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+
+_fake_client = None
+
+
+class FakeStripeClient:
+    """Хранит checkout сессии и отдает их как list/retrieve API Stripe"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._ids = itertools.count(1)
+        self._idempotent_results = {}
+        self.writes = []
+
+    def _write(self, operation, idempotency_key, create):
+        """Выполняет create() один раз на ключ идемпотентности"""
+        if not idempotency_key:
+            raise ValueError('Stripe write operations require an idempotency key')
+        with self._lock:
+            self.writes.append((operation, idempotency_key))
+            result = self._idempotent_results.get(idempotency_key)
+        if result is None:
+            result = create()
+            with self._lock:
+                result = self._idempotent_results.setdefault(idempotency_key, result)
+        return result
+
+    def create_customer(self, *, idempotency_key, **params):
+        return self._write('customers.create', idempotency_key, lambda: SimpleNamespace(
+            id=f'cus_fake_{next(self._ids)}', email=params.get('email')
+        ))
+
+    def create_checkout_session(self, *, idempotency_key, metadata=None, **params):
+        def create():
+            session = self.create_session(metadata={
+                key: str(value) for key, value in (metadata or {}).items() if value is not None
+            })
+            return SimpleNamespace(id=session['id'], url=f"https://checkout.stripe.test/{session['id']}")
+        return self._write('checkout.sessions.create', idempotency_key, create)
+
+    def create_session(self, metadata=None, status='open', payment_status='unpaid', created=None):
+        with self._lock:
+            session = {
+                'id': f'cs_fake_{next(self._ids)}',
+                'status': status,
+                'payment_status': payment_status,
+                'payment_intent': None,
+                'customer': None,
+                'metadata': metadata or {},
+                'created': int(created if created is not None else time.time()),
+            }
+            self._sessions[session['id']] = session
+        return dict(session)
+
+    def complete_session(self, session_id):
+        """Имитирует оплату сессии"""
+        with self._lock:
+            session = self._sessions[session_id]
+            session.update(status='complete', payment_status='paid',
+                           payment_intent=f'pi_fake_{session_id}')
+
+    def expire_session(self, session_id):
+        with self._lock:
+            self._sessions[session_id]['status'] = 'expired'
+
+    def list_checkout_sessions(self, created_gte, starting_after=None, limit=100):
+        """Сессии от новых к старым, как в Stripe: (сессии, has_more)"""
+        with self._lock:
+            sessions = sorted(
+                (s for s in self._sessions.values() if s['created'] >= created_gte),
+                key=lambda s: (s['created'], int(s['id'].rsplit('_', 1)[1])),
+                reverse=True
+            )
+        if starting_after:
+            ids = [s['id'] for s in sessions]
+            sessions = sessions[ids.index(starting_after) + 1:] if starting_after in ids else []
+        page = [dict(s) for s in sessions[:limit]]
+        return page, len(sessions) > limit
+
+    def retrieve_session(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        return {
+            'status': session['payment_status'],
+            'payment_intent': session['payment_intent'],
+            'customer': session['customer'],
+            'metadata': session['metadata'],
+        }
+
+
+def get_fake_stripe_client():
+    global _fake_client
+    if _fake_client is None:
+        _fake_client = FakeStripeClient()
+    return _fake_client
@@ -0,0 +1,139 @@
+import time
+
+from celery import group, shared_task
+from django.utils import timezone
+from datetime import timedelta
+from .models import Payment, WebhookEvent
+
+
+@shared_task
+def cleanup_old_payments():
+    """Очистка старых платежных записей"""
+    cutoff_date = timezone.now() - timedelta(days=90)
+
+    # Удаляем старые неудачные/отмененные платежи
+    old_payments = Payment.objects.filter(
+        created_at__lt=cutoff_date,
+        status__in=['failed', 'cancelled']
+    )
+
+    deleted_payments, _ = old_payments.delete()
+
+    return {'deleted_payments': deleted_payments}
+
+
+@shared_task
+def cleanup_old_webhook_events():
+    """Очистка старых webhook событий"""
+    cutoff_date = timezone.now() - timedelta(days=30)
+
+    # Удаляем старые обработанные события
+    old_events = WebhookEvent.objects.filter(
+        created_at__lt=cutoff_date,
+        status__in=['processed', 'ignored']
+    )
+
+    deleted_events, _ = old_events.delete()
+
+    return {'deleted_webhook_events': deleted_events}
+
+
+@shared_task
+def retry_failed_webhook_events(batch_size=100, drain=False):
+    """
+    Повторная обработка неудачных webhook событий.
+    Обычный режим обрабатывает пачку событий, время повтора которых наступило.
+    В режиме drain все неудачные события (без учета расписания) разбиваются
+    на пачки, которые обрабатываются параллельно воркерами Celery.
+    """
+    from .retry import due_events
+
+    if drain:
+        event_ids = list(
+            WebhookEvent.objects.filter(status='failed').order_by('id').values_list('pk', flat=True)
+        )
+        batches = [
+            event_ids[i:i + batch_size] for i in range(0, len(event_ids), batch_size)
+        ]
+        group(retry_webhook_events_batch.s(batch) for batch in batches).apply_async()
+        return {'queued_events': len(event_ids), 'queued_batches': len(batches)}
+
+    event_ids = list(due_events().values_list('pk', flat=True)[:batch_size])
+    return retry_webhook_events_batch(event_ids)
+
+
+@shared_task
+def retry_webhook_events_batch(webhook_event_ids):
+    """Повторная обработка пачки webhook событий"""
+    from .retry import record_run, retry_events
+
+    started_at = time.monotonic()
+    processed_count = retry_events(webhook_event_ids)
+    record_run(processed_count, time.monotonic() - started_at)
+
+    return {'reprocessed_events': processed_count}
+
+
+@shared_task
+def process_webhook_event(webhook_event_id):
+    """Обработка сохраненного webhook события (режим быстрого ответа Stripe)"""
+    from .services import WebhookService
+
+    webhook_event = WebhookEvent.objects.filter(pk=webhook_event_id, status='pending').first()
+    if webhook_event is None:
+        # Уже обработано вместе с более ранним событием того же платежа
+        return {'processed_events': 0}
+
+    if webhook_event.ordering_key:
+        processed = WebhookService.process_pending_events(webhook_event.ordering_key)
+    else:
+        processed = int(WebhookService.handle_event(webhook_event) is not None)
+
+    return {'processed_events': processed}
+
+
+@shared_task
+def process_pending_webhook_events(batch_size=500):
+    """Обработка событий, задача для которых не была поставлена в очередь"""
+    from .services import WebhookService
+
+    # Свежие события еще могут обрабатываться своими задачами
+    cutoff = timezone.now() - timedelta(minutes=5)
+
+    pending = list(WebhookEvent.objects.filter(
+        status='pending',
+        created_at__lt=cutoff
+    ).order_by('created_at', 'id')[:batch_size])
+
+    processed_count = 0
+    seen_keys = set()
+
+    for webhook_event in pending:
+        if not webhook_event.ordering_key:
+            if WebhookService.handle_event(webhook_event) is not None:
+                processed_count += 1
+        elif webhook_event.ordering_key not in seen_keys:
+            seen_keys.add(webhook_event.ordering_key)
+            processed_count += WebhookService.process_pending_events(webhook_event.ordering_key)
+
+    return {'processed_events': processed_count}
+
+
+@shared_task
+def reconcile_stripe_payments(lookback_hours=24):
+    """Сверка ожидающих платежей с checkout сессиями Stripe"""
+    from .reconciliation import reconcile_checkout_sessions, recover_orphaned_checkouts
+
+    recovered = recover_orphaned_checkouts(lookback_hours=lookback_hours)
+    reconciled = reconcile_checkout_sessions(lookback_hours=lookback_hours)
+    return {**recovered, **reconciled}
+
+
+@shared_task
+def compact_payment_rollups(days=None):
+    """Ночной пересчет дневных сводок платежей за последние дни"""
+    from django.conf import settings
+    from .rollups import compact_recent_rollups
+
+    days = days or getattr(settings, 'PAYMENT_ROLLUP_COMPACT_DAYS', 3)
+    return {'rollup_rows': compact_recent_rollups(days)}
@@ -1,3 +1,1216 @@
-from django.test import TestCase
+import itertools
+import json
+import threading
+import time
+import unittest
+from collections import deque
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import stripe
+
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from config.celery import app as celery_app
+
+from apps.accounts.models import User
+from apps.subscribe.expiry import SubscriptionExpiryEngine
+from apps.subscribe.models import Subscription, SubscriptionHistory, SubscriptionPlan
+
+from . import customers
+from .models import Payment, PaymentDailyRollup, Refund, WebhookEvent
+from .reconciliation import CLOCK_SKEW, reconcile_checkout_sessions, recover_orphaned_checkouts
+from .retry import retry_events, retry_metrics
+from .rollups import COUNTERS, add_to_rollup, aggregate_payments, rebuild_rollups
+from .services import PaymentService, WebhookService
+from .stripe_client import CircuitBreaker, StripeClient, StripeUnavailableError, idempotency_key
+from .stripe_fake import FakeStripeClient
+from .tasks import process_pending_webhook_events, process_webhook_event, retry_failed_webhook_events
+from .timeseries import SUBSCRIPTION_SERIES, build_timeseries
+from .transitions import transition
+
+
+def create_user(username='buyer'):
+    return User.objects.create(email=f'{username}@example.com', username=username)
+
+
+def create_plan(**kwargs):
+    kwargs.setdefault('stripe_price_id', 'price_basic')
+    return SubscriptionPlan.objects.create(name='Basic', price=10, duration_days=30, **kwargs)
+
+
+def count_queries(queries):
+    """Запросы без SAVEPOINT/RELEASE, которые добавляют atomic-блоки"""
+    return sum(1 for query in queries if 'SAVEPOINT' not in query['sql'])
+
+
+def stripe_event(event_id, payment, event_type='payment_intent.succeeded'):
+    return {
+        'id': event_id,
+        'type': event_type,
+        'data': {'object': {
+            'id': f'pi_{payment.pk}',
+            'metadata': {'payment_id': str(payment.pk)},
+        }},
+    }
+
+
+class RecordStripeEventTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.payment, _ = PaymentService.create_subscription_payment(create_user(), create_plan())
+
+    def test_inserts_all_model_columns(self):
+        event, created = WebhookService.record_stripe_event(stripe_event('evt_1', self.payment))
+
+        self.assertTrue(created)
+        stored = WebhookEvent.objects.get(pk=event.pk)
+        self.assertEqual(
+            (stored.status, stored.attempts, stored.ordering_key, stored.event_type),
+            ('pending', 0, str(self.payment.pk), 'payment_intent.succeeded')
+        )
+        self.assertIsNone(stored.locked_until)
+        self.assertIsNotNone(stored.created_at)
+
+    def test_repeated_delivery_returns_stored_event(self):
+        first, _ = WebhookService.record_stripe_event(stripe_event('evt_1', self.payment))
+        second, created = WebhookService.record_stripe_event(stripe_event('evt_1', self.payment))
+
+        self.assertFalse(created)
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    def test_process_stripe_webhook_activates_subscription_once(self):
+        event = stripe_event('evt_1', self.payment)
+
+        self.assertTrue(WebhookService.process_stripe_webhook(event))
+        self.assertTrue(WebhookService.process_stripe_webhook(event))
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'succeeded')
+        self.assertEqual(self.payment.subscription.history.filter(action='activated').count(), 1)
+        self.assertEqual(WebhookEvent.objects.get().status, 'processed')
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Concurrent inserts need PostgreSQL')
+class ConcurrentWebhookDeliveryTests(TransactionTestCase):
+
+    def test_many_threads_deliver_the_same_event(self):
+        payment, _ = PaymentService.create_subscription_payment(create_user(), create_plan())
+        event = stripe_event('evt_concurrent', payment)
+        threads_count = 16
+        barrier = threading.Barrier(threads_count)
+        results = []
+        errors = []
+
+        def deliver():
+            try:
+                barrier.wait()
+                webhook_event, created = WebhookService.record_stripe_event(event)
+                handled = WebhookService.handle_event(webhook_event)
+                results.append((created, handled))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=deliver) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), threads_count)
+        # Событие вставлено и обработано ровно одним потоком
+        self.assertEqual(sum(created for created, _ in results), 1)
+        self.assertEqual(sum(handled is not None for _, handled in results), 1)
+        self.assertEqual(WebhookEvent.objects.filter(event_id='evt_concurrent').count(), 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'succeeded')
+        self.assertEqual(payment.subscription.history.filter(action='activated').count(), 1)
+
+
+@override_settings(WEBHOOK_RETRY_MAX_ATTEMPTS=4)
+class WebhookOutageRecoveryTests(TestCase):
+    """Восстановление после сбоя: 10 000 событий, упавших за время недоступности"""
+    events_count = 10000
+    poison_count = 20
+
+    def setUp(self):
+        # Пачки drain выполняются синхронно, как их выполнили бы воркеры Celery
+        eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', eager)
+
+        failed_at = timezone.now() - timedelta(hours=1)
+        WebhookEvent.objects.bulk_create([
+            WebhookEvent(
+                provider='stripe',
+                event_id=f'evt_{i}',
+                event_type='payment_intent.succeeded',
+                status='failed',
+                data={'id': f'evt_{i}', 'poison': i < self.poison_count},
+                attempts=1,
+                next_attempt_at=failed_at + timedelta(seconds=i % 600),
+                error_message='Processing failed',
+            )
+            for i in range(self.events_count)
+        ], batch_size=1000)
+
+        # После восстановления обработчик работает, кроме "ядовитых" событий
+        self.handled = []
+
+        def handler(event_data):
+            if event_data['poison']:
+                return False
+            self.handled.append(event_data['id'])
+            return True
+
+        patcher = mock.patch.object(WebhookService, '_handle_payment_succeeded', side_effect=handler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_drain_recovers_backlog_and_dead_letters_poison_events(self):
+        metrics = retry_metrics()
+        self.assertEqual((metrics['backlog'], metrics['due']), (self.events_count, self.events_count))
+
+        result = retry_failed_webhook_events(batch_size=500, drain=True)
+
+        self.assertEqual(result, {'queued_events': self.events_count, 'queued_batches': 20})
+        self.assertEqual(len(self.handled), self.events_count - self.poison_count)
+        self.assertEqual(len(set(self.handled)), len(self.handled))
+        self.assertEqual(
+            WebhookEvent.objects.filter(status='processed').count(),
+            self.events_count - self.poison_count
+        )
+
+        # Ядовитые события отложены с backoff
+        poison = WebhookEvent.objects.filter(status='failed')
+        self.assertEqual(poison.count(), self.poison_count)
+        for event in poison:
+            self.assertEqual(event.attempts, 2)
+            self.assertGreaterEqual(event.next_attempt_at, event.processed_at)
+
+        # Повторные drain доводят их до dead после WEBHOOK_RETRY_MAX_ATTEMPTS попыток
+        for _ in range(3):
+            retry_failed_webhook_events(batch_size=500, drain=True)
+        self.assertEqual(retry_failed_webhook_events(drain=True)['queued_events'], 0)
+
+        metrics = retry_metrics()
+        self.assertEqual(metrics['backlog'], 0)
+        self.assertEqual(metrics['dead'], self.poison_count)
+        self.assertEqual(set(WebhookEvent.objects.filter(status='dead').values_list('attempts', flat=True)), {4})
+        self.assertEqual(len(self.handled), self.events_count - self.poison_count)
+
+    def test_scheduled_retries_drain_backlog_in_due_order(self):
+        processed = 0
+        while True:
+            result = retry_failed_webhook_events(batch_size=1000)
+            if not result['reprocessed_events']:
+                break
+            processed += result['reprocessed_events']
+
+        self.assertEqual(processed, self.events_count - self.poison_count)
+        # События обрабатываются в порядке расписания (next_attempt_at)
+        delays = [int(event_id.split('_')[1]) % 600 for event_id in self.handled]
+        self.assertEqual(delays, sorted(delays))
+        self.assertIsNotNone(retry_metrics()['last_run'])
+
+
+@override_settings(STRIPE_WEBHOOK_ASYNC=False)
+class CheckoutFlowQueryCountTests(TestCase):
+    """Запросы к БД на всем пути: checkout сессия -> webhook об оплате -> активная подписка"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.user.stripe_customer_id = 'cus_test'
+        cls.user.save()
+        cls.plan = create_plan()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        stripe_client = mock.Mock()
+        stripe_client.create_checkout_session.return_value = mock.Mock(
+            id='cs_test', url='https://checkout.stripe.test/cs_test'
+        )
+        patcher = mock.patch('apps.payment.services.get_stripe_client', return_value=stripe_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def checkout(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/v1/payment/create-checkout-session/',
+                {'subscription_plan_id': self.plan.pk}, format='json'
+            )
+        self.assertEqual(response.status_code, 201, response.content)
+        return Payment.objects.get(pk=response.data['payment_id']), queries
+
+    def webhook(self, event):
+        with mock.patch('stripe.Webhook.construct_event', return_value=event), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/v1/payment/webhooks/stripe/', b'{}',
+                content_type='application/json', HTTP_STRIPE_SIGNATURE='t=1,v1=test'
+            )
+        self.assertEqual(response.status_code, 200)
+        return queries
+
+    def test_checkout_to_success(self):
+        payment, checkout_queries = self.checkout()
+        self.assertEqual(payment.status, 'processing')
+        self.assertEqual(payment.stripe_session_id, 'cs_test')
+
+        event = stripe_event('evt_paid', payment, 'checkout.session.completed')
+        webhook_queries = self.webhook(event)
+        # Подписка, проверка незавершенных платежей, план; INSERT подписки, платежа,
+        # строки rollup (UPDATE + INSERT) и истории; перевод в processing
+        self.assertEqual(count_queries(checkout_queries), 10)
+        # INSERT события, его блокировка и платеж; перевод в succeeded и rollup;
+        # подписка с планом, ее UPDATE и история; отметка события
+        self.assertEqual(count_queries(webhook_queries), 11)
+
+        payment.refresh_from_db()
+        subscription = payment.subscription
+        self.assertEqual(payment.status, 'succeeded')
+        self.assertEqual(subscription.status, 'active')
+        self.assertEqual(
+            list(subscription.history.order_by('id').values_list('action', flat=True)),
+            ['created', 'activated']
+        )
+        rollup = PaymentDailyRollup.objects.get()
+        self.assertEqual((rollup.payments_count, rollup.succeeded_count), (1, 1))
+
+        # Повторная доставка события ничего не меняет
+        self.webhook(event)
+        self.assertEqual(subscription.history.count(), 2)
+
+
+class PaymentTransitionTests(TestCase):
+    """Таблица переходов и инварианты при любом порядке событий платежа"""
+    # Статус -> переходы, допустимые из него
+    ALLOWED = {
+        'pending': {'start', 'succeed', 'fail', 'cancel'},
+        'processing': {'succeed', 'fail', 'cancel'},
+        'succeeded': set(),
+        'failed': {'start', 'succeed'},
+        'cancelled': {'succeed'},
+        'refunded': set(),
+    }
+    TARGETS = {'start': 'processing', 'succeed': 'succeeded', 'fail': 'failed', 'cancel': 'cancelled'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = create_plan()
+
+    def apply(self, payment, name):
+        if name == 'start':
+            return transition(payment, 'start', stripe_session_id=f'cs_{payment.pk}')
+        if name == 'succeed':
+            return PaymentService.process_successful_payment(payment)
+        if name == 'fail':
+            return PaymentService.process_failed_payment(payment, 'Card declined')
+        return PaymentService.cancel_payment(payment)
+
+    def test_transition_table(self):
+        user = create_user()
+        payment, _ = PaymentService.create_subscription_payment(user, self.plan)
+
+        for status, allowed in self.ALLOWED.items():
+            for name, target in self.TARGETS.items():
+                with self.subTest(status=status, transition=name):
+                    Payment.objects.filter(pk=payment.pk).update(status=status)
+                    payment.refresh_from_db()
+
+                    self.assertEqual(transition(payment, name), name in allowed)
+                    payment.refresh_from_db()
+                    self.assertEqual(payment.status, target if name in allowed else status)
+
+    def test_any_event_order_keeps_payment_and_subscription_consistent(self):
+        sequences = itertools.product(self.TARGETS, repeat=3)
+        for i, sequence in enumerate(sequences):
+            with self.subTest(sequence=sequence):
+                payment, subscription = PaymentService.create_subscription_payment(
+                    create_user(f'buyer{i}'), self.plan
+                )
+                for name in sequence:
+                    self.apply(payment, name)
+                payment.refresh_from_db()
+                subscription.refresh_from_db()
+
+                # Списанная оплата не теряется, в каком бы порядке ни пришли события
+                if 'succeed' in sequence:
+                    self.assertEqual(payment.status, 'succeeded')
+                    self.assertEqual(subscription.status, 'active')
+                    self.assertTrue(subscription.is_active)
+                    self.assertTrue(subscription.auto_renew)
+                elif payment.status in ('failed', 'cancelled'):
+                    self.assertEqual(subscription.status, 'cancelled')
+                else:
+                    # Повтор после отказа: подписка остается отмененной до оплаты
+                    self.assertEqual(subscription.status, 'cancelled' if 'fail' in sequence else 'pending')
+                self.assertEqual(
+                    subscription.history.filter(action='activated').count(),
+                    int(payment.status == 'succeeded')
+                )
+
+        # Инкрементальные сводки совпадают с пересчетом по платежам
+        today = timezone.localdate()
+        expected = {
+            (row['currency'], row['subscription__plan']): (
+                row['payments_count'], row['succeeded_count'], row['failed_count'], row['revenue']
+            )
+            for row in aggregate_payments(today, today)
+        }
+        actual = {
+            (row.currency, row.plan_id): (
+                row.payments_count, row.succeeded_count, row.failed_count, row.revenue
+            )
+            for row in PaymentDailyRollup.objects.all()
+        }
+        self.assertEqual(actual, expected)
+
+
+class OutOfOrderWebhookTests(TestCase):
+    """Поздние и пришедшие не по порядку события подтверждаются, а не уходят в повтор"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = create_plan()
+
+    def setUp(self):
+        self.payment, self.subscription = PaymentService.create_subscription_payment(
+            create_user(), self.plan
+        )
+
+    def deliver(self, event_id, event_type):
+        self.assertTrue(WebhookService.process_stripe_webhook(
+            stripe_event(event_id, self.payment, event_type)
+        ))
+        self.payment.refresh_from_db()
+        self.subscription.refresh_from_db()
+        return WebhookEvent.objects.get(event_id=event_id)
+
+    def test_failure_after_success(self):
+        self.deliver('evt_paid', 'payment_intent.succeeded')
+        event = self.deliver('evt_declined', 'payment_intent.payment_failed')
+
+        self.assertEqual((event.status, event.attempts), ('processed', 0))
+        self.assertEqual(self.payment.status, 'succeeded')
+        self.assertEqual(self.subscription.status, 'active')
+
+    def test_success_after_cancel(self):
+        PaymentService.cancel_payment(self.payment)
+        event = self.deliver('evt_paid', 'checkout.session.completed')
+
+        self.assertEqual(event.status, 'processed')
+        self.assertEqual(self.payment.status, 'succeeded')
+        self.assertEqual(self.subscription.status, 'active')
+
+    def test_events_for_refunded_payment(self):
+        PaymentService.process_successful_payment(self.payment)
+        Payment.objects.filter(pk=self.payment.pk).update(status='refunded')
+
+        for event_id, event_type in [('evt_paid', 'payment_intent.succeeded'),
+                                     ('evt_declined', 'payment_intent.payment_failed')]:
+            with self.subTest(event_type=event_type):
+                self.assertEqual(self.deliver(event_id, event_type).status, 'processed')
+                self.assertEqual(self.payment.status, 'refunded')
+
+    def test_stale_status_in_memory_transitions_from_actual_status(self):
+        stale = Payment.objects.get(pk=self.payment.pk)
+        PaymentService.process_failed_payment(self.payment, 'Card declined')
+
+        # Переход выполняется из фактического статуса (failed), а не из pending в памяти,
+        # поэтому сводка учитывает повтор неудачного платежа
+        self.assertTrue(PaymentService.process_successful_payment(stale))
+        self.assertEqual(stale.status, 'succeeded')
+        rollup = PaymentDailyRollup.objects.get()
+        self.assertEqual((rollup.succeeded_count, rollup.failed_count), (1, 0))
+
+
+@override_settings(STRIPE_WEBHOOK_ASYNC=True)
+class AsyncWebhookProcessingTests(TestCase):
+    """Быстрый ответ Stripe и обработка событий в Celery по порядку получения"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = create_plan()
+
+    def setUp(self):
+        eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', eager)
+
+        self.payment, self.subscription = PaymentService.create_subscription_payment(
+            create_user(), self.plan
+        )
+
+    def record(self, event_id, event_type):
+        webhook_event, _ = WebhookService.record_stripe_event(
+            stripe_event(event_id, self.payment, event_type)
+        )
+        return webhook_event
+
+    def statuses(self, *events):
+        return [WebhookEvent.objects.get(pk=event.pk).status for event in events]
+
+    def refresh(self):
+        self.payment.refresh_from_db()
+        self.subscription.refresh_from_db()
+
+    def test_fast_ack_enqueues_processing_on_commit(self):
+        event = stripe_event('evt_paid', self.payment)
+        client = APIClient()
+
+        def deliver():
+            with mock.patch('stripe.Webhook.construct_event', return_value=event), \
+                    self.captureOnCommitCallbacks(execute=True) as callbacks:
+                response = client.post(
+                    '/api/v1/payment/webhooks/stripe/', b'{}',
+                    content_type='application/json', HTTP_STRIPE_SIGNATURE='t=1,v1=test'
+                )
+            self.assertEqual(response.status_code, 200)
+            return callbacks
+
+        with mock.patch('apps.payment.tasks.process_webhook_event.delay') as delay:
+            callbacks = deliver()
+        # Ответ отдан до обработки: событие сохранено, задача ставится после коммита
+        self.assertEqual(len(callbacks), 1)
+        webhook_event = WebhookEvent.objects.get(event_id='evt_paid')
+        delay.assert_called_once_with(webhook_event.pk)
+        self.assertEqual(webhook_event.status, 'pending')
+        self.refresh()
+        self.assertEqual(self.payment.status, 'pending')
+
+        callbacks[0]()
+        self.refresh()
+        self.assertEqual(self.statuses(webhook_event), ['processed'])
+        self.assertEqual(self.payment.status, 'succeeded')
+
+        # Повторная доставка не ставит задачу еще раз
+        self.assertEqual(len(deliver()), 0)
+
+    def test_out_of_order_tasks_process_events_in_received_order(self):
+        started = self.record('evt_1', 'checkout.session.completed')
+        declined = self.record('evt_2', 'payment_intent.payment_failed')
+        paid = self.record('evt_3', 'payment_intent.succeeded')
+
+        # Задача последнего события выполнилась первой - она обрабатывает всю очередь платежа
+        self.assertEqual(process_webhook_event(paid.pk), {'processed_events': 3})
+        self.assertEqual(process_webhook_event(started.pk), {'processed_events': 0})
+
+        self.assertEqual(self.statuses(started, declined, paid), ['processed'] * 3)
+        self.refresh()
+        self.assertEqual(self.payment.status, 'succeeded')
+        self.assertEqual(self.subscription.status, 'active')
+        # Отказ после оплаты ничего не изменил
+        self.assertFalse(self.subscription.history.filter(action='payment_failed').exists())
+
+    def test_queue_stops_at_first_failed_event_until_its_retry(self):
+        paid = self.record('evt_1', 'payment_intent.succeeded')
+        declined = self.record('evt_2', 'payment_intent.payment_failed')
+        WebhookEvent.objects.update(created_at=timezone.now() - timedelta(minutes=10))
+
+        with mock.patch.object(WebhookService, '_handle_payment_succeeded', return_value=False):
+            self.assertEqual(process_webhook_event(paid.pk), {'processed_events': 1})
+        self.assertEqual(self.statuses(paid, declined), ['failed', 'pending'])
+
+        # Ни задача, ни периодическая обработка не обгоняют неудачное событие
+        self.assertEqual(process_webhook_event(declined.pk), {'processed_events': 0})
+        self.assertEqual(process_pending_webhook_events(), {'processed_events': 0})
+        self.refresh()
+        self.assertEqual(self.payment.status, 'pending')
+
+        # Успешный повтор продолжает очередь платежа
+        self.assertEqual(retry_events([paid.pk]), 1)
+        self.assertEqual(self.statuses(paid, declined), ['processed', 'processed'])
+        self.refresh()
+        self.assertEqual(self.payment.status, 'succeeded')
+        self.assertEqual(self.subscription.status, 'active')
+
+    def test_dead_event_releases_queue(self):
+        paid = self.record('evt_1', 'payment_intent.succeeded')
+        declined = self.record('evt_2', 'payment_intent.payment_failed')
+
+        with override_settings(WEBHOOK_RETRY_MAX_ATTEMPTS=2), \
+                mock.patch.object(WebhookService, '_handle_payment_succeeded', return_value=False):
+            process_webhook_event(paid.pk)
+            self.assertEqual(retry_events([paid.pk]), 0)
+
+        self.assertEqual(self.statuses(paid, declined), ['dead', 'processed'])
+        self.refresh()
+        self.assertEqual(self.payment.status, 'failed')
+
+    def test_pending_events_without_task_are_requeued(self):
+        stale = self.record('evt_1', 'payment_intent.succeeded')
+        WebhookEvent.objects.filter(pk=stale.pk).update(created_at=timezone.now() - timedelta(minutes=10))
+        # Событие другого платежа, задача которого еще может выполниться
+        other, _ = PaymentService.create_subscription_payment(create_user('other'), self.plan)
+        fresh, _ = WebhookService.record_stripe_event(stripe_event('evt_2', other))
+
+        self.assertEqual(process_pending_webhook_events(), {'processed_events': 1})
+
+        self.assertEqual(self.statuses(stale, fresh), ['processed', 'pending'])
+        self.refresh()
+        self.assertEqual(self.payment.status, 'succeeded')
+
+
+class RecordingSessionsApi(FakeStripeClient):
+    """Заглушка Stripe, запоминающая запрошенные страницы сессий"""
+
+    def __init__(self):
+        super().__init__()
+        self.pages = []
+
+    def list_checkout_sessions(self, created_gte, starting_after=None, limit=100):
+        self.pages.append(created_gte)
+        return super().list_checkout_sessions(created_gte, starting_after=starting_after, limit=limit)
+
+
+class ReconciliationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = create_plan()
+
+    def setUp(self):
+        self.api = RecordingSessionsApi()
+        self.now = timezone.now()
+        # Старые сессии за сутки, не относящиеся к ожидающим платежам
+        for _ in range(500):
+            self.api.create_session(created=(self.now - timedelta(hours=20)).timestamp())
+
+    def create_payment(self, username, created_at):
+        payment, _ = PaymentService.create_subscription_payment(create_user(username), self.plan)
+        Payment.objects.filter(pk=payment.pk).update(created_at=created_at)
+        return payment
+
+    def test_lists_sessions_since_oldest_pending_payment_and_stops_when_matched(self):
+        created_at = self.now - timedelta(minutes=2)
+        paid = self.create_payment('paid', created_at)
+        expired = self.create_payment('expired', created_at)
+        for payment in (paid, expired):
+            session = self.api.create_session(created=(created_at + timedelta(seconds=10)).timestamp())
+            Payment.objects.filter(pk=payment.pk).update(stripe_session_id=session['id'])
+        self.api.complete_session(Payment.objects.get(pk=paid.pk).stripe_session_id)
+        self.api.expire_session(Payment.objects.get(pk=expired.pk).stripe_session_id)
+        # Более новые сессии других покупателей и более старые в пределах запаса
+        for _ in range(30):
+            self.api.create_session(created=self.now.timestamp())
+        for _ in range(100):
+            self.api.create_session(created=(created_at - timedelta(minutes=1)).timestamp())
+
+        stats = reconcile_checkout_sessions(self.api, page_size=10)
+
+        self.assertEqual(
+            stats, {'pending_payments': 2, 'sessions_seen': 32, 'succeeded': 1, 'failed': 1}
+        )
+        # 30 новых сессий - три страницы, на четвертой найдены оба платежа
+        self.assertEqual(self.api.pages, [int((created_at - CLOCK_SKEW).timestamp())] * 4)
+        self.assertEqual(
+            dict(Payment.objects.values_list('user__username', 'status')),
+            {'paid': 'succeeded', 'expired': 'failed'}
+        )
+
+    def test_nothing_pending_does_not_call_stripe(self):
+        self.assertEqual(reconcile_checkout_sessions(self.api)['pending_payments'], 0)
+        self.assertEqual(self.api.pages, [])
+
+    def test_orphaned_checkouts_use_oldest_orphan_as_lower_bound(self):
+        created_at = self.now - timedelta(minutes=30)
+        adopted = self.create_payment('adopted', created_at)
+        abandoned = self.create_payment('abandoned', created_at - timedelta(minutes=10))
+        session = self.api.create_session(
+            metadata={'payment_id': str(adopted.pk)},
+            created=(created_at + timedelta(seconds=5)).timestamp()
+        )
+
+        stats = recover_orphaned_checkouts(self.api, orphan_minutes=15)
+
+        self.assertEqual(stats, {'orphaned_payments': 2, 'adopted': 1, 'cancelled': 1})
+        oldest = Payment.objects.get(pk=abandoned.pk).created_at
+        self.assertEqual(self.api.pages, [int((oldest - CLOCK_SKEW).timestamp())])
+        adopted.refresh_from_db()
+        self.assertEqual((adopted.status, adopted.stripe_session_id), ('processing', session['id']))
+        self.assertEqual(Payment.objects.get(pk=abandoned.pk).status, 'cancelled')
+
+
+class StripeCustomerTests(TestCase):
+    """Клиент Stripe создается один раз на пользователя (apps.payment.customers)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = create_plan()
+
+    def setUp(self):
+        customers._memo.clear()
+        self.stripe = FakeStripeClient()
+        patcher = mock.patch('apps.payment.services.get_stripe_client', return_value=self.stripe)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def customer_writes(self):
+        return [key for operation, key in self.stripe.writes if operation == 'customers.create']
+
+    def test_two_checkouts_create_one_customer(self):
+        user = create_user()
+        client = APIClient()
+
+        for _ in range(2):
+            # Каждый запрос загружает пользователя заново
+            client.force_authenticate(User.objects.get(pk=user.pk))
+            response = client.post(
+                '/api/v1/payment/create-checkout-session/',
+                {'subscription_plan_id': self.plan.pk}, format='json'
+            )
+            self.assertEqual(response.status_code, 201, response.content)
+            # Покупатель бросает оплату; следующая попытка - в другом процессе
+            PaymentService.cancel_payment(Payment.objects.get(pk=response.data['payment_id']))
+            customers._memo.clear()
+
+        self.assertEqual(self.customer_writes(), [idempotency_key('customer', user.pk)])
+        # Повторная оплата использует ту же подписку пользователя
+        self.assertEqual(Subscription.objects.filter(user=user).count(), 1)
+        customer_id = User.objects.values_list('stripe_customer_id', flat=True).get(pk=user.pk)
+        self.assertTrue(customer_id.startswith('cus_fake_'))
+        self.assertEqual(
+            set(Payment.objects.filter(user=user).values_list('stripe_customer_id', flat=True)),
+            {customer_id}
+        )
+
+    def test_existing_customer_id_is_not_overwritten(self):
+        user = create_user()
+        # Другой запрос уже записал клиента, а этот прочитал пользователя раньше
+        User.objects.filter(pk=user.pk).update(stripe_customer_id='cus_existing')
+
+        self.assertEqual(customers.get_customer_id(user), 'cus_existing')
+        self.assertEqual(user.stripe_customer_id, 'cus_existing')
+        self.assertEqual(len(self.customer_writes()), 1)
+        self.assertEqual(
+            User.objects.values_list('stripe_customer_id', flat=True).get(pk=user.pk), 'cus_existing'
+        )
+        # Дальше ID берется из памяти процесса без запросов к Stripe и БД
+        with self.assertNumQueries(0):
+            self.assertEqual(customers.get_customer_id(User(pk=user.pk)), 'cus_existing')
+        self.assertEqual(len(self.customer_writes()), 1)
+
+
+class WorkerKilled(BaseException):
+    """Остановка процесса посреди запроса (не перехватывается except Exception)"""
+
+
+class CheckoutCrashRecoveryTests(TestCase):
+    """Платежи checkout, процесс которых завершился между фазами (recover_orphaned_checkouts)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = create_plan()
+
+    def setUp(self):
+        self.stripe = FakeStripeClient()
+        patcher = mock.patch('apps.payment.services.get_stripe_client', return_value=self.stripe)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def crashed_checkout(self, username, crash_target):
+        user = create_user(username)
+        user.stripe_customer_id = f'cus_{username}'
+        user.save()
+        client = APIClient()
+        client.force_authenticate(user)
+        with mock.patch(crash_target, side_effect=WorkerKilled), self.assertRaises(WorkerKilled):
+            client.post(
+                '/api/v1/payment/create-checkout-session/',
+                {'subscription_plan_id': self.plan.pk}, format='json'
+            )
+        # Платеж фазы 1 зафиксирован, но сессия к нему не привязана
+        payment = Payment.objects.get(user=user)
+        self.assertEqual((payment.status, payment.stripe_session_id), ('pending', None))
+        Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - timedelta(minutes=30))
+        return payment
+
+    def test_recovers_checkouts_crashed_before_and_after_stripe_call(self):
+        # До запроса к Stripe и после создания сессии, до записи ее в платеж
+        before = self.crashed_checkout(
+            'before', 'apps.payment.services.StripeService.create_checkout_session'
+        )
+        after = self.crashed_checkout('after', 'apps.payment.services.transition')
+        session = self.stripe.list_checkout_sessions(0)[0][0]
+        self.assertEqual(session['metadata']['payment_id'], str(after.pk))
+
+        # Свежие платежи без сессии еще могут быть в процессе создания - их не трогаем
+        self.assertEqual(
+            recover_orphaned_checkouts(self.stripe, orphan_minutes=60)['orphaned_payments'], 0
+        )
+        stats = recover_orphaned_checkouts(self.stripe, orphan_minutes=15)
+
+        self.assertEqual(stats, {'orphaned_payments': 2, 'adopted': 1, 'cancelled': 1})
+        before.refresh_from_db()
+        after.refresh_from_db()
+        self.assertEqual(before.status, 'cancelled')
+        self.assertEqual(before.subscription.status, 'cancelled')
+        self.assertEqual((after.status, after.stripe_session_id), ('processing', session['id']))
+
+        # Оплата привязанной сессии завершает платеж сверкой
+        self.stripe.complete_session(session['id'])
+        self.assertEqual(reconcile_checkout_sessions(self.stripe)['succeeded'], 1)
+        after.refresh_from_db()
+        self.assertEqual(after.status, 'succeeded')
+        self.assertTrue(after.subscription.is_active)
+
+        # Повторный запуск ничего не находит
+        self.assertEqual(recover_orphaned_checkouts(self.stripe, orphan_minutes=15)['orphaned_payments'], 0)
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    """
+    Локальный HTTP сервер вместо api.stripe.com с внедрением сбоев.
+    faults - очередь сбоев для следующих запросов: HTTP статус (500, 429...),
+    'drop' (обрыв соединения без ответа) или 'hang' (ответ позже таймаута).
+    Запросы на запись с уже виденным Idempotency-Key возвращают прежний объект.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeStripeHandler)
+        self.faults = deque()
+        self.requests = []
+        self.objects = {}
+        self.hang_seconds = 1
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def created(self, path):
+        return [obj for obj in self.objects.values() if obj['path'] == path]
+
+    def handle_error(self, request, client_address):
+        # Клиент закрыл соединение по таймауту раньше ответа ('hang') - ожидаемо
+        pass
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    resources = {
+        '/v1/customers': {'object': 'customer'},
+        '/v1/refunds': {'object': 'refund', 'status': 'succeeded'},
+        '/v1/balance': {'object': 'balance', 'available': [], 'pending': []},
+    }
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_api()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.handle_api()
+
+    def handle_api(self):
+        server = self.server
+        key = self.headers.get('Idempotency-Key')
+        server.requests.append((self.command, self.path, key))
+        fault = server.faults.popleft() if server.faults else None
+
+        if fault == 'drop':
+            self.close_connection = True
+            return
+        if fault == 'hang':
+            time.sleep(server.hang_seconds)
+        if isinstance(fault, int):
+            return self.respond(fault, {'error': {'type': 'api_error', 'message': f'Injected {fault}'}})
+
+        body = dict(self.resources[self.path])
+        if self.command == 'POST':
+            if key not in server.objects:
+                body['id'] = f'obj_{len(server.objects) + 1}'
+                server.objects[key] = {'path': self.path, 'body': body}
+            body = server.objects[key]['body']
+        self.respond(200, body)
+
+    def respond(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class StripeClientFaultInjectionTests(unittest.TestCase):
+    """StripeClient против локального сервера со сбоями: повторы, таймауты, circuit breaker"""
+
+    def setUp(self):
+        self.server = FakeStripeServer()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        # Без пауз между повторами библиотеки stripe
+        patcher = mock.patch.object(stripe._http_client.HTTPClient, '_sleep_time_seconds', return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def client(self, max_retries=0, failure_threshold=2, reset_timeout=60):
+        return StripeClient(
+            api_key='sk_test_fake', api_base=self.server.url, max_retries=max_retries,
+            connect_timeout=1, read_timeout=0.3, write_timeout=0.3,
+            breaker=CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+        )
+
+    def test_retries_reuse_idempotency_key(self):
+        self.server.faults.extend([500, 'drop', 'hang'])
+        client = self.client(max_retries=3)
+
+        refund = client.create_refund(
+            idempotency_key=idempotency_key('refund', 1, 7), payment_intent='pi_1'
+        )
+
+        self.assertEqual(refund.status, 'succeeded')
+        self.assertEqual([key for _, _, key in self.server.requests], ['refund:1:7'] * 4)
+        # Повторный вызов (например, повтор задачи) не создает второй возврат
+        again = client.create_refund(
+            idempotency_key=idempotency_key('refund', 1, 7), payment_intent='pi_1'
+        )
+        self.assertEqual(again.id, refund.id)
+        self.assertEqual(len(self.server.created('/v1/refunds')), 1)
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_write_requires_deterministic_idempotency_key(self):
+        client = self.client()
+
+        with self.assertRaises(TypeError):
+            client.create_customer(email='buyer@example.com')
+        with self.assertRaises(ValueError):
+            client.create_customer(idempotency_key='', email='buyer@example.com')
+        with self.assertRaises(ValueError):
+            idempotency_key()
+        self.assertEqual(self.server.requests, [])
+
+    def test_outage_opens_circuit_and_fails_fast(self):
+        self.server.faults.extend([503, 'hang'])
+        client = self.client()
+
+        with self.assertRaises(stripe.error.APIError):
+            client.retrieve_balance()
+        with self.assertRaises(stripe.error.APIConnectionError):
+            client.retrieve_balance()
+
+        self.assertEqual(client.breaker.state, 'open')
+        started = time.monotonic()
+        with self.assertRaises(StripeUnavailableError):
+            client.retrieve_balance()
+        self.assertLess(time.monotonic() - started, 0.1)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_client_errors_do_not_open_circuit(self):
+        self.server.faults.extend([400, 400, 400])
+        client = self.client()
+
+        for _ in range(3):
+            with self.assertRaises(stripe.error.StripeError):
+                client.retrieve_balance()
+
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_half_open_probe_closes_circuit_after_recovery(self):
+        self.server.faults.extend([500, 500])
+        client = self.client(reset_timeout=0.2)
+        for _ in range(2):
+            with self.assertRaises(stripe.error.APIError):
+                client.retrieve_balance()
+
+        time.sleep(0.25)
+        self.assertEqual(client.breaker.state, 'half-open')
+        client.retrieve_balance()
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_unexpected_errors_count_as_failures_and_release_probe(self):
+        client = self.client(reset_timeout=0)
+
+        def broken(api):
+            raise RuntimeError('response parsing bug')
+
+        with self.assertLogs('apps.payment.stripe_client', 'WARNING'):
+            for _ in range(2):
+                with self.assertRaises(RuntimeError):
+                    client._call('read', broken)
+        self.assertEqual(client.breaker.state, 'half-open')
+
+        # Пробная операция, прерванная BaseException (таймаут воркера), не блокирует breaker
+        class WorkerTimeout(BaseException):
+            pass
+
+        def interrupted(api):
+            raise WorkerTimeout()
+
+        with self.assertRaises(WorkerTimeout):
+            client._call('read', interrupted)
+        self.assertTrue(client.breaker.allow())
+        client.breaker.release_probe()
+
+        client.retrieve_balance()
+        self.assertEqual(client.breaker.state, 'closed')
+
+
+class PaymentRollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = create_plan()
+
+    def test_retry_of_failed_payment_does_not_drop_counter_below_zero(self):
+        payment, _ = PaymentService.create_subscription_payment(create_user(), self.plan)
+        PaymentService.process_failed_payment(payment, 'Card declined')
+        # Строка сводки не учитывает неудачу (например, создана до backfill)
+        PaymentDailyRollup.objects.update(failed_count=0)
+
+        self.assertTrue(PaymentService.process_successful_payment(payment))
+
+        rollup = PaymentDailyRollup.objects.get()
+        self.assertEqual((rollup.succeeded_count, rollup.failed_count), (1, 0))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'succeeded')
+
+    def test_retry_without_rollup_row(self):
+        payment, _ = PaymentService.create_subscription_payment(create_user(), self.plan)
+        PaymentService.process_failed_payment(payment, 'Card declined')
+        PaymentDailyRollup.objects.all().delete()
+
+        self.assertTrue(PaymentService.process_successful_payment(payment))
+
+        rollup = PaymentDailyRollup.objects.get()
+        self.assertEqual((rollup.succeeded_count, rollup.failed_count), (1, 0))
+
+    def test_add_to_rollup_values(self):
+        today = timezone.localdate()
+        key = {'date': today, 'currency': 'USD', 'plan_id': self.plan.pk}
+
+        # Нулевые приращения строку не создают
+        add_to_rollup(**key, payments_count=0)
+        self.assertFalse(PaymentDailyRollup.objects.exists())
+        # Отрицательное приращение новой строки записывается нулем
+        add_to_rollup(**key, payments_count=2, failed_count=-1)
+        add_to_rollup(**key, succeeded_count=1, revenue=Decimal('9.99'))
+        add_to_rollup(**key, payments_count=1, failed_count=1)
+        add_to_rollup(**key, failed_count=-3, revenue=Decimal('0.01'))
+        add_to_rollup(**{**key, 'currency': 'EUR'}, payments_count=1)
+
+        rollup = PaymentDailyRollup.objects.get(**key)
+        self.assertEqual(
+            (rollup.payments_count, rollup.succeeded_count, rollup.failed_count, rollup.revenue),
+            (3, 1, 0, Decimal('10.00'))
+        )
+        self.assertEqual(PaymentDailyRollup.objects.get(currency='EUR').payments_count, 1)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        other_plan = create_plan(stripe_price_id='price_other')
+        outcomes = ['succeed', 'fail', 'retry', 'cancel', None, 'succeed']
+        for i, outcome in enumerate(outcomes):
+            plan = self.plan if i % 2 else other_plan
+            payment, _ = PaymentService.create_subscription_payment(create_user(f'buyer{i}'), plan)
+            if outcome in ('fail', 'retry'):
+                PaymentService.process_failed_payment(payment, 'Card declined')
+            if outcome in ('succeed', 'retry'):
+                PaymentService.process_successful_payment(payment)
+            if outcome == 'cancel':
+                PaymentService.cancel_payment(payment)
+
+        def rows():
+            return sorted(PaymentDailyRollup.objects.values_list('date', 'currency', 'plan', *COUNTERS))
+
+        incremental = rows()
+        self.assertEqual(len(incremental), 2)
+        today = timezone.localdate()
+
+        self.assertEqual(rebuild_rollups(today, today), 2)
+
+        self.assertEqual(rows(), incremental)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Row and table locks need PostgreSQL')
+class RollupRebuildConcurrencyTests(TransactionTestCase):
+
+    def test_rebuild_waits_for_in_flight_increment(self):
+        payment, _ = PaymentService.create_subscription_payment(create_user(), create_plan())
+        today = timezone.localdate()
+        incremented = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def succeed_payment():
+            # Переход платежа и инкремент сводки в открытой транзакции
+            try:
+                with transaction.atomic():
+                    PaymentService.process_successful_payment(Payment.objects.get(pk=payment.pk))
+                    incremented.set()
+                    release.wait(5)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                incremented.set()
+                connections.close_all()
+
+        def rebuild():
+            try:
+                rebuild_rollups(today, today)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        payer = threading.Thread(target=succeed_payment)
+        payer.start()
+        incremented.wait(5)
+        rebuilder = threading.Thread(target=rebuild)
+        rebuilder.start()
+        rebuilder.join(0.3)
+        # Пересчет ждет коммита перехода, а не агрегирует без него
+        self.assertTrue(rebuilder.is_alive())
+        release.set()
+        payer.join()
+        rebuilder.join()
+
+        self.assertEqual(errors, [])
+        rollup = PaymentDailyRollup.objects.get()
+        self.assertEqual((rollup.payments_count, rollup.succeeded_count), (1, 1))
+        self.assertEqual(rollup.revenue, payment.amount)
+
+
+class PaymentTimeseriesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = create_plan()
+        cls.start = date(2025, 3, 3)  # понедельник
+
+    def at(self, day, hour=12):
+        day = self.start + timedelta(days=day)
+        return timezone.make_aware(datetime(day.year, day.month, day.day, hour))
+
+    def add_history(self, subscription, action, day):
+        row = SubscriptionHistory.objects.create(subscription=subscription, action=action)
+        SubscriptionHistory.objects.filter(pk=row.pk).update(created_at=self.at(day))
+
+    def test_bucket_values(self):
+        PaymentDailyRollup.objects.bulk_create([
+            PaymentDailyRollup(date=self.start, currency='USD', plan=self.plan,
+                               payments_count=3, succeeded_count=2, revenue=Decimal('20')),
+            PaymentDailyRollup(date=self.start, currency='EUR', plan=self.plan,
+                               payments_count=1, succeeded_count=1, revenue=Decimal('5.50')),
+            PaymentDailyRollup(date=self.start + timedelta(days=2), currency='USD', plan=self.plan,
+                               payments_count=1, succeeded_count=1, revenue=Decimal('10')),
+            PaymentDailyRollup(date=self.start + timedelta(days=7), currency='USD', plan=self.plan,
+                               payments_count=1, succeeded_count=1, revenue=Decimal('10')),
+        ])
+        payment, subscription = PaymentService.create_subscription_payment(create_user(), self.plan)
+        refund = Refund.objects.create(payment=payment, amount=Decimal('4'), status='succeeded')
+        Refund.objects.filter(pk=refund.pk).update(created_at=self.at(2))
+        SubscriptionHistory.objects.all().delete()
+        for action, day in [('activated', 0), ('activated', 0), ('renewed', 2), ('cancelled', 2),
+                            ('expired', 7), ('created', 0), ('payment_failed', 2)]:
+            self.add_history(subscription, action, day)
+
+        with self.assertNumQueries(3):
+            daily = build_timeseries(self.start, self.start + timedelta(days=3), window=2)
+
+        self.assertEqual(daily['buckets'], ['2025-03-03', '2025-03-04', '2025-03-05', '2025-03-06'])
+        series = daily['series']
+        self.assertEqual(series['revenue'], [25.5, 0, 10, 0])
+        self.assertEqual(series['payments'], [3, 0, 1, 0])
+        self.assertEqual(series['refunded_amount'], [0, 0, 4, 0])
+        self.assertEqual(series['refunds'], [0, 0, 1, 0])
+        self.assertEqual(series['net_revenue'], [25.5, 0, 6, 0])
+        self.assertEqual(series['new_subscriptions'], [2, 0, 0, 0])
+        self.assertEqual(series['renewed_subscriptions'], [0, 0, 1, 0])
+        self.assertEqual(series['cancelled_subscriptions'], [0, 0, 1, 0])
+        self.assertEqual(series['expired_subscriptions'], [0, 0, 0, 0])
+        self.assertEqual(daily['cumulative']['net_revenue'], [25.5, 25.5, 31.5, 31.5])
+        self.assertEqual(daily['moving_average']['revenue'], [25.5, 12.75, 5, 5])
+
+        # Начало недели выравнивается на понедельник
+        weekly = build_timeseries(self.start + timedelta(days=3), self.start + timedelta(days=8), 'week')
+        self.assertEqual(weekly['buckets'], ['2025-03-03', '2025-03-10'])
+        self.assertEqual(weekly['series']['revenue'], [35.5, 10])
+        self.assertEqual(weekly['series']['new_subscriptions'], [2, 0])
+        self.assertEqual(weekly['series']['expired_subscriptions'], [0, 1])
+
+    def test_renewal_is_not_counted_as_new_subscription(self):
+        user = create_user()
+        payment, subscription = PaymentService.create_subscription_payment(user, self.plan)
+        PaymentService.process_failed_payment(payment, 'Card declined')
+        # Повтор после отказа - все еще первая активация
+        PaymentService.process_successful_payment(payment)
+        Subscription.objects.filter(pk=subscription.pk).update(
+            end_date=timezone.now() - timedelta(minutes=1)
+        )
+        SubscriptionExpiryEngine().run()
+
+        renewal, _ = PaymentService.create_subscription_payment(User.objects.get(pk=user.pk), self.plan)
+        PaymentService.process_successful_payment(renewal)
+
+        today = timezone.localdate()
+        series = build_timeseries(today, today)['series']
+        self.assertEqual(
+            [series[name][0] for name in ('new_subscriptions', 'renewed_subscriptions',
+                                          'expired_subscriptions', 'payments')],
+            [1, 1, 1, 2]
+        )
+
+    # Бюджет задан для PostgreSQL: в SQLite date_trunc выполняется функцией Python
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'Latency budget is for PostgreSQL')
+    def test_year_of_daily_buckets_within_latency_budget(self):
+        days = 365
+        users = User.objects.bulk_create([
+            User(email=f'user{i}@example.com', username=f'user{i}') for i in range(200)
+        ])
+        subscriptions = Subscription.objects.bulk_create([
+            Subscription(user=user, plan=self.plan, status='active',
+                         start_date=self.at(0), end_date=self.at(30))
+            for user in users
+        ])
+        PaymentDailyRollup.objects.bulk_create([
+            PaymentDailyRollup(date=self.start + timedelta(days=day), currency=currency, plan=self.plan,
+                               payments_count=5, succeeded_count=4, revenue=Decimal('40'))
+            for day in range(days) for currency in ('USD', 'EUR', 'GBP')
+        ])
+        actions = list(SUBSCRIPTION_SERIES) + ['created', 'payment_failed']
+        history = SubscriptionHistory.objects.bulk_create([
+            SubscriptionHistory(subscription=subscriptions[i % len(subscriptions)],
+                                action=actions[i % len(actions)])
+            for i in range(50000)
+        ], batch_size=5000)
+        for day in range(days):
+            SubscriptionHistory.objects.filter(
+                pk__in=[row.pk for row in history[day::days]]
+            ).update(created_at=self.at(day))
+
+        end = self.start + timedelta(days=days - 1)
+        build_timeseries(self.start, end)  # прогрев
+        with self.assertNumQueries(3):
+            started = time.monotonic()
+            data = build_timeseries(self.start, end)
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(len(data['buckets']), days)
+        self.assertEqual(sum(data['series']['payments']), days * 12)
+        self.assertEqual(
+            sum(sum(data['series'][name]) for name in SUBSCRIPTION_SERIES.values()),
+            sum(1 for row in history if row.action in SUBSCRIPTION_SERIES)
+        )
+        self.assertLess(elapsed, 0.2)
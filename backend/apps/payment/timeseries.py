@@ -0,0 +1,173 @@
+"""
+Временные ряды выручки, подписок и возвратов по дням, неделям или месяцам.
+
+Каждый источник читается одним сгруппированным запросом (date_trunc в SQL):
+выручка и число платежей - из дневных сводок (apps.payment.rollups),
+события подписок - из SubscriptionHistory, возвраты - из Refund.
+Пустые интервалы заполняются нулями, накопительные ряды и скользящее
+среднее считаются в Python за один проход по уже сгруппированным точкам.
+"""
+from collections import deque
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate
+
+from django.db.models import Count, DateField, Q, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import PaymentDailyRollup, Refund
+
+TRUNCATE = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+# Действие в истории подписки -> имя ряда. activated пишется при первой
+# активации подписки, renewed - при оплате подписки, которая уже была активна
+# (apps.payment.services.PaymentService.process_successful_payment)
+SUBSCRIPTION_SERIES = {
+    'activated': 'new_subscriptions',
+    'renewed': 'renewed_subscriptions',
+    'cancelled': 'cancelled_subscriptions',
+    'expired': 'expired_subscriptions',
+}
+
+# Ряды, для которых считаются накопительные значения и скользящее среднее
+DERIVED_SERIES = ('revenue', 'net_revenue', 'refunded_amount')
+
+MAX_BUCKETS = 1000
+
+
+def bucket_start(day, interval):
+    """Начало интервала, в который попадает день"""
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    if interval == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(day, interval):
+    if interval == 'week':
+        return day + timedelta(days=7)
+    if interval == 'month':
+        return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    return day + timedelta(days=1)
+
+
+def bucket_starts(start_date, end_date, interval):
+    """Начала всех интервалов в [start_date, end_date]"""
+    buckets = []
+    day = bucket_start(start_date, interval)
+    while day <= end_date:
+        buckets.append(day)
+        day = next_bucket(day, interval)
+    return buckets
+
+
+def cumulative(values):
+    return [round(value, 2) for value in accumulate(values)]
+
+
+def moving_average(values, window):
+    """Скользящее среднее по window последним точкам (в начале ряда - по доступным)"""
+    result = []
+    points = deque()
+    total = 0
+    for value in values:
+        points.append(value)
+        total += value
+        if len(points) > window:
+            total -= points.popleft()
+        result.append(round(total / len(points), 2))
+    return result
+
+
+def _grouped(queryset, field, interval, **aggregates):
+    """{начало интервала: {агрегат: значение}} одним запросом с date_trunc по field"""
+    bucket = TRUNCATE[interval](field, output_field=DateField())
+    rows = queryset.annotate(bucket=bucket).values('bucket').annotate(**aggregates).order_by()
+    return {row.pop('bucket'): row for row in rows}
+
+
+def _datetime_range(start_date, end_date):
+    """Границы [начало start_date, начало дня после end_date) в текущем часовом поясе"""
+    tz = timezone.get_current_timezone()
+    return (
+        timezone.make_aware(datetime.combine(start_date, time.min), tz),
+        timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz),
+    )
+
+
+def build_timeseries(start_date, end_date, interval='day', window=7):
+    """
+    Ряды за [start_date, end_date] с шагом interval ('day', 'week', 'month').
+    Начало диапазона выравнивается на начало интервала, чтобы первый
+    интервал был полным. window - ширина скользящего среднего в интервалах.
+    """
+    from apps.subscribe.models import SubscriptionHistory
+
+    if interval not in TRUNCATE:
+        raise ValueError(f"Unknown interval: {interval}")
+
+    start_date = bucket_start(start_date, interval)
+    buckets = bucket_starts(start_date, end_date, interval)
+    if len(buckets) > MAX_BUCKETS:
+        raise ValueError(f"Range has more than {MAX_BUCKETS} {interval} buckets")
+
+    range_start, range_end = _datetime_range(start_date, end_date)
+
+    payments = _grouped(
+        PaymentDailyRollup.objects.filter(date__gte=start_date, date__lte=end_date),
+        'date', interval,
+        revenue=Sum('revenue'),
+        payments=Sum('succeeded_count'),
+    )
+    refunds = _grouped(
+        Refund.objects.filter(status='succeeded', created_at__gte=range_start, created_at__lt=range_end),
+        'created_at', interval,
+        refunded_amount=Sum('amount'),
+        refunds=Count('id'),
+    )
+    subscriptions = _grouped(
+        SubscriptionHistory.objects.filter(
+            action__in=SUBSCRIPTION_SERIES,
+            created_at__gte=range_start,
+            created_at__lt=range_end
+        ),
+        'created_at', interval,
+        **{
+            name: Count('id', filter=Q(action=action))
+            for action, name in SUBSCRIPTION_SERIES.items()
+        }
+    )
+
+    def series(source, name, cast=int):
+        return [cast(source.get(bucket, {}).get(name) or 0) for bucket in buckets]
+
+    data = {
+        'revenue': series(payments, 'revenue', float),
+        'payments': series(payments, 'payments'),
+        'refunded_amount': series(refunds, 'refunded_amount', float),
+        'refunds': series(refunds, 'refunds'),
+    }
+    for name in SUBSCRIPTION_SERIES.values():
+        data[name] = series(subscriptions, name)
+    data['net_revenue'] = [
+        round(revenue - refunded, 2)
+        for revenue, refunded in zip(data['revenue'], data['refunded_amount'])
+    ]
+
+    return {
+        'interval': interval,
+        'from': start_date.isoformat(),
+        'to': end_date.isoformat(),
+        'buckets': [bucket.isoformat() for bucket in buckets],
+        'series': data,
+        'cumulative': {name: cumulative(data[name]) for name in DERIVED_SERIES},
+        'moving_average': {
+            'window': window,
+            **{name: moving_average(data[name], window) for name in DERIVED_SERIES}
+        },
+    }
@@ -0,0 +1,87 @@
+"""
+Переходы статусов платежа.
+
+Каждый переход применяется одним условным UPDATE ... WHERE status = <текущий>
+(compare-and-set): из нескольких одновременных попыток (повторная доставка webhook, опрос
+payment_status, действие администратора) выигрывает ровно одна, и только
+она выполняет побочные эффекты (активацию подписки, запись в историю)
+в той же транзакции. Проигравшие попытки ничего не меняют.
+Там же обновляются дневные сводки (apps.payment.rollups).
+"""
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Payment
+from .rollups import record_transition
+
+logger = logging.getLogger(__name__)
+
+# Имя перехода -> (допустимые исходные статусы, целевой статус)
+TRANSITIONS = {
+    'start': (('pending', 'failed'), 'processing'),
+    # Оплата после отказа (повтор в Checkout) или после отмены ожидающего платежа
+    # все равно списана - такой платеж тоже становится успешным
+    'succeed': (('pending', 'processing', 'failed', 'cancelled'), 'succeeded'),
+    'fail': (('pending', 'processing'), 'failed'),
+    'cancel': (('pending', 'processing'), 'cancelled'),
+}
+
+# Статусы, при переходе в которые фиксируется processed_at
+FINAL_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+# Статусы, в которых событие об итоге оплаты уже ничего не меняет: поздняя
+# или пришедшая не по порядку доставка считается обработанной, а не ошибкой
+SETTLED_STATUSES = {
+    'succeed': ('succeeded', 'refunded'),
+    'fail': ('succeeded', 'failed', 'cancelled', 'refunded'),
+}
+
+
+def transition(payment, name, side_effect=None, **fields):
+    """
+    Применяет переход name к платежу.
+    fields - дополнительные поля, обновляемые тем же UPDATE;
+    side_effect(payment) вызывается в той же транзакции только при успешном переходе.
+    Возвращает True, если переход выполнен этим вызовом.
+    """
+    sources, target = TRANSITIONS[name]
+
+    # Статус в памяти уже не допускает перехода - запрос не нужен
+    if payment.status not in sources:
+        return False
+
+    now = timezone.now()
+    fields['updated_at'] = now
+    if target in FINAL_STATUSES:
+        fields.setdefault('processed_at', now)
+
+    with transaction.atomic():
+        while True:
+            # Исходный статус, записываемый в сводки, - ровно тот, из которого выполнен UPDATE
+            source = payment.status
+            won = Payment.objects.filter(
+                pk=payment.pk,
+                status=source
+            ).update(status=target, **fields)
+            if won:
+                break
+
+            # Статус изменил кто-то другой - обновляем его в памяти
+            payment.status = Payment.objects.values_list('status', flat=True).get(pk=payment.pk)
+            payment._snapshot_tracked_fields()
+            if payment.status not in sources:
+                return False
+
+        payment.status = target
+        for field, value in fields.items():
+            setattr(payment, field, value)
+        payment._snapshot_tracked_fields()
+        record_transition(payment, source, target)
+
+        if side_effect:
+            side_effect(payment)
+
+    logger.info(f"Payment {payment.id}: {name} -> {target}")
+    return True
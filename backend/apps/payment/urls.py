@@ -20,7 +20,9 @@ urlpatterns = [
 
     # Webhooks
     path('webhooks/stripe/', views.stripe_webhook, name='stripe-webhook'),
+    path('webhooks/metrics/', views.webhook_metrics, name='webhook-metrics'),
 
     # Analytics (Admin only)
     path('analytics/', views.payment_analytics, name='payment-analytics'),
+    path('analytics/timeseries/', views.payment_timeseries, name='payment-timeseries'),
 ]
\ No newline at end of file
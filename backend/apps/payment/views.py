@@ -1,6 +1,7 @@
 from django.shortcuts import render
 import stripe
 import json
+import logging
 from django.conf import settings
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
@@ -25,6 +26,8 @@ from .serializers import (
 from .services import StripeService, PaymentService, WebhookService
 from apps.subscribe.models import SubscriptionPlan
 
+logger = logging.getLogger(__name__)
+
 
 class PaymentListView(generics.ListAPIView):
     """Список платежей пользователя"""
@@ -50,45 +53,52 @@ class PaymentDetailView(generics.RetrieveAPIView):
         ).select_related('subscription', 'subscription__plan')
 
 
+@transaction.non_atomic_requests
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def create_checkout_session(request):
-    """Создает Stripe Checkout сессию для оплаты подписки"""
+    """
+    Создает Stripe Checkout сессию для оплаты подписки.
+    Платеж фиксируется короткой транзакцией, запросы к Stripe выполняются
+    вне транзакции, результат применяется условным UPDATE (transitions).
+    Платежи, для которых сессия так и не была записана, обрабатывает
+    apps.payment.reconciliation.recover_orphaned_checkouts.
+    """
     serializer = PaymentCreateSerializer(data=request.data, context={'request': request})
 
     if serializer.is_valid():
         try:
-            with transaction.atomic():
-                plan_id = serializer.validated_data['subscription_plan_id']
-                plan = get_object_or_404(SubscriptionPlan, id=plan_id, is_active=True)
+            plan_id = serializer.validated_data['subscription_plan_id']
+            plan = get_object_or_404(SubscriptionPlan, id=plan_id, is_active=True)
 
-                # Создаем платеж и подписку
+            # Фаза 1: создаем платеж и подписку
+            with transaction.atomic():
                 payment, subscription = PaymentService.create_subscription_payment(
                     request.user, plan
                 )
 
-                # Получаем URLs из запроса
-                success_url = serializer.validated_data.get(
-                    'success_url',
-                    f"{settings.FRONTEND_URL}/payment/success?session_id={{CHECKOUT_SESSION_ID}}"
-                )
-                cancel_url = serializer.validated_data.get(
-                    'cancel_url',
-                    f"{settings.FRONTEND_URL}/payment/cancel"
-                )
-
-                # Создаем Stripe сессию
-                session_data = StripeService.create_checkout_session(
-                    payment, success_url, cancel_url
-                )
-
-                if session_data:
-                    response_serializer = StripeCheckoutSessionSerializer(session_data)
-                    return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-                else:
-                    return Response({
-                        'error': 'Failed to create checkout session'
-                    }, status=status.HTTP_400_BAD_REQUEST)
+            # Получаем URLs из запроса
+            success_url = serializer.validated_data.get(
+                'success_url',
+                f"{settings.FRONTEND_URL}/payment/success?session_id={{CHECKOUT_SESSION_ID}}"
+            )
+            cancel_url = serializer.validated_data.get(
+                'cancel_url',
+                f"{settings.FRONTEND_URL}/payment/cancel"
+            )
+
+            # Фаза 2: создаем Stripe сессию вне транзакции
+            session_data = StripeService.create_checkout_session(
+                payment, success_url, cancel_url
+            )
+
+            if session_data:
+                response_serializer = StripeCheckoutSessionSerializer(session_data)
+                return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+            else:
+                return Response({
+                    'error': 'Failed to create checkout session'
+                }, status=status.HTTP_400_BAD_REQUEST)
 
         except Exception as e:
             return Response({
@@ -104,21 +114,13 @@ def payment_status(request, payment_id):
     """Проверяет статус платежа"""
     try:
         payment = get_object_or_404(
-            Payment,
+            Payment.objects.select_related('subscription'),
             id=payment_id,
             user=request.user
         )
 
-        # Если есть session_id, проверяем статус в Stripe
-        if payment.stripe_session_id and payment.status in ['pending', 'processing']:
-            session_info = StripeService.retrieve_session(payment.stripe_session_id)
-
-            if session_info:
-                if session_info['status'] == 'complete':
-                    PaymentService.process_successful_payment(payment)
-                elif session_info['status'] == 'failed':
-                    PaymentService.process_failed_payment(payment, "Session failed")
-
+        # Статус отдается из БД: его обновляют webhook и периодическая
+        # сверка со Stripe (apps.payment.reconciliation)
         response_data = {
             'payment_id': payment.id,
             'status': payment.status,
@@ -150,18 +152,12 @@ def cancel_payment(request, payment_id):
             user=request.user
         )
 
-        if not payment.is_pending:
+        # Отменяем платеж и подписку (только ожидающий платеж)
+        if not PaymentService.cancel_payment(payment):
             return Response({
                 'error': 'Can only cancel pending payments'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        payment.status = 'cancelled'
-        payment.save()
-
-        # Отменяем подписку
-        if payment.subscription:
-            payment.subscription.cancel()
-
         return Response({
             'message': 'Payment cancelled successfully'
         })
@@ -221,7 +217,8 @@ def create_refund(request, payment_id):
                 success = StripeService.refund_payment(
                     payment,
                     refund.amount,
-                    refund.reason
+                    refund.reason,
+                    refund_id=refund.id
                 )
 
                 if success:
@@ -267,6 +264,20 @@ def stripe_webhook(request):
         # Неверная подпись
         return HttpResponse(status=400)
 
+    if settings.STRIPE_WEBHOOK_ASYNC:
+        # Быстрый ответ: сохраняем событие и обрабатываем его в Celery
+        from .tasks import process_webhook_event
+
+        try:
+            webhook_event, created = WebhookService.record_stripe_event(event)
+        except Exception:
+            logger.exception('Error recording Stripe webhook')
+            return HttpResponse(status=500)
+
+        if created:
+            transaction.on_commit(lambda: process_webhook_event.delay(webhook_event.pk))
+        return HttpResponse(status=200)
+
     # Обрабатываем событие
     success = WebhookService.process_stripe_webhook(event)
 
@@ -276,59 +287,122 @@ def stripe_webhook(request):
         return HttpResponse(status=400)
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def webhook_metrics(request):
+    """Очередь повторной обработки webhook событий для администраторов"""
+    from .retry import retry_metrics
+
+    return Response(retry_metrics())
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAdminUser])
 def payment_analytics(request):
-    """Аналитика по платежам для администраторов"""
-    from django.db.models import Count, Sum, Avg
+    """
+    Аналитика по платежам для администраторов.
+    Считается по дневным сводкам (apps.payment.rollups); период задается
+    параметрами ?from=YYYY-MM-DD&to=YYYY-MM-DD, по умолчанию - последние 30 дней.
+    """
+    from datetime import date, timedelta
     from django.utils import timezone
-    from datetime import timedelta
+    from apps.subscribe.models import Subscription
+    from .rollups import summarize_rollups
+
+    today = timezone.localdate()
+    try:
+        date_to = date.fromisoformat(request.query_params['to']) if 'to' in request.query_params else today
+        date_from = (
+            date.fromisoformat(request.query_params['from']) if 'from' in request.query_params
+            else date_to - timedelta(days=30)
+        )
+    except ValueError:
+        return Response({
+            'error': 'Dates must be in YYYY-MM-DD format'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if date_from > date_to:
+        return Response({
+            'error': "'from' must not be later than 'to'"
+        }, status=status.HTTP_400_BAD_REQUEST)
 
     # Общая статистика
-    total_payments = Payment.objects.count()
-    successful_payments = Payment.objects.filter(status='succeeded').count()
-    total_revenue = Payment.objects.filter(
-        status='succeeded'
-    ).aggregate(total=Sum('amount'))['total'] or 0
-
-    # Статистика за последний месяц
-    last_month = timezone.now() - timedelta(days=30)
-    monthly_payments = Payment.objects.filter(
-        created_at__gte=last_month,
-        status='succeeded'
-    )
-    monthly_revenue = monthly_payments.aggregate(
-        total=Sum('amount')
-    )['total'] or 0
-    monthly_count = monthly_payments.count()
-
-    # Средний чек
-    avg_payment = Payment.objects.filter(
-        status='succeeded'
-    ).aggregate(avg=Avg('amount'))['avg'] or 0
-
-    # Статистика по подпискам
-    active_subscriptions = Payment.objects.filter(
-        status='succeeded',
-        subscription__status='active'
-    ).count()
+    overall = summarize_rollups()
+    total_payments = overall['payments']
+    successful_payments = overall['successful_payments']
+    total_revenue = overall['revenue_total']
+
+    # Статистика за период
+    period = summarize_rollups(date_from, date_to)
+
+    def breakdown(rows):
+        return [
+            {**row, 'revenue_total': float(row['revenue_total'] or 0)}
+            for row in rows
+        ]
 
     return Response({
         'total_payments': total_payments,
         'successful_payments': successful_payments,
         'success_rate': (successful_payments / total_payments * 100) if total_payments > 0 else 0,
         'total_revenue': float(total_revenue),
-        'monthly_revenue': float(monthly_revenue),
-        'monthly_payments': monthly_count,
-        'average_payment': float(avg_payment),
-        'active_subscriptions': active_subscriptions,
+        'monthly_revenue': float(period['revenue_total']),
+        'monthly_payments': period['successful_payments'],
+        # Средний чек
+        'average_payment': float(total_revenue / successful_payments) if successful_payments else 0,
+        'active_subscriptions': Subscription.objects.filter(status='active').count(),
+        'by_currency': breakdown(period['by_currency']),
+        'by_plan': breakdown(period['by_plan']),
         'period': {
-            'from': last_month.isoformat(),
-            'to': timezone.now().isoformat()
+            'from': date_from.isoformat(),
+            'to': date_to.isoformat()
         }
     })
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def payment_timeseries(request):
+    """
+    Временные ряды выручки, подписок и возвратов для администраторов:
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD&interval=day|week|month&window=7
+    """
+    from datetime import date, timedelta
+    from django.utils import timezone
+    from .timeseries import build_timeseries
+
+    today = timezone.localdate()
+    try:
+        date_to = date.fromisoformat(request.query_params['to']) if 'to' in request.query_params else today
+        date_from = (
+            date.fromisoformat(request.query_params['from']) if 'from' in request.query_params
+            else date_to - timedelta(days=30)
+        )
+        window = int(request.query_params.get('window', 7))
+    except ValueError:
+        return Response({
+            'error': 'Dates must be in YYYY-MM-DD format and window must be an integer'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if date_from > date_to or window < 1:
+        return Response({
+            'error': "'from' must not be later than 'to' and window must be positive"
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        data = build_timeseries(
+            date_from, date_to,
+            interval=request.query_params.get('interval', 'day'),
+            window=window
+        )
+    except ValueError as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(data)
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def user_payment_history(request):
@@ -344,6 +418,7 @@ def user_payment_history(request):
     })
 
 
+@transaction.non_atomic_requests
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def retry_payment(request, payment_id):
@@ -371,10 +446,7 @@ def retry_payment(request, payment_id):
         )
 
         if session_data:
-            # Обновляем статус платежа
-            payment.status = 'processing'
-            payment.save()
-
+            # Статус платежа переведен в processing при создании сессии
             response_serializer = StripeCheckoutSessionSerializer(session_data)
             return Response(response_serializer.data)
         else:
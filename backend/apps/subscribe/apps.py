@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SubscribeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.subscribe'
+
+    def ready(self):
+        # Сброс кеша возможностей подписки при ее изменении
+        from . import entitlements  # noqa: F401
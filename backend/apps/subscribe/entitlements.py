@@ -0,0 +1,173 @@
+"""
+Возможности (entitlements), которые дает пользователю активная подписка.
+
+has_entitlement(user, 'pin_posts') заменяет проверки вида
+hasattr(user, 'subscription') and user.subscription.is_active.
+Возможности пользователя определяются один раз:
+- на время запроса - запоминаются на объекте пользователя;
+- между запросами - хранятся в кеше Django с TTL (ENTITLEMENTS_CACHE_TIMEOUT),
+  но только для активной подписки.
+Запись в кеше сбрасывается при сохранении или удалении подписки, изменение
+тарифного плана сбрасывает записи всех пользователей (версия в ключе).
+Окончание подписки учитывается по сохраненной end_date без сброса кеша.
+
+Подписку активируют другой воркер или Celery (webhook, сверка), и с кешем
+в памяти процесса их сброс сюда не доходит. Поэтому отсутствие возможностей
+не кешируется: оплативший пользователь получает их сразу. Отмена подписки
+в другом процессе видна не позже чем через TTL (с таким кешем он короткий).
+"""
+import math
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+KEY_PREFIX = 'entitlements'
+
+# Возможности любой активной подписки, если план явно не отключает их
+DEFAULT_ENTITLEMENTS = frozenset({'pin_posts'})
+
+MEMO_ATTR = '_entitlements_memo'
+
+# Меняется при любом сбросе в этом процессе: запомненные на объектах
+# пользователей значения перестают использоваться
+_generation = 0
+
+
+class Entitlements(namedtuple('Entitlements', ['has_subscription', 'active_until', 'features'])):
+    """Подписка пользователя: есть ли она, до какого времени активна (timestamp) и возможности"""
+
+    @property
+    def is_active(self):
+        return bool(self.active_until and self.active_until > time.time())
+
+    def allows(self, name):
+        return self.is_active and name in self.features
+
+
+NO_ENTITLEMENTS = Entitlements(False, None, frozenset())
+
+
+def get_entitlements_cache():
+    return caches[getattr(settings, 'ENTITLEMENTS_CACHE_ALIAS', 'default')]
+
+
+def _version(cache):
+    key = f'{KEY_PREFIX}:version'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _cache_key(cache, user_id):
+    return f'{KEY_PREFIX}:{_version(cache)}:{user_id}'
+
+
+def plan_features(plan):
+    """Возможности тарифного плана: features - словарь флагов или список имен"""
+    features = plan.features or {}
+    if isinstance(features, dict):
+        enabled = {name for name, value in features.items() if value}
+        disabled = {name for name, value in features.items() if not value}
+    else:
+        enabled, disabled = set(features), set()
+    return frozenset((DEFAULT_ENTITLEMENTS | enabled) - disabled)
+
+
+def _from_subscription(subscription):
+    if subscription is None:
+        return NO_ENTITLEMENTS
+    if subscription.status != 'active':
+        return Entitlements(True, None, frozenset())
+    return Entitlements(True, subscription.end_date.timestamp(), plan_features(subscription.plan))
+
+
+def _load(user):
+    from .models import Subscription
+
+    # Подписка уже загружена вместе с пользователем (select_related)
+    if type(user) is get_user_model() and get_user_model().subscription.related.is_cached(user):
+        return _from_subscription(getattr(user, 'subscription', None))
+
+    subscription = Subscription.objects.select_related('plan').only(
+        'status', 'end_date', 'plan', 'plan__features'
+    ).filter(user_id=user.pk).first()
+    return _from_subscription(subscription)
+
+
+def get_entitlements(user):
+    """Подписка и возможности пользователя (Entitlements)"""
+    if not user or not user.is_authenticated:
+        return NO_ENTITLEMENTS
+
+    # vars() - собственный __dict__ объекта, в том числе ленивого пользователя
+    # (apps.accounts.authentication.ClaimsUser), без загрузки модели
+    memo = vars(user).get(MEMO_ATTR)
+    if memo and memo[0] == _generation:
+        return memo[1]
+
+    cache = get_entitlements_cache()
+    key = _cache_key(cache, user.pk)
+    cached = cache.get(key)
+    if cached is None:
+        entitlements = _load(user)
+        if entitlements.is_active:
+            timeout = min(
+                getattr(settings, 'ENTITLEMENTS_CACHE_TIMEOUT', 300),
+                math.ceil(entitlements.active_until - time.time())
+            )
+            cache.set(key, tuple(entitlements), timeout)
+    else:
+        entitlements = Entitlements(*cached)
+
+    vars(user)[MEMO_ATTR] = (_generation, entitlements)
+    return entitlements
+
+
+def has_entitlement(user, name):
+    """Дает ли активная подписка пользователя возможность name"""
+    return get_entitlements(user).allows(name)
+
+
+def invalidate_entitlements(user_id=None):
+    """Сбрасывает возможности пользователя, без user_id - всех пользователей"""
+    global _generation
+    _generation += 1
+
+    cache = get_entitlements_cache()
+    if user_id is None:
+        key = f'{KEY_PREFIX}:version'
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+    else:
+        cache.delete(_cache_key(cache, user_id))
+
+
+def invalidate_entitlements_for(user_ids):
+    """Сбрасывает возможности нескольких пользователей (одной операцией кеша)"""
+    global _generation
+    _generation += 1
+
+    cache = get_entitlements_cache()
+    cache.delete_many([_cache_key(cache, user_id) for user_id in user_ids])
+
+
+@receiver([post_save, post_delete], sender='subscribe.Subscription')
+def invalidate_subscription_entitlements(sender, instance, **kwargs):
+    invalidate_entitlements(instance.user_id)
+    # Повторно после фиксации: до нее другой запрос мог закешировать старые данные
+    transaction.on_commit(lambda: invalidate_entitlements(instance.user_id))
+
+
+@receiver([post_save, post_delete], sender='subscribe.SubscriptionPlan')
+def invalidate_plan_entitlements(sender, **kwargs):
+    invalidate_entitlements()
@@ -0,0 +1,131 @@
+"""
+Пакетное истечение подписок.
+
+Истекшие подписки переводятся в статус expired порциями: одна порция - это
+одна транзакция с одним UPDATE ... RETURNING, удалением закрепленных постов
+одним DELETE и записью истории через bulk_create. Строки порции выбираются
+с FOR UPDATE SKIP LOCKED, поэтому несколько воркеров могут обрабатывать
+истекшие подписки одновременно, не блокируя и не дублируя друг друга.
+"""
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import PinnedPost, Subscription, SubscriptionHistory
+
+logger = logging.getLogger(__name__)
+
+EXPIRE_CHUNK_SQL = """
+    UPDATE {table}
+    SET status = 'expired', updated_at = %s
+    WHERE id IN (
+        SELECT id FROM {table}
+        WHERE status = 'active' AND end_date < %s
+        ORDER BY end_date
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, user_id
+"""
+
+
+def invalidate_users(user_ids):
+    """Сбрасывает кеши, зависящие от подписок пользователей user_ids"""
+    from apps.main.cache import invalidate
+
+    from .entitlements import invalidate_entitlements_for
+
+    invalidate('subscriptions', 'pins')
+    invalidate_entitlements_for(user_ids)
+
+
+class SubscriptionExpiryEngine:
+    """Переводит истекшие активные подписки в статус expired порциями"""
+
+    def __init__(self, chunk_size=None, now=None):
+        self.chunk_size = chunk_size or getattr(settings, 'SUBSCRIPTION_EXPIRY_CHUNK_SIZE', 1000)
+        self.now = now or timezone.now()
+
+    def _expire_rows(self):
+        """Помечает порцию подписок истекшими, возвращает [(id, user_id), ...]"""
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    EXPIRE_CHUNK_SQL.format(table=Subscription._meta.db_table),
+                    [timezone.now(), self.now, self.chunk_size]
+                )
+                return cursor.fetchall()
+
+        rows = list(
+            Subscription.objects.select_for_update(skip_locked=True).filter(
+                status='active',
+                end_date__lt=self.now
+            ).order_by('end_date').values_list('id', 'user_id')[:self.chunk_size]
+        )
+        if rows:
+            Subscription.objects.filter(pk__in=[pk for pk, _ in rows]).update(
+                status='expired',
+                updated_at=timezone.now()
+            )
+        return rows
+
+    def expire_chunk(self):
+        """
+        Обрабатывает одну порцию в транзакции.
+        Возвращает (количество истекших подписок, количество снятых закреплений).
+        """
+        with transaction.atomic():
+            rows = self._expire_rows()
+            if not rows:
+                return 0, 0
+
+            user_ids = [user_id for _, user_id in rows]
+            pinned = dict(
+                PinnedPost.objects.filter(user_id__in=user_ids).values_list('user_id', 'post_id')
+            )
+            if pinned:
+                PinnedPost.objects.filter(user_id__in=list(pinned)).delete()
+
+            SubscriptionHistory.objects.bulk_create([
+                SubscriptionHistory(
+                    subscription_id=subscription_id,
+                    action='expired',
+                    description='Subscription expired automatically',
+                    metadata={'unpinned_post_id': pinned[user_id]} if user_id in pinned else {}
+                )
+                for subscription_id, user_id in rows
+            ])
+
+            # UPDATE и bulk-операции не отправляют сигналы моделей: сбрасываем
+            # кеши ответов, возможностей и пользователей аутентификации явно
+            invalidate_users(user_ids)
+            transaction.on_commit(lambda: invalidate_users(user_ids))
+
+        return len(rows), len(pinned)
+
+    def run(self, max_chunks=None):
+        """Обрабатывает порции, пока есть истекшие подписки (или до max_chunks)"""
+        expired_count = 0
+        pinned_posts_removed = 0
+        chunks = 0
+
+        while max_chunks is None or chunks < max_chunks:
+            expired, unpinned = self.expire_chunk()
+            if not expired:
+                break
+            expired_count += expired
+            pinned_posts_removed += unpinned
+            chunks += 1
+
+        if expired_count:
+            logger.info(
+                f"Expired {expired_count} subscriptions in {chunks} chunks, "
+                f"removed {pinned_posts_removed} pinned posts"
+            )
+
+        return {
+            'expired_subscriptions': expired_count,
+            'pinned_posts_removed': pinned_posts_removed
+        }
@@ -1,11 +1,9 @@
 # backend/apps/subscribe/management/commands/fix_stripe_integration.py
 import stripe
 from django.core.management.base import BaseCommand
-from django.conf import settings
+from apps.payment.stripe_client import get_stripe_client, idempotency_key
 from apps.subscribe.models import SubscriptionPlan
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
 
 class Command(BaseCommand):
     help = 'Fix Stripe integration by creating real products and prices'
@@ -19,10 +17,11 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         force = options['force']
+        client = get_stripe_client()
 
         # Проверяем подключение к Stripe
         try:
-            stripe.Balance.retrieve()
+            client.retrieve_balance()
             self.stdout.write(self.style.SUCCESS('✅ Подключение к Stripe работает'))
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'❌ Ошибка подключения к Stripe: {e}'))
@@ -41,7 +40,8 @@ class Command(BaseCommand):
 
             try:
                 # Создаем или обновляем продукт
-                product = stripe.Product.create(
+                product = client.create_product(
+                    idempotency_key=idempotency_key('product', plan.id, plan.updated_at.timestamp()),
                     name=plan.name,
                     description=f"Subscription plan: {plan.name}",
                     metadata={
@@ -53,7 +53,8 @@ class Command(BaseCommand):
                 self.stdout.write(f'  ✅ Продукт создан: {product.id}')
 
                 # Создаем цену
-                price = stripe.Price.create(
+                price = client.create_price(
+                    idempotency_key=idempotency_key('price', plan.id, product.id),
                     product=product.id,
                     unit_amount=int(plan.price * 100),  # В центах
                     currency='usd',
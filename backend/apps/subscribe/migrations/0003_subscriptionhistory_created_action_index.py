@@ -0,0 +1,17 @@
+# Generated by Django 5.2.9 on 2026-10-18 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscribe', '0002_subscription_reminder_sent_for'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscriptionhistory',
+            index=models.Index(fields=['created_at', 'action'], name='subscriptio_created_db0787_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 21:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscribe', '0003_subscriptionhistory_created_action_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='subscriptionhistory',
+            name='action',
+            field=models.CharField(choices=[('created', 'Created'), ('activated', 'Activated'), ('renewed', 'Renewed'), ('cancelled', 'Cancelled'), ('expired', 'Expired'), ('payment_failed', 'Payment Failed'), ('post_pinned', 'Post Pinned'), ('post_unpinned', 'Post Unpinned')], max_length=20),
+        ),
+    ]
@@ -49,6 +49,8 @@ class Subscription(models.Model):
     end_date = models.DateTimeField()
     stripe_subscription_id = models.CharField(max_length=255, blank=True, null=True)
     auto_renew = models.BooleanField(default=True)
+    # end_date, для которой уже отправлено напоминание об истечении
+    reminder_sent_for = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -140,15 +142,44 @@ class PinnedPost(models.Model):
     def save(self, *args, **kwargs):
         """Переопределяет сохранение для проверки подписки"""
 
+        from .entitlements import has_entitlement
+
         # проверка на наличие активной подписки
-        if not hasattr(self.user, 'subscription') or not self.user.subscription.is_active:
+        if not has_entitlement(self.user, 'pin_posts'):
             raise ValueError('User must have an active subscription to pin posts.')
 
         # проверка принадлежности поста к пользователю
-        if self.post.author != self.user:
+        if self.post.author_id != self.user_id:
             raise ValueError('User can only pin their own posts.')
 
+        created = self._state.adding
         super().save(*args, **kwargs)
+        if created:
+            self._record_history('post_pinned', 'pinned')
+
+    def delete(self, *args, **kwargs):
+        """
+        Удаляет закрепление и записывает это в историю подписки.
+        Массовое удаление (QuerySet.delete, истечение подписок в
+        apps.subscribe.expiry) историю закреплений не пишет: снятое
+        закрепление отмечается в записи об истечении.
+        """
+        result = super().delete(*args, **kwargs)
+        self._record_history('post_unpinned', 'unpinned')
+        return result
+
+    def _record_history(self, action, verb):
+        subscription_id = Subscription.objects.filter(
+            user_id=self.user_id
+        ).values_list('pk', flat=True).first()
+        if subscription_id is None:
+            return
+        SubscriptionHistory.objects.create(
+            subscription_id=subscription_id,
+            action=action,
+            description=f'Post "{self.post.title}" {verb}',
+            metadata={'post_id': self.post_id, 'post_title': self.post.title}
+        )
 
 
 class SubscriptionHistory(models.Model):
@@ -160,6 +191,8 @@ class SubscriptionHistory(models.Model):
         ('cancelled', 'Cancelled'),
         ('expired', 'Expired'),
         ('payment_failed', 'Payment Failed'),
+        ('post_pinned', 'Post Pinned'),
+        ('post_unpinned', 'Post Unpinned'),
     ]
 
     subscription = models.ForeignKey(
@@ -177,6 +210,9 @@ class SubscriptionHistory(models.Model):
         verbose_name = 'Subscription History'
         verbose_name_plural = 'Subscription History'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'action']),
+        ]
 
     def __str__(self):
         return f"{self.subscription.user.username} - {self.action}"
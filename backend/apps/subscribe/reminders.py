@@ -0,0 +1,137 @@
+"""
+Рассылка напоминаний о скором истечении подписки.
+
+Получатели выбираются порциями вместе с пользователем и планом
+(select_related), письма отправляются через одно открытое соединение
+почтового backend'а. У подписок, письма которых отправлены, запоминается
+end_date, для которой отправлено напоминание (одним UPDATE на порцию),
+поэтому повторный запуск не отправляет письма повторно, а продление
+подписки (новая end_date) снова делает ее получателем. После ошибки
+отправки соединение переоткрывается, а неотправленное письмо остается
+для следующего запуска.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Subscription
+
+logger = logging.getLogger(__name__)
+
+REMINDER_SUBJECT = 'Your subscription is expiring soon'
+
+
+def render_reminder(subscription):
+    """Текст напоминания для подписки"""
+    user = subscription.user
+    return (
+        f'Dear {user.get_full_name() or user.username},\n\n'
+        f'Your {subscription.plan.name} subscription will expire on {subscription.end_date.strftime("%B %d, %Y")}.\n\n'
+        f'To continue enjoying premium features, please renew your subscription.\n\n'
+        f'Best regards,\nNews Site Team'
+    )
+
+
+class ExpiryReminderMailer:
+    """Отправляет напоминания пачками через одно соединение"""
+
+    def __init__(self, days_before=3, batch_size=None, rate_limit=None, now=None):
+        self.days_before = days_before
+        self.batch_size = batch_size or getattr(settings, 'SUBSCRIPTION_REMINDER_BATCH_SIZE', 500)
+        # Максимум писем в секунду, 0 - без ограничения
+        self.rate_limit = (
+            rate_limit if rate_limit is not None
+            else getattr(settings, 'SUBSCRIPTION_REMINDER_RATE_LIMIT', 0)
+        )
+        self.now = now or timezone.now()
+
+    def recipients(self):
+        """Подписки, истекающие через days_before дней, без отправленного напоминания"""
+        reminder_date = (self.now + timedelta(days=self.days_before)).date()
+        return Subscription.objects.select_related('user', 'plan').filter(
+            status='active',
+            end_date__date=reminder_date,
+            auto_renew=False
+        ).exclude(
+            reminder_sent_for=F('end_date')
+        ).exclude(user__email='')
+
+    def build_messages(self, subscriptions, connection):
+        return [
+            EmailMessage(
+                subject=REMINDER_SUBJECT,
+                body=render_reminder(subscription),
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[subscription.user.email],
+                connection=connection
+            )
+            for subscription in subscriptions
+        ]
+
+    def _throttle(self, started_at, sent_count):
+        """Выдерживает паузу, чтобы не превышать rate_limit писем в секунду"""
+        if not self.rate_limit:
+            return
+        delay = sent_count / self.rate_limit - (time.monotonic() - started_at)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _reopen(self, connection):
+        """Переоткрывает соединение: после ошибки SMTP сессия может быть в неизвестном состоянии"""
+        try:
+            connection.close()
+        except Exception:
+            pass
+        connection.open()
+
+    def send(self):
+        """Отправляет все напоминания, возвращает статистику"""
+        queryset = self.recipients().order_by('pk')
+        sent_count = 0
+        failed_count = 0
+        last_pk = 0
+        started_at = time.monotonic()
+
+        connection = get_connection()
+        connection.open()
+        try:
+            while True:
+                batch = list(queryset.filter(pk__gt=last_pk)[:self.batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+
+                delivered = []
+                try:
+                    for subscription, message in zip(batch, self.build_messages(batch, connection)):
+                        try:
+                            message.send()
+                        except Exception as e:
+                            failed_count += 1
+                            logger.error(f"Failed to send expiry reminder to {subscription.user.email}: {e}")
+                            self._reopen(connection)
+                            continue
+
+                        delivered.append(subscription.pk)
+                        sent_count += 1
+                        self._throttle(started_at, sent_count)
+                finally:
+                    # Помечаем отправленные письма, даже если порция прервана
+                    if delivered:
+                        Subscription.objects.filter(pk__in=delivered).update(
+                            reminder_sent_for=F('end_date')
+                        )
+        finally:
+            connection.close()
+
+        elapsed = time.monotonic() - started_at
+        return {
+            'reminders_sent': sent_count,
+            'reminders_failed': failed_count,
+            'messages_per_second': round(sent_count / elapsed, 1) if elapsed else sent_count
+        }
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from django.utils import timezone
+from .entitlements import has_entitlement
 from .models import SubscriptionPlan, Subscription, PinnedPost, SubscriptionHistory
 
 
@@ -104,7 +105,7 @@ class PinnedPostSerializer(serializers.ModelSerializer):
             'title': obj.post.title,
             'slug': obj.post.slug,
             'content': obj.post.content,
-            'image': obj.post.image,
+            'image': obj.post.image.url if obj.post.image else None,
             'views_count': obj.post.views_count,
             'created_at': obj.post.created_at,
         }
@@ -114,7 +115,7 @@ class PinnedPostSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
 
         # Проверяем, что пост принадлежит пользователю
-        if value.author != user:
+        if value.author_id != user.pk:
             raise serializers.ValidationError('You can ony pinned your posts.')
 
         # Проверяем, что пост опубликован
@@ -128,7 +129,7 @@ class PinnedPostSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
 
         # Проверяем, есть ли активная подписка
-        if not hasattr(user, 'subscription') or not user.subscription.is_active:
+        if not has_entitlement(user, 'pin_posts'):
             raise serializers.ValidationError({
                 'non_field_errors': ['Active subscription required to pin posts.']
             })
@@ -173,7 +174,7 @@ class UserSubscriptionStatusSerializer(serializers.Serializer):
             'is_active': is_active,
             'subscription': SubscriptionSerializer(subscription).data if subscription else None,
             'pinned_post': PinnedPostSerializer(pinned_post).data if pinned_post else None,
-            'can_pin_posts': is_active,
+            'can_pin_posts': has_entitlement(user, 'pin_posts'),
         }
 
 
@@ -191,7 +192,7 @@ class PinPostSerializer(serializers.Serializer):
             raise serializers.ValidationError("Post not found or not published.")
 
         user = self.context['request'].user
-        if post.author != user:
+        if post.author_id != user.pk:
             raise serializers.ValidationError("You can only pin your own posts.")
 
         return value
@@ -201,7 +202,7 @@ class PinPostSerializer(serializers.Serializer):
         user = self.context['request'].user
 
         # Проверяем подписку
-        if not hasattr(user, 'subscription') or not user.subscription.is_active:
+        if not has_entitlement(user, 'pin_posts'):
             raise serializers.ValidationError({
                 'non_field_errors': ['Active subscription required to pin posts.']
             })
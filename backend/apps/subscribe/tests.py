@@ -1,3 +1,290 @@
-from django.test import TestCase
+import smtplib
+from datetime import timedelta
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import caches
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from apps.accounts.tokens import UserClaimsRefreshToken
+from apps.main.models import Category, Post
+
+from . import entitlements
+from .expiry import SubscriptionExpiryEngine
+from .models import PinnedPost, Subscription, SubscriptionHistory, SubscriptionPlan
+from .reminders import ExpiryReminderMailer
+
+
+def create_subscriber(username, plan, **kwargs):
+    user = User.objects.create(email=f'{username}@example.com', username=username)
+    Subscription.objects.create(
+        user=user, plan=plan, status=kwargs.pop('status', 'active'),
+        start_date=timezone.now(), end_date=timezone.now() + timedelta(days=30), **kwargs
+    )
+    return user
+
+
+class SubscriptionExpiryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = SubscriptionPlan.objects.create(name='Plan', price=10, stripe_price_id='price_1')
+        cls.category = Category.objects.create(name='News')
+        cls.users = [create_subscriber(f'user{i}', cls.plan) for i in range(5)]
+        for user in cls.users[:2]:
+            post = Post.objects.create(
+                title=user.username, slug=user.username, content='text',
+                author=user, category=cls.category
+            )
+            PinnedPost.objects.create(user=user, post=post)
+
+    def cached_entitlements(self, user):
+        cache = entitlements.get_entitlements_cache()
+        return cache.get(entitlements._cache_key(cache, user.pk))
+
+    def test_expires_in_chunks_and_invalidates_caches(self):
+        expired_users = self.users[:3]
+        for user in self.users:
+            entitlements.get_entitlements(User.objects.get(pk=user.pk))
+        # UPDATE без сигналов: закешированные возможности остаются
+        Subscription.objects.filter(user__in=expired_users).update(
+            end_date=timezone.now() - timedelta(minutes=1)
+        )
+        self.assertIsNotNone(self.cached_entitlements(expired_users[0]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = SubscriptionExpiryEngine(chunk_size=2).run()
+
+        self.assertEqual(result, {'expired_subscriptions': 3, 'pinned_posts_removed': 2})
+        self.assertEqual(
+            set(Subscription.objects.filter(status='expired').values_list('user_id', flat=True)),
+            {user.pk for user in expired_users}
+        )
+        self.assertFalse(PinnedPost.objects.exists())
+        self.assertEqual(SubscriptionHistory.objects.filter(action='expired').count(), 3)
+        for user in expired_users:
+            self.assertIsNone(self.cached_entitlements(user))
+        self.assertIsNotNone(self.cached_entitlements(self.users[4]))
+
+    def test_chunk_expires_subscriptions_with_history_and_bulk_unpin(self):
+        expired_users = self.users[1:4]
+        Subscription.objects.filter(user__in=expired_users).update(
+            end_date=timezone.now() - timedelta(minutes=1)
+        )
+        pinned_post = PinnedPost.objects.get(user=self.users[1]).post_id
+
+        with CaptureQueriesContext(connection) as queries:
+            result = SubscriptionExpiryEngine(chunk_size=10).expire_chunk()
+
+        self.assertEqual(result, (3, 1))
+        statuses = dict(Subscription.objects.values_list('user_id', 'status'))
+        self.assertEqual(
+            statuses,
+            {user.pk: 'expired' if user in expired_users else 'active' for user in self.users}
+        )
+        # Снимается только закрепление пользователя с истекшей подпиской
+        self.assertEqual(list(PinnedPost.objects.values_list('user_id', flat=True)), [self.users[0].pk])
+
+        history = {
+            row.subscription.user_id: row
+            for row in SubscriptionHistory.objects.select_related('subscription').filter(action='expired')
+        }
+        self.assertEqual(set(history), {user.pk for user in expired_users})
+        self.assertEqual(history[self.users[1].pk].metadata, {'unpinned_post_id': pinned_post})
+        self.assertEqual(history[self.users[2].pk].metadata, {})
+
+        # Закрепления удаляются одним DELETE, история - одним INSERT
+        sql = [query['sql'] for query in queries]
+        self.assertEqual(len([q for q in sql if q.startswith('DELETE') and 'pinned_posts' in q]), 1)
+        self.assertEqual(len([q for q in sql if q.startswith('INSERT') and 'subscription_history' in q]), 1)
+
+    def test_nothing_to_expire(self):
+        self.assertEqual(
+            SubscriptionExpiryEngine().run(),
+            {'expired_subscriptions': 0, 'pinned_posts_removed': 0}
+        )
+
+
+class FlakyEmailBackend(EmailBackend):
+    """locmem backend, у которого письма на failing_recipients обрывают сессию SMTP"""
+    failing_recipients = set()
+    opened = 0
+
+    def open(self):
+        FlakyEmailBackend.opened += 1
+        self.broken = False
+        return True
+
+    def send_messages(self, messages):
+        if self.broken:
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        for message in messages:
+            if set(message.to) & self.failing_recipients:
+                self.broken = True
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b'rejected')})
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='apps.subscribe.tests.FlakyEmailBackend')
+class ExpiryReminderTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        plan = SubscriptionPlan.objects.create(name='Plan', price=10, stripe_price_id='price_1')
+        cls.users = [create_subscriber(f'user{i}', plan, auto_renew=False) for i in range(5)]
+        Subscription.objects.update(end_date=timezone.now() + timedelta(days=3))
+
+    def setUp(self):
+        FlakyEmailBackend.failing_recipients = set()
+        FlakyEmailBackend.opened = 0
+
+    def test_sends_each_reminder_once(self):
+        result = ExpiryReminderMailer(batch_size=2).send()
+
+        self.assertEqual(result['reminders_sent'], 5)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(FlakyEmailBackend.opened, 1)
+
+        self.assertEqual(ExpiryReminderMailer().send()['reminders_sent'], 0)
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_failed_recipient_does_not_block_batch(self):
+        failing = self.users[1].email
+        FlakyEmailBackend.failing_recipients = {failing}
+
+        result = ExpiryReminderMailer(batch_size=10).send()
+
+        # После ошибки соединение переоткрыто, остальные письма пачки отправлены
+        self.assertEqual((result['reminders_sent'], result['reminders_failed']), (4, 1))
+        self.assertEqual(FlakyEmailBackend.opened, 2)
+        self.assertNotIn([failing], [message.to for message in mail.outbox])
+        pending = Subscription.objects.filter(reminder_sent_for__isnull=True)
+        self.assertEqual(list(pending.values_list('user__email', flat=True)), [failing])
+
+        FlakyEmailBackend.failing_recipients = set()
+        self.assertEqual(ExpiryReminderMailer().send()['reminders_sent'], 1)
+        self.assertEqual(len(mail.outbox), 5)
+
+
+
+@override_settings(EMAIL_BACKEND='apps.subscribe.tests.FlakyEmailBackend')
+class ExpiryReminderLargeBatchTests(TestCase):
+    """Рассылка большого числа напоминаний на locmem backend"""
+    count = 50000
+
+    @classmethod
+    def setUpTestData(cls):
+        plan = SubscriptionPlan.objects.create(name='Plan', price=10, stripe_price_id='price_1')
+        users = User.objects.bulk_create(
+            User(email=f'bulk{i}@example.com', username=f'bulk{i}') for i in range(cls.count)
+        )
+        end_date = timezone.now() + timedelta(days=3)
+        Subscription.objects.bulk_create(
+            Subscription(
+                user=user, plan=plan, status='active', auto_renew=False,
+                start_date=timezone.now(), end_date=end_date
+            )
+            for user in users
+        )
+
+    def setUp(self):
+        FlakyEmailBackend.failing_recipients = set()
+        FlakyEmailBackend.opened = 0
+
+    def test_sends_all_reminders_through_one_connection(self):
+        result = ExpiryReminderMailer().send()
+
+        self.assertEqual((result['reminders_sent'], result['reminders_failed']), (self.count, 0))
+        self.assertEqual(len(mail.outbox), self.count)
+        self.assertEqual(len({message.to[0] for message in mail.outbox}), self.count)
+        self.assertEqual(FlakyEmailBackend.opened, 1)
+        self.assertFalse(Subscription.objects.filter(reminder_sent_for__isnull=True).exists())
+
+        # Повторный запуск ничего не отправляет
+        self.assertEqual(ExpiryReminderMailer().send()['reminders_sent'], 0)
+        self.assertEqual(len(mail.outbox), self.count)
+        self.assertEqual(FlakyEmailBackend.opened, 2)
+
+@override_settings(CACHE_IS_SHARED=True)
+class PinEntitlementsTests(TestCase):
+    """Проверки возможности закрепления: запросы к БД и кеш возможностей"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = SubscriptionPlan.objects.create(name='Plan', price=10, stripe_price_id='price_1')
+        cls.category = Category.objects.create(name='News')
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def create_author(self, username, subscribed=True):
+        if subscribed:
+            user = create_subscriber(username, self.plan)
+        else:
+            user = User.objects.create(email=f'{username}@example.com', username=username)
+        post = Post.objects.create(
+            title=username, slug=username, content='text', author=user,
+            category=self.category, status='published'
+        )
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {UserClaimsRefreshToken.for_user(user).access_token}'
+        )
+        return user, post, client
+
+    def request(self, method, client, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300, response.data)
+        return response, [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+
+    def test_pin_flow_query_count(self):
+        user, post, client = self.create_author('author')
+
+        # Признаки доступа, пост и подписка с планом
+        response, queries = self.request('get', client, f'/api/v1/subscribe/can-pin/{post.pk}/')
+        self.assertTrue(response.data['can_pin'])
+        self.assertEqual(len(queries), 3)
+
+        # Признаки и возможности - из кеша, остается только пост
+        _, queries = self.request('get', client, f'/api/v1/subscribe/can-pin/{post.pk}/')
+        self.assertEqual(len(queries), 1)
+
+        # Сериализатор и view проверяют возможность без запросов к подпискам;
+        # запись в историю - ID подписки и INSERT
+        _, queries = self.request('post', client, '/api/v1/subscribe/pin-post/', {'post_id': post.pk})
+        self.assertEqual(len(queries), 7)
+        subscription_queries = [sql for sql in queries if 'FROM "subscriptions"' in sql]
+        self.assertEqual(len(subscription_queries), 1)
+        self.assertTrue(subscription_queries[0].startswith('SELECT "subscriptions"."id" AS "pk" FROM'))
+        self.assertTrue(PinnedPost.objects.filter(user=user, post=post).exists())
+
+        self.request('post', client, '/api/v1/subscribe/unpin-post/')
+        self.assertEqual(
+            list(SubscriptionHistory.objects.filter(
+                action__in=['post_pinned', 'post_unpinned']
+            ).order_by('id').values_list('action', 'metadata')),
+            [('post_pinned', {'post_id': post.pk, 'post_title': 'author'}),
+             ('post_unpinned', {'post_id': post.pk, 'post_title': 'author'})]
+        )
+
+    def test_subscription_activated_elsewhere_is_seen_immediately(self):
+        user, post, client = self.create_author('buyer', subscribed=False)
+
+        response, _ = self.request('get', client, f'/api/v1/subscribe/can-pin/{post.pk}/')
+        self.assertFalse(response.data['can_pin'])
+
+        # Подписку активировал другой процесс (webhook в Celery): сброс кеша сюда не дошел
+        Subscription.objects.bulk_create([Subscription(
+            user=user, plan=self.plan, status='active',
+            start_date=timezone.now(), end_date=timezone.now() + timedelta(days=30)
+        )])
+
+        response, queries = self.request('get', client, f'/api/v1/subscribe/can-pin/{post.pk}/')
+        self.assertTrue(response.data['can_pin'])
+        self.assertTrue(any('FROM "subscriptions"' in sql for sql in queries))
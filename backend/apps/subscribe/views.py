@@ -3,8 +3,8 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from django.db import transaction
-from django.utils import timezone
 
+from .entitlements import get_entitlements, has_entitlement
 from .models import SubscriptionPlan, Subscription, PinnedPost, SubscriptionHistory
 from .serializers import (
     SubscriptionPlanSerializer,
@@ -17,6 +17,8 @@ from .serializers import (
     UnpinPostSerializer
 )
 from apps.main.models import Post
+from apps.main.feed import PostFeed
+from apps.main.cache import POST_LIST_DEPENDENCIES, cache_response
 
 
 class SubscriptionPlanListView(generics.ListAPIView):
@@ -97,7 +99,7 @@ class PinnedPostView(generics.RetrieveUpdateDestroyAPIView):
     def update(self, request, *args, **kwargs):
         """Обновляет закрепленный пост"""
         # Проверяем подписку
-        if not hasattr(request.user, 'subscription') or not request.user.subscription.is_active:
+        if not has_entitlement(request.user, 'pin_posts'):
             return Response({
                 'error': 'Active subscription required to pin posts'
             }, status=status.HTTP_403_FORBIDDEN)
@@ -138,13 +140,13 @@ def pin_post(request):
                 post = get_object_or_404(Post, id=post_id, status='published')
 
                 # проверяем права
-                if post.author != request.user:
+                if post.author_id != request.user.pk:
                     return Response({
                         'error': 'You can only pin your own posts'
                     }, status=status.HTTP_403_FORBIDDEN)
 
                 # проверяем подписку
-                if not hasattr(request.user, 'subscription') or not request.user.subscription.is_active:
+                if not has_entitlement(request.user, 'pin_posts'):
                     return Response({
                         'error': 'Active subscription required to pin posts'
                     }, status=status.HTTP_403_FORBIDDEN)
@@ -230,21 +232,15 @@ def cancel_subscription(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@cache_response('pinned_posts_list', POST_LIST_DEPENDENCIES)
 def pinned_posts_list(request):
     """Возвращает список всех закрепленных постов для отображения в топе"""
     # Получаем только закрепленные посты пользователей с активной подпиской
-    pinned_posts = PinnedPost.objects.select_related(
-        'post', 'post__author', 'post__category', 'user__subscription'
-    ).filter(
-        user__subscription__status='active',
-        user__subscription__end_date__gt=timezone.now(),
-        post__status='published'
-    ).order_by('pinned_at')
+    pinned_posts = PostFeed().pinned()
 
     # Формируем ответ с информацией о посте
     posts_data = []
-    for pinned_post in pinned_posts:
-        post = pinned_post.post
+    for post in pinned_posts:
         posts_data.append({
             'id': post.id,
             'title': post.title,
@@ -260,12 +256,12 @@ def pinned_posts_list(request):
             'views_count': post.views_count,
             'comments_count': post.comments_count,
             'created_at': post.created_at,
-            'pinned_at': pinned_post.pinned_at,
+            'pinned_at': post.pin_info.pinned_at,
             'is_pinned': True
         })
 
     return Response({
-        'count': int(posts_data),
+        'count': len(posts_data),
         'results': posts_data,
     })
 
@@ -277,22 +273,20 @@ def can_pin_post(request, post_id):
     try:
         post = get_object_or_404(Post, id=post_id, status='published')
 
+        entitlements = get_entitlements(request.user)
+
         # Проверки
         checks = {
             'post_exists': True,
-            'is_own_post': post.author == request.user,
-            'has_subscription': hasattr(request.user, 'subscription'),
-            'subscription_active': False,
+            'is_own_post': post.author_id == request.user.pk,
+            'has_subscription': entitlements.has_subscription,
+            'subscription_active': entitlements.is_active,
             'can_pin': False
         }
 
-        if checks['has_subscription']:
-            checks['subscription_active'] = request.user.subscription.is_active
-
         checks['can_pin'] = (
                 checks['is_own_post'] and
-                checks['has_subscription'] and
-                checks['subscription_active']
+                entitlements.allows('pin_posts')
         )
 
         return Response({
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 from decouple import config
 
@@ -31,6 +32,7 @@ DJANGO_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 
 THIRD_PARTY_APPS = [
@@ -84,6 +86,27 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# Соединения с БД.
+# Переиспользование: соединение живет DB_CONN_MAX_AGE секунд (0 - закрывается
+# после каждого запроса/задачи) и проверяется перед повторным использованием.
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+DB_CONN_HEALTH_CHECKS = config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool)
+
+# Пул соединений в каждом процессе (драйвер psycopg 3 с psycopg-pool, см. requirements.txt).
+# Размер пула по умолчанию делит бюджет соединений DB_MAX_CONNECTIONS между
+# процессами: воркерами gunicorn, процессами Celery worker и Celery beat.
+DB_POOL = config('DB_POOL', default=False, cast=bool)
+WEB_CONCURRENCY = config('WEB_CONCURRENCY', default=3, cast=int)
+CELERY_WORKER_CONCURRENCY = config('CELERY_WORKER_CONCURRENCY', default=os.cpu_count() or 1, cast=int)
+DB_MAX_CONNECTIONS = config('DB_MAX_CONNECTIONS', default=80, cast=int)
+DB_POOL_MIN_SIZE = config('DB_POOL_MIN_SIZE', default=1, cast=int)
+DB_POOL_MAX_SIZE = config(
+    'DB_POOL_MAX_SIZE',
+    default=max(2, DB_MAX_CONNECTIONS // (WEB_CONCURRENCY + CELERY_WORKER_CONCURRENCY + 1)),
+    cast=int
+)
+DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', default=10, cast=int)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -93,8 +116,19 @@ DATABASES = {
         'HOST': config('DB_HOST', default='localhost'),
         'PORT': config('DB_PORT', default='5432', cast=int),
         'ATOMIC_REQUESTS': True,
+        # С пулом соединения возвращаются в пул, постоянные соединения не нужны
+        'CONN_MAX_AGE': 0 if DB_POOL else DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': DB_CONN_HEALTH_CHECKS,
     }
 }
+if DB_POOL:
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': DB_POOL_TIMEOUT,
+        }
+    }
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -149,12 +183,12 @@ AUTH_USER_MODEL = 'accounts.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'apps.accounts.authentication.ClaimsJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'apps.main.pagination.FlexiblePagination',
     'PAGE_SIZE': 20,
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -182,7 +216,8 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
-    'UPDATE_LAST_LOGIN': True,
+    # last_login обновляет django.contrib.auth.login во LoginView, повторная запись не нужна
+    'UPDATE_LAST_LOGIN': False,
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY,
     'VERIFYING_KEY': None,
@@ -190,8 +225,14 @@ SIMPLE_JWT = {
     'AUTH_HEADER_NAME': 'HTTP_AUTHORIZATION',
     'USER_ID_FIELD': 'id',
     'USER_ID_CLAIM': 'user_id',
+    'TOKEN_REFRESH_SERIALIZER': 'apps.accounts.tokens.UserClaimsTokenRefreshSerializer',
 }
 
+# Кеш признаков доступа пользователей для JWT аутентификации (apps.accounts.authentication), секунды.
+# Используется только с общим кешем (CACHE_IS_SHARED), иначе признаки читаются из БД
+AUTH_USER_FLAGS_CACHE_ALIAS = 'default'
+AUTH_USER_FLAGS_CACHE_TIMEOUT = config('AUTH_USER_FLAGS_CACHE_TIMEOUT', default=300, cast=int)
+
 
 
 # Security Settings
@@ -249,6 +290,11 @@ LOGGING = {
     },
 }
 
+# Тесты (manage.py test) не пишут в logs/django.log
+TESTING = sys.argv[1:2] == ['test']
+if TESTING:
+    LOGGING['handlers']['file'] = {'class': 'logging.NullHandler'}
+
 # Создаем директорию для логов
 import os
 os.makedirs(BASE_DIR / 'logs', exist_ok=True)
@@ -260,6 +306,30 @@ FRONTEND_URL = config('FRONTEND_URL', default='http://localhost:5173')
 STRIPE_PUBLISHABLE_KEY = config('STRIPE_PUBLISHABLE_KEY', default='')
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY', default='')
 STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET', default='')
+# Быстрый ответ на webhook: событие сохраняется и обрабатывается в Celery
+STRIPE_WEBHOOK_ASYNC = config('STRIPE_WEBHOOK_ASYNC', default=False, cast=bool)
+# Клиент Stripe (apps.payment.stripe_client): таймауты в секундах, повторы, пул и circuit breaker
+STRIPE_CONNECT_TIMEOUT = config('STRIPE_CONNECT_TIMEOUT', default=3, cast=float)
+STRIPE_READ_TIMEOUT = config('STRIPE_READ_TIMEOUT', default=10, cast=float)
+STRIPE_WRITE_TIMEOUT = config('STRIPE_WRITE_TIMEOUT', default=20, cast=float)
+STRIPE_MAX_NETWORK_RETRIES = config('STRIPE_MAX_NETWORK_RETRIES', default=2, cast=int)
+STRIPE_POOL_SIZE = config('STRIPE_POOL_SIZE', default=10, cast=int)
+STRIPE_CIRCUIT_FAILURE_THRESHOLD = config('STRIPE_CIRCUIT_FAILURE_THRESHOLD', default=5, cast=int)
+STRIPE_CIRCUIT_RESET_TIMEOUT = config('STRIPE_CIRCUIT_RESET_TIMEOUT', default=30, cast=int)
+# Адрес API Stripe (например, локальный сервер-заглушка для проверки отказов)
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='') or None
+# Через сколько минут платеж checkout без сессии Stripe считается осиротевшим
+STRIPE_CHECKOUT_ORPHAN_MINUTES = config('STRIPE_CHECKOUT_ORPHAN_MINUTES', default=15, cast=int)
+# Заглушка Stripe в памяти (apps.payment.stripe_fake) для проверки без сети
+STRIPE_FAKE_CLIENT = config('STRIPE_FAKE_CLIENT', default=False, cast=bool)
+# За сколько последних дней ночная задача пересчитывает сводки платежей (apps.payment.rollups)
+PAYMENT_ROLLUP_COMPACT_DAYS = config('PAYMENT_ROLLUP_COMPACT_DAYS', default=3, cast=int)
+# Время аренды webhook события воркером; по истечении событие может захватить другой
+WEBHOOK_EVENT_LEASE_SECONDS = config('WEBHOOK_EVENT_LEASE_SECONDS', default=300, cast=int)
+# Повторы неудачных webhook событий: экспоненциальная задержка с разбросом, затем dead
+WEBHOOK_RETRY_MAX_ATTEMPTS = config('WEBHOOK_RETRY_MAX_ATTEMPTS', default=8, cast=int)
+WEBHOOK_RETRY_BASE_DELAY = config('WEBHOOK_RETRY_BASE_DELAY', default=60, cast=int)
+WEBHOOK_RETRY_MAX_DELAY = config('WEBHOOK_RETRY_MAX_DELAY', default=6 * 3600, cast=int)
 
 # Email настройки (для уведомлений)
 EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
@@ -278,8 +348,54 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_ACCEPT_CONTENT = ['json']
 
+# Кеш (по умолчанию в памяти процесса; для общего кеша между воркерами -
+# django.core.cache.backends.redis.RedisCache с CACHE_LOCATION=redis://...,
+# так настроен docker-compose)
+CACHE_BACKEND = config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+CACHE_IS_SHARED = CACHE_BACKEND not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Кеш ответов публичных эндпоинтов для анонимных пользователей (apps.main.cache).
+# Кеш в памяти процесса не получает инвалидаций из других воркеров и Celery,
+# поэтому с ним ответы хранятся всего несколько секунд
+RESPONSE_CACHE_ENABLED = config('RESPONSE_CACHE_ENABLED', default=True, cast=bool)
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = config('RESPONSE_CACHE_TIMEOUT', default=60 if CACHE_IS_SHARED else 5, cast=int)
+
+# Кеш возможностей активных подписок (apps.subscribe.entitlements), секунды.
+# Отмена подписки в другом процессе не сбрасывает кеш в памяти процесса, поэтому с ним TTL короткий
+ENTITLEMENTS_CACHE_ALIAS = 'default'
+ENTITLEMENTS_CACHE_TIMEOUT = config('ENTITLEMENTS_CACHE_TIMEOUT', default=300 if CACHE_IS_SHARED else 30, cast=int)
+
+# Буферизированный счетчик просмотров постов: 'local' (в памяти процесса) или 'redis'
+VIEW_COUNTER_BACKEND = config('VIEW_COUNTER_BACKEND', default='local')
+VIEW_COUNTER_REDIS_URL = config('VIEW_COUNTER_REDIS_URL', default=CELERY_BROKER_URL)
+VIEW_COUNTER_FLUSH_INTERVAL = config('VIEW_COUNTER_FLUSH_INTERVAL', default=60, cast=int)
+
+# Размер порции при пакетном истечении подписок (apps.subscribe.expiry)
+SUBSCRIPTION_EXPIRY_CHUNK_SIZE = config('SUBSCRIPTION_EXPIRY_CHUNK_SIZE', default=1000, cast=int)
+
+# Рассылка напоминаний об истечении подписки: размер пачки и лимит писем в секунду (0 - без лимита)
+SUBSCRIPTION_REMINDER_BATCH_SIZE = config('SUBSCRIPTION_REMINDER_BATCH_SIZE', default=500, cast=int)
+SUBSCRIPTION_REMINDER_RATE_LIMIT = config('SUBSCRIPTION_REMINDER_RATE_LIMIT', default=0, cast=float)
+
+# Конфигурация полнотекстового поиска PostgreSQL для постов
+POST_SEARCH_CONFIG = config('POST_SEARCH_CONFIG', default='english')
+
 # Celery Beat настройки для периодических задач
 CELERY_BEAT_SCHEDULE = {
+    'flush-post-views': {
+        'task': 'apps.main.tasks.flush_post_views',
+        'schedule': float(VIEW_COUNTER_FLUSH_INTERVAL),
+    },
     'check-expired-subscriptions': {
         'task': 'apps.subscribe.tasks.check_expired_subscriptions',
         'schedule': 3600.0,  # Каждый час
@@ -296,8 +412,20 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'apps.payment.tasks.cleanup_old_webhook_events',
         'schedule': 86400.0,  # Каждый день
     },
+    'process-pending-webhook-events': {
+        'task': 'apps.payment.tasks.process_pending_webhook_events',
+        'schedule': 300.0,  # Каждые 5 минут
+    },
+    'reconcile-stripe-payments': {
+        'task': 'apps.payment.tasks.reconcile_stripe_payments',
+        'schedule': 120.0,  # Каждые 2 минуты
+    },
     'retry-failed-webhook-events': {
         'task': 'apps.payment.tasks.retry_failed_webhook_events',
-        'schedule': 3600.0,  # Каждый час
+        'schedule': 60.0,  # Каждую минуту (события повторяются по своему расписанию)
+    },
+    'compact-payment-rollups': {
+        'task': 'apps.payment.tasks.compact_payment_rollups',
+        'schedule': 86400.0,  # Каждый день
     },
 }
\ No newline at end of file